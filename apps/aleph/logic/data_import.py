@@ -1,8 +1,12 @@
+import hashlib
+import json
 import re
 import xml.etree.ElementTree as ET
 import logging
+from typing import Iterator
 
 from django.conf import settings
+from django.utils import timezone
 
 from ..models import AlephEntry
 
@@ -26,7 +30,9 @@ def aleph_xml_to_json(filename: str) -> list:
 def import_aleph_xml(filename: str) -> (AlephEntry, bool):
     data = aleph_xml_to_json(filename)
     uid = filename_to_uid(filename)
-    return AlephEntry.objects.update_or_create(defaults={'raw_data': data}, uid=uid)
+    return AlephEntry.objects.update_or_create(
+        defaults={'raw_data': data, 'content_hash': content_hash(data)}, uid=uid
+    )
 
 
 def filename_to_uid(filename) -> str:
@@ -46,18 +52,22 @@ def import_aleph_marc_xml(filename: str) -> (AlephEntry, int):
     # as the data is the same and updating all records is very slow.
     # This is why we now rather test for existence and equality - it is worse in worst case,
     # but much better in common cases
+    # The content is compared using `content_hash`, so `raw_data` need not be loaded at all.
     data = aleph_marc_xml_to_dict(filename)
+    data_hash = content_hash(data)
     uid = filename_to_uid(filename)
     try:
-        rec = AlephEntry.objects.get(uid=uid)
+        rec = AlephEntry.objects.defer('raw_data').get(uid=uid)
     except AlephEntry.DoesNotExist:
-        return AlephEntry.objects.create(raw_data=data, uid=uid), 1
-    if rec.raw_data != data:
+        return AlephEntry.objects.create(raw_data=data, uid=uid, content_hash=data_hash), 1
+    if rec.content_hash != data_hash:
         rec.raw_data = data
+        rec.content_hash = data_hash
         rec.save()
         return rec, 2
     else:
-        rec.save()  # save to update `last_updated`
+        # update `last_updated` to mark the record as seen
+        AlephEntry.objects.filter(uid=uid).update(last_updated=timezone.now())
         return rec, 0
 
 
@@ -89,30 +99,64 @@ def aleph_marc_xml_to_dict(filename: str) -> dict:
     root = et.getroot()
     ret = {}
     for el in root:
-        tag_name = el.tag
-        if "}" in tag_name:  # remove namespace
-            tag_name = tag_name.split("}")[1]
-        if tag_name == 'controlfield' and el.attrib.get('tag') == '008':
-            ret['lang'] = el.text[35:38].strip()
-            ret['catalog_date'] = el.text[0:6]
-        elif tag_name == 'datafield':
-            tag_num = el.attrib.get('tag')
-            if tag_num in MARC_TAGS_OF_INTEREST:
-                json_field = MARC_TAGS_OF_INTEREST[tag_num]
-                if json_field not in ret:
-                    ret[json_field] = []
-                subfields = {fix_code(sf.attrib.get('code', '')): sf.text for sf in el}
-                ret[json_field].append(subfields)
-            if tag_num in settings.EXTRA_ALEPH_FIELDS:
-                ret['_extra'] = ret.get('_extra', {})
-                if tag_num not in ret['_extra']:
-                    ret['_extra'][tag_num] = []
-                ret['_extra'][tag_num].append(
-                    {fix_code(sf.attrib.get('code', '')): sf.text for sf in el}
-                )
+        _add_marc_field(ret, _local_name(el.tag), el)
     return ret
 
 
+def iter_marc_xml_records(source) -> Iterator[dict]:
+    """
+    Reads MARC records from `source` (file name or file object) containing either one record
+    or a collection of them. It uses `iterparse` and drops the already processed elements,
+    so that the whole document is never kept in memory.
+    """
+    ret = {}
+    for _event, el in ET.iterparse(source):
+        tag_name = _local_name(el.tag)
+        if tag_name in ('controlfield', 'datafield'):
+            _add_marc_field(ret, tag_name, el)
+            el.clear()
+        elif tag_name == 'record':
+            yield ret
+            ret = {}
+            el.clear()
+
+
+def _local_name(tag_name: str) -> str:
+    if "}" in tag_name:  # remove namespace
+        return tag_name.split("}")[1]
+    return tag_name
+
+
+def _add_marc_field(ret: dict, tag_name: str, el: ET.Element) -> None:
+    if tag_name == 'controlfield' and el.attrib.get('tag') == '008':
+        ret['lang'] = el.text[35:38].strip()
+        ret['catalog_date'] = el.text[0:6]
+    elif tag_name == 'datafield':
+        tag_num = el.attrib.get('tag')
+        if tag_num in MARC_TAGS_OF_INTEREST:
+            json_field = MARC_TAGS_OF_INTEREST[tag_num]
+            if json_field not in ret:
+                ret[json_field] = []
+            subfields = {fix_code(sf.attrib.get('code', '')): sf.text for sf in el}
+            ret[json_field].append(subfields)
+        if tag_num in settings.EXTRA_ALEPH_FIELDS:
+            ret['_extra'] = ret.get('_extra', {})
+            if tag_num not in ret['_extra']:
+                ret['_extra'][tag_num] = []
+            ret['_extra'][tag_num].append(
+                {fix_code(sf.attrib.get('code', '')): sf.text for sf in el}
+            )
+
+
+def content_hash(data) -> str:
+    """
+    Hash of JSON serializable `data` which does not depend on the order of keys
+    """
+    return hashlib.md5(
+        json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
 def fix_code(code: str) -> str:
     code = code.strip()
     if not code:
@@ -0,0 +1,199 @@
+"""
+Bulk import of Aleph MARC XML records.
+
+The records are read either from a directory with one file per record or directly from a tar
+archive of such files (optionally compressed by gzip or zstd). The XML is parsed in a pool of
+worker processes and the resulting data are compared with the `content_hash` of existing
+entries, so that full `raw_data` does not have to be loaded from the database. Changed entries
+are written in batches.
+"""
+
+import io
+import logging
+import os
+import tarfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+from xml.etree.ElementTree import ParseError
+
+import zstandard
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from ..models import AlephEntry
+from .data_import import FILENAME_MATCHER, content_hash, filename_to_uid, iter_marc_xml_records
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# (uid, modification time, XML content)
+SourceRecord = Tuple[str, float, bytes]
+# (uid, data, hash of data) - data and hash are None if the XML could not be parsed
+ParsedRecord = Tuple[str, Optional[dict], Optional[str]]
+
+
+def iter_directory(path: Path) -> Iterator[Tuple[str, float, Path]]:
+    for file_path in path.iterdir():
+        if FILENAME_MATCHER.search(file_path.name):
+            yield filename_to_uid(file_path.name), file_path.stat().st_mtime, file_path
+        else:
+            logger.warning('Skipping file without Aleph ID: %s', file_path)
+
+
+def iter_archive(path: Path) -> Iterator[SourceRecord]:
+    """
+    Reads records from a tar archive. Archives compressed by zstd (`.zst` or `.zstd` suffix)
+    are decompressed on the fly, other compression methods are handled by `tarfile`.
+    """
+    with open(path, 'rb') as infile:
+        if path.suffix in ('.zst', '.zstd'):
+            stream = zstandard.ZstdDecompressor().stream_reader(infile)
+            archive = tarfile.open(fileobj=stream, mode='r|')
+        else:
+            archive = tarfile.open(fileobj=infile, mode='r|*')
+        with archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                # only the file name is used, directories may contain digits as well
+                name = os.path.basename(member.name)
+                if not FILENAME_MATCHER.search(name):
+                    logger.warning('Skipping file without Aleph ID: %s', member.name)
+                    continue
+                yield filename_to_uid(name), member.mtime, archive.extractfile(member).read()
+
+
+def parse_records(records: List[Tuple[str, bytes]]) -> List[ParsedRecord]:
+    """
+    Converts XML of records into data for `AlephEntry.raw_data`. Runs in worker processes.
+    """
+    result = []
+    for uid, content in records:
+        try:
+            data = next(iter_marc_xml_records(io.BytesIO(content)), {})
+        except ParseError as exc:
+            logger.error('Error parsing record "%s": %s', uid, exc)
+            result.append((uid, None, None))
+        else:
+            result.append((uid, data, content_hash(data)))
+    return result
+
+
+class AlephEntryWriter:
+    """
+    Writes parsed records into the database in batches. Entries whose content did not change
+    only get their `last_updated` bumped to mark them as seen.
+    """
+
+    def __init__(self, known: dict, use_transactions: bool = True):
+        """
+        :param known: uid -> content_hash of existing entries
+        """
+        self.known = known
+        self.use_transactions = use_transactions
+        self.stats = Counter()
+
+    def write(self, records: List[ParsedRecord]) -> None:
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        unchanged = []
+        # the same record may be present more than once, the last one wins
+        for uid, (data, data_hash) in {uid: rest for uid, *rest in records}.items():
+            if data is None:
+                self.stats['xml_error'] += 1
+                continue
+            old_hash = self.known.get(uid)
+            entry = AlephEntry(
+                uid=uid, raw_data=data, content_hash=data_hash, created=now, last_updated=now
+            )
+            if old_hash is None:
+                to_create.append(entry)
+            elif old_hash != data_hash:
+                to_update.append(entry)
+            else:
+                unchanged.append(uid)
+            self.known[uid] = data_hash
+        if self.use_transactions:
+            with atomic():
+                self._write(to_create, to_update, unchanged, now)
+        else:
+            self._write(to_create, to_update, unchanged, now)
+        self.stats.update(
+            {'created': len(to_create), 'updated': len(to_update), 'no change': len(unchanged)}
+        )
+        self.stats = +self.stats
+
+    @classmethod
+    def _write(cls, to_create, to_update, unchanged, now: datetime) -> None:
+        AlephEntry.objects.bulk_create(to_create)
+        AlephEntry.objects.bulk_update(to_update, ['raw_data', 'content_hash', 'last_updated'])
+        if unchanged:
+            AlephEntry.objects.filter(uid__in=unchanged).update(last_updated=now)
+
+
+def _batches(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def import_marc_xml_records(
+    path: Path,
+    process_all: bool = False,
+    jobs: int = 1,
+    use_transactions: bool = True,
+    batch_size: int = BATCH_SIZE,
+) -> Tuple[Counter, Set[str]]:
+    """
+    Imports MARC XML records from `path` - a directory with one file per record or a tar
+    archive of such files. Unless `process_all` is given, only records whose file is newer
+    than the corresponding entry are processed.
+
+    :return: stats and the set of uids of all records found in `path`
+    """
+    known = {}
+    uid_to_mod_time = {}
+    for uid, last_updated, entry_hash in AlephEntry.objects.values_list(
+        'uid', 'last_updated', 'content_hash'
+    ).iterator(chunk_size=10_000):
+        known[uid] = entry_hash
+        uid_to_mod_time[uid] = last_updated.timestamp()
+    writer = AlephEntryWriter(known, use_transactions=use_transactions)
+    seen_uids = set()
+
+    def to_process():
+        if path.is_file():
+            records = iter_archive(path)
+        else:
+            records = iter_directory(path)
+        for uid, mtime, content in records:
+            seen_uids.add(uid)
+            mod_time = uid_to_mod_time.get(uid)
+            if process_all or not mod_time or mod_time < mtime:
+                yield uid, content.read_bytes() if isinstance(content, Path) else content
+            else:
+                writer.stats['skipped'] += 1
+
+    batches = _batches(to_process(), batch_size)
+    if jobs <= 1:
+        for batch in batches:
+            writer.write(parse_records(batch))
+            logger.debug('Stats: %s', writer.stats)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # map would read the whole input ahead, so we keep only a few batches in flight
+            pending = deque()
+            for batch in batches:
+                pending.append(executor.submit(parse_records, batch))
+                if len(pending) >= 2 * jobs:
+                    writer.write(pending.popleft().result())
+                    logger.debug('Stats: %s', writer.stats)
+            while pending:
+                writer.write(pending.popleft().result())
+    return writer.stats, seen_uids
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('aleph', '0002_json_field_migration')]
+
+    operations = [
+        migrations.AddField(
+            model_name='alephentry',
+            name='content_hash',
+            field=models.CharField(
+                blank=True,
+                default='',
+                help_text='Hash of `raw_data` used to detect changes on import, empty if not known',
+                max_length=32,
+            ),
+        )
+    ]
@@ -8,6 +8,12 @@ class AlephEntry(CreatedUpdatedMixin, models.Model):
 
     uid = models.SlugField(max_length=16, primary_key=True)
     raw_data = JSONField(default=list)
+    content_hash = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        help_text='Hash of `raw_data` used to detect changes on import, empty if not known',
+    )
 
     def __str__(self):
         return "AlephEntry: {}".format(self.uid)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from .logic.data_import import content_hash
 from .models import AlephEntry
 
 
@@ -7,3 +8,9 @@ class AlephEntrySerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = AlephEntry
         fields = ('uid', 'raw_data')
+
+    def validate(self, attrs):
+        # the hash is used to skip unchanged entries, so it must follow the data
+        if 'raw_data' in attrs:
+            attrs['content_hash'] = content_hash(attrs['raw_data'])
+        return attrs
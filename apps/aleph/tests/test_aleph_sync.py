@@ -1,7 +1,17 @@
+import io
+import tarfile
+from pathlib import Path
+
 import pytest
+import zstandard
 from django.core.management import call_command
 
+from aleph.logic.data_import import aleph_marc_xml_to_dict, content_hash, iter_marc_xml_records
+from aleph.logic.marc_import import import_marc_xml_records
 from aleph.models import AlephEntry
+from aleph.serializers import AlephEntrySerializer
+
+DATA_DIR = 'apps/aleph/tests/data'
 
 
 @pytest.mark.django_db
@@ -28,3 +38,46 @@ class TestAlephSync:
                 assert field.strip() in entry.raw_data['_extra']
         else:
             assert '_extra' not in entry.raw_data
+
+    def test_iterparse_reader(self):
+        for file_path in Path(DATA_DIR).iterdir():
+            records = list(iter_marc_xml_records(str(file_path)))
+            assert records == [aleph_marc_xml_to_dict(str(file_path))]
+
+    @pytest.mark.parametrize('suffix', ['.tar', '.tar.gz', '.tar.zst'])
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_archive_import(self, tmp_path, suffix, jobs):
+        archive = tmp_path / f'dump{suffix}'
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz' if suffix == '.tar.gz' else 'w') as tar:
+            # digits in the directory name must not be taken for the Aleph ID
+            tar.add(DATA_DIR, arcname='dump_20241018123')
+        content = buffer.getvalue()
+        if suffix == '.tar.zst':
+            content = zstandard.ZstdCompressor().compress(content)
+        archive.write_bytes(content)
+        call_command('import_aleph_marc_xml', '-j', str(jobs), str(archive))
+        assert AlephEntry.objects.count() == 2
+        entry = AlephEntry.objects.get(uid='000010000')
+        assert entry.raw_data == aleph_marc_xml_to_dict(f'{DATA_DIR}/file-000010000.marc21.xml')
+        assert entry.content_hash == content_hash(entry.raw_data)
+
+    def test_change_detection(self):
+        stats, _uids = import_marc_xml_records(Path(DATA_DIR))
+        assert stats == {'created': 2}
+        AlephEntry.objects.filter(uid='000000002').update(content_hash='')
+        stats, uids = import_marc_xml_records(Path(DATA_DIR), process_all=True)
+        assert stats == {'updated': 1, 'no change': 1}
+        assert uids == {'000000002', '000010000'}
+        stats, _uids = import_marc_xml_records(Path(DATA_DIR))
+        assert stats == {'skipped': 2}, 'files are older than the entries'
+
+    def test_serializer_updates_content_hash(self):
+        entry = AlephEntry.objects.create(
+            uid='000000003', raw_data={'title': 'Foo'}, content_hash=content_hash({'title': 'Foo'})
+        )
+        serializer = AlephEntrySerializer(entry, data={'raw_data': {'title': 'Bar'}}, partial=True)
+        assert serializer.is_valid()
+        serializer.save()
+        entry.refresh_from_db()
+        assert entry.content_hash == content_hash({'title': 'Bar'})
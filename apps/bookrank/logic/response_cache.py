@@ -0,0 +1,148 @@
+"""
+Server side cache of responses of the read-only analytics endpoints.
+
+Cached responses are stored in the default (Redis) cache under a key which contains the
+`data_generation` of the workset the response is computed from. Whenever data which the
+responses are based on change (hits are loaded, works or candidates are synced, scores or
+growth fields are recomputed, topics are extracted), `bump_data_generation` is called and
+responses cached for the older generation are never used again - there is no need to guess
+how long a response may be cached.
+"""
+
+import hashlib
+import logging
+from functools import wraps
+from typing import Callable, Optional, Union
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.db.models import F, QuerySet
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from ..models import Work, WorkSet
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'analytics'
+
+
+def bump_data_generation(work_set: Union[WorkSet, int]) -> None:
+    """
+    Invalidates all cached responses computed from the data of `work_set`
+    """
+    pk = work_set.pk if isinstance(work_set, WorkSet) else work_set
+    WorkSet.objects.filter(pk=pk).update(data_generation=F('data_generation') + 1)
+
+
+def workset_generation_token(workset_uuid) -> Optional[str]:
+    """
+    Returns a string identifying the current state of data of the workset or None if the
+    workset does not exist
+    """
+    try:
+        generation = (
+            WorkSet.objects.filter(uuid=workset_uuid)
+            .values_list('data_generation', flat=True)
+            .first()
+        )
+    except ValidationError:
+        return None
+    if generation is None:
+        return None
+    return f'{workset_uuid}-{generation}'
+
+
+def work_generation_token(work_id) -> Optional[str]:
+    """
+    Same as `workset_generation_token` for the workset the work belongs to
+    """
+    try:
+        row = (
+            Work.objects.filter(pk=work_id)
+            .values_list('work_set__uuid', 'work_set__data_generation')
+            .first()
+        )
+    except (ValueError, TypeError):
+        return None
+    if row is None:
+        return None
+    return f'{row[0]}-{row[1]}'
+
+
+def global_generation_token() -> str:
+    """
+    Token for responses computed from the data of all worksets
+    """
+    rows = WorkSet.objects.order_by('uuid').values_list('uuid', 'data_generation')
+    return hashlib.md5(str(list(rows)).encode('utf-8')).hexdigest()
+
+
+def _params_digest(request, kwargs: dict) -> str:
+    params = sorted(
+        (key, sorted(values)) for key, values in request.query_params.lists() if key != 'format'
+    )
+    data = repr((sorted((key, str(value)) for key, value in kwargs.items()), params))
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def cache_key(view_name: str, token: str, request, kwargs: dict) -> str:
+    return f'{KEY_PREFIX}:{view_name}:{token}:{_params_digest(request, kwargs)}'
+
+
+def _evaluated(data):
+    """
+    Replaces querysets in response data by lists, so that only the results get pickled
+    """
+    if isinstance(data, QuerySet):
+        return list(data)
+    if isinstance(data, dict):
+        return {key: _evaluated(value) for key, value in data.items()}
+    return data
+
+
+def cached_analytics_response(
+    scope: str = 'workset', cache_if: Optional[Callable[[Request], bool]] = None
+):
+    """
+    Decorator of `get` (or action) methods of DRF views which caches the response data.
+
+    :param scope: what data the response is computed from - `workset` (the `workset_uuid` or
+                  `workset_pk` url kwarg), `work` (the `work_id` url kwarg) or `global`
+    :param cache_if: if given, only requests for which it returns True are cached - used for
+                     responses which may depend on data not covered by the data generation
+    """
+
+    def decorator(method):
+        view_name = method.__qualname__
+
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            if not settings.ANALYTICS_CACHE_ENABLED or (cache_if and not cache_if(request)):
+                return method(self, request, *args, **kwargs)
+            if scope == 'workset':
+                token = workset_generation_token(
+                    kwargs.get('workset_uuid') or kwargs.get('workset_pk')
+                )
+            elif scope == 'work':
+                token = work_generation_token(kwargs.get('work_id'))
+            else:
+                token = global_generation_token()
+            if token is None:
+                # nonexistent object - let the view deal with it
+                return method(self, request, *args, **kwargs)
+            key = cache_key(view_name, token, request, kwargs)
+            data = cache.get(key)
+            if data is not None:
+                logger.debug('Cache hit for %s', key)
+                return Response(data)
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, _evaluated(response.data), settings.ANALYTICS_CACHE_TIMEOUT)
+            return response
+
+        return wrapper
+
+    return decorator
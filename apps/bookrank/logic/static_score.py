@@ -1,15 +1,20 @@
-from collections import Counter
-from typing import List, Optional
+import json
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
 import logging
-from datetime import date
+from datetime import date, timedelta
+from django.db import connection
 from django.db.models import QuerySet, Sum, Q, Count, FloatField, Max
 from django.db.models.functions import Cast, Coalesce
 from django.db.models.fields.json import KeyTextTransform
 from django.conf import settings
 from django.db.transaction import atomic
+from django.utils import timezone
 from tqdm import tqdm
 
+from core.models import SingletonValue
 from hits.models import WorkHit
+from ..managers import DAYS_IN_YR
 from ..models import (
     Author,
     Publisher,
@@ -20,6 +25,7 @@ from ..models import (
     WorkCategory,
     Work,
 )
+from .response_cache import bump_data_generation
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +36,10 @@ MODELS_TO_UPDATE = (
     (SubjectCategory, 'subject_categories'),
 )
 YEARS = (2020, 2015, 2010, 2005, 2000)
+SCORE_KEYS = (*[f'score_{yr}' for yr in YEARS], 'score_all')
+CHUNK_SIZE = 10_000
+# fields written when the static score of a topic changes
+STATIC_SCORE_FIELDS = ['static_score', 'static_score_all', 'last_updated']
 
 
 def make_annotations_dict() -> dict:
@@ -71,18 +81,100 @@ def get_maximums(qs: QuerySet, field: str) -> dict:
     return maximums
 
 
-def update_normalized_scores(qs: QuerySet, field: str, stats: Optional[Counter] = None) -> None:
+def _maximums_key(field: str) -> str:
+    return f'score_maximums_{field}'
+
+
+def store_maximums(field: str, maximums: dict) -> dict:
+    SingletonValue.objects.update_or_create(
+        key=_maximums_key(field), defaults={'text': json.dumps(maximums)}
+    )
+    return maximums
+
+
+def stored_maximums(model, field: str) -> dict:
+    """
+    Returns maximums used for normalization as stored by the last update, computing them from
+    all topics if they are not stored
+    """
+    text = SingletonValue.objects.filter(key=_maximums_key(field)).values_list('text', flat=True)
+    if text := text.first():
+        maximums = json.loads(text)
+        if field == 'subject_categories':
+            # json turns the tree ids into strings
+            return {int(tree_id): maxs for tree_id, maxs in maximums.items()}
+        return maximums
+    return store_maximums(field, get_maximums(model.objects.all(), field))
+
+
+def forget_maximums() -> None:
+    """
+    Removes the stored maximums - to be used when the set of topics considered for maximums
+    changes (e.g. topics are connected to new candidates)
+    """
+    SingletonValue.objects.filter(key__startswith=_maximums_key('')).delete()
+
+
+def maximums_after_deltas(
+    model, field: str, old_maximums: dict, old_scores: dict, new_scores: dict
+) -> Optional[dict]:
+    """
+    Computes new maximums from `old_maximums` and static scores of the changed topics
+    (`old_scores` and `new_scores` map topic pk to the static score before and after the
+    change). Returns None if a score equal to one of the old maximums decreased - the new
+    maximum is not known without looking at all the topics then.
+    """
+    changed = model.objects.filter(pk__in=new_scores)
+    if field == 'subject_categories':
+        # roots are not part of the trees for which maximums are computed
+        topic_groups = changed.filter(level__gt=0).values_list('pk', 'tree_id')
+    else:
+        topic_groups = changed.filter(candidates__isnull=False).distinct().values_list('pk')
+        topic_groups = [(pk, None) for (pk,) in topic_groups]
+    group_to_pks = defaultdict(list)
+    for pk, group in topic_groups:
+        group_to_pks[group].append(pk)
+    new_maximums = (
+        {group: dict(maxs) for group, maxs in old_maximums.items()}
+        if field == 'subject_categories'
+        else {None: dict(old_maximums)}
+    )
+    for group, pks in group_to_pks.items():
+        if group not in new_maximums:
+            # not a tree maximums are computed for
+            continue
+        max_dict = new_maximums[group]
+        for key in SCORE_KEYS:
+            old_max = max_dict.get(f'{key}_max')
+            for pk in pks:
+                old_value = old_scores[pk].get(key)
+                new_value = new_scores[pk][key]
+                if old_max is not None and old_value == old_max and new_value < old_max:
+                    return None
+                if old_max is None or new_value > old_max:
+                    old_max = float(new_value)
+            max_dict[f'{key}_max'] = old_max
+    return new_maximums if field == 'subject_categories' else new_maximums[None]
+
+
+def update_normalized_scores(
+    qs: QuerySet, field: str, stats: Optional[Counter] = None, maximums: Optional[dict] = None
+) -> None:
     years = [*YEARS, 'all']
-    maximums = get_maximums(qs, field)
+    if maximums is None:
+        maximums = store_maximums(field, get_maximums(qs, field))
     objs_to_update = []
     logger.info(f'Updating normalized scores for {field}')
     for obj in tqdm(qs.iterator(chunk_size=10_000), total=qs.count()):
         max_dict = maximums if field != 'subject_categories' else maximums.get(obj.tree_id)
         if not max_dict:
             continue
+        # the values are taken from annotations if present, otherwise from the stored scores
         scores_dict = {
             f'score_{yr}': (
-                100 * (getattr(obj, f'score_{yr}') or 0) / max_dict[f'score_{yr}_max']
+                100
+                * (getattr(obj, f'score_{yr}', obj.static_score.get(f'score_{yr}')) or 0)
+                / max_dict[f'score_{yr}_max']
                 if max_dict[f'score_{yr}_max']
                 else None
             )
@@ -90,10 +182,14 @@ def update_normalized_scores(qs: QuerySet, field: str, stats: Optional[Counter]
         }
         if obj.normalized_score != scores_dict:
             obj.normalized_score = scores_dict
+            obj.last_updated = timezone.now()
             objs_to_update.append(obj)
-    qs.model.objects.bulk_update(objs_to_update, ['normalized_score'], batch_size=1000)
+    # `last_updated` is used to find candidates whose scores need to be recomputed
+    qs.model.objects.bulk_update(
+        objs_to_update, ['normalized_score', 'last_updated'], batch_size=1000
+    )
     if stats is not None:
-        stats[f'{field}_normalized_score_updated'] = len(objs_to_update)
+        stats[f'{field}_normalized_score_updated'] += len(objs_to_update)
 
 
 def update_scores_for_model(qs: QuerySet, field: str, stats: Optional[Counter] = None) -> None:
@@ -104,8 +200,10 @@ def update_scores_for_model(qs: QuerySet, field: str, stats: Optional[Counter] =
         scores_dict['score_all'] = obj.score_all
         if obj.static_score != scores_dict:
             obj.static_score = scores_dict
+            obj.static_score_all = scores_dict['score_all']
+            obj.last_updated = timezone.now()
             objs_to_update.append(obj)
-    qs.model.objects.bulk_update(objs_to_update, ['static_score'], batch_size=1000)
+    qs.model.objects.bulk_update(objs_to_update, STATIC_SCORE_FIELDS, batch_size=1000)
     if stats is not None:
         stats[f'{field}_static_scores_updated'] = len(objs_to_update)
     update_normalized_scores(qs, field, stats=stats)
@@ -121,40 +219,224 @@ def update_static_scores(
             qs = qs.filter(works__workhit__in=new_hits)
         qs = qs.annotate(**agg_dict)
         update_scores_for_model(qs, field, stats=stats)
+    bump_data_generation(work_set)
+
+
+def score_deltas_for_works(hit_deltas: Counter) -> Dict[int, Counter]:
+    """
+    Converts changes in hits (as produced by `hits.logic.rollups.hit_deltas`) into changes
+    of the individual static score buckets of the affected works
+    """
+    year_starts = [(f'score_{yr}', date(yr, 1, 1)) for yr in YEARS]
+    work_deltas = defaultdict(Counter)
+    for (work_id, _typ_id, hit_date), value in hit_deltas.items():
+        if not value:
+            continue
+        deltas = work_deltas[work_id]
+        deltas['score_all'] += value
+        if hit_date:
+            for key, start in year_starts:
+                if hit_date >= start:
+                    deltas[key] += value
+    return work_deltas
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE) -> Iterable[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def work_topic_links(field: str, work_ids: list) -> QuerySet:
+    """
+    Returns (work_id, topic_id) pairs for topics connected to works using `field`
+    """
+    work_field = Work._meta.get_field(field)
+    if work_field.many_to_many:
+        return work_field.remote_field.through.objects.filter(work_id__in=work_ids).values_list(
+            'work_id', 'topic_id'
+        )
+    return Work.objects.filter(pk__in=work_ids, **{f'{field}__isnull': False}).values_list(
+        'pk', field
+    )
+
+
+def update_static_scores_from_deltas(
+    work_set: WorkSet, hit_deltas: Counter, stats: Optional[Counter] = None
+) -> None:
+    """
+    Incremental alternative to `update_static_scores` - the changes in hits are added directly
+    to the static scores of topics connected to the affected works, so that the cost is
+    proportional to the size of the change and not to the whole hit history.
+
+    Normalized scores are recomputed for all topics only when one of the maximums used for
+    normalization changes, otherwise just the affected topics are updated. The maximums are
+    stored between runs and updated from the changed topics - all topics are scanned only when
+    a topic with the maximum score got a lower score.
+    """
+    work_deltas = score_deltas_for_works(hit_deltas)
+    if not work_deltas:
+        return
+    work_ids = list(work_deltas)
+    for model, field in MODELS_TO_UPDATE:
+        topic_deltas = defaultdict(Counter)
+        for work_ids_chunk in _chunks(work_ids):
+            for work_id, topic_id in work_topic_links(field, work_ids_chunk):
+                topic_deltas[topic_id].update(work_deltas[work_id])
+        if topic_deltas:
+            update_scores_for_model_from_deltas(model, work_set, field, topic_deltas, stats)
+
+
+def update_scores_for_model_from_deltas(
+    model, work_set: WorkSet, field: str, topic_deltas: dict, stats: Optional[Counter] = None
+) -> None:
+    logger.info(f'Updating static scores for {len(topic_deltas)} {field} from deltas')
+    old_maximums = stored_maximums(model, field)
+    topic_ids = list(topic_deltas)
+    # static scores of the changed topics before and after the change
+    old_scores = {}
+    new_scores = {}
+    # topics without complete static score have never been computed, so deltas are not enough
+    to_recompute = []
+    updated = 0
+    for topic_ids_chunk in _chunks(topic_ids):
+        objs_to_update = []
+        for obj in model.objects.filter(pk__in=topic_ids_chunk):
+            if any(obj.static_score.get(key) is None for key in SCORE_KEYS):
+                to_recompute.append(obj.pk)
+                continue
+            deltas = topic_deltas[obj.pk]
+            old_scores[obj.pk] = obj.static_score
+            obj.static_score = {key: obj.static_score[key] + deltas[key] for key in SCORE_KEYS}
+            new_scores[obj.pk] = obj.static_score
+            obj.static_score_all = obj.static_score['score_all']
+            obj.last_updated = timezone.now()
+            objs_to_update.append(obj)
+        model.objects.bulk_update(objs_to_update, STATIC_SCORE_FIELDS, batch_size=1000)
+        updated += len(objs_to_update)
+    for topic_ids_chunk in _chunks(to_recompute):
+        qs = model.objects.filter(pk__in=topic_ids_chunk).annotate(**make_annotations_dict())
+        objs_to_update = []
+        for obj in qs:
+            old_scores[obj.pk] = obj.static_score
+            obj.static_score = {key: getattr(obj, key) for key in SCORE_KEYS}
+            new_scores[obj.pk] = obj.static_score
+            obj.static_score_all = obj.static_score['score_all']
+            obj.last_updated = timezone.now()
+            objs_to_update.append(obj)
+        model.objects.bulk_update(objs_to_update, STATIC_SCORE_FIELDS, batch_size=1000)
+        updated += len(objs_to_update)
+    if stats is not None:
+        stats[f'{field}_static_scores_updated'] += updated
+    # normalization
+    new_maximums = maximums_after_deltas(model, field, old_maximums, old_scores, new_scores)
+    if new_maximums is None:
+        logger.info(f'A maximum score of {field} decreased, looking for the new one')
+        new_maximums = get_maximums(model.objects.all(), field)
+    store_maximums(field, new_maximums)
+    if new_maximums == old_maximums:
+        for topic_ids_chunk in _chunks(topic_ids):
+            update_normalized_scores(
+                model.objects.filter(pk__in=topic_ids_chunk),
+                field,
+                stats=stats,
+                maximums=new_maximums,
+            )
+        return
+    logger.info(f'Normalization maximums changed for {field}, updating all normalized scores')
+    qs = model.objects.filter(work_set=work_set)
+    if field == 'subject_categories':
+        changed_trees = [
+            tree_id for tree_id, maxs in new_maximums.items() if old_maximums.get(tree_id) != maxs
+        ]
+        qs = model.objects.filter(Q(pk__in=topic_ids) | Q(tree_id__in=changed_trees))
+    update_normalized_scores(qs, field, stats=stats, maximums=new_maximums)
 
 
-def update_growth_fields(work_set: WorkSet, chunk_size=10_000) -> Counter:
+GROWTH_TOPIC_FIELDS = (
+    (Author, 'authors'),
+    (Publisher, 'publishers'),
+    (Language, 'lang'),
+    (SubjectCategory, 'subject_categories'),
+    (WorkCategory, 'category'),
+    (OwnerInstitution, 'owner_institution'),
+)
+
+GROWTH_UPDATE_SQL = """
+UPDATE {table} AS obj SET
+    score_past_yr = growth.past_yr,
+    score_yr_b4 = growth.yr_b4,
+    absolute_growth = growth.past_yr - growth.yr_b4,
+    relative_growth = CASE
+        WHEN growth.yr_b4 = 0 THEN NULL
+        ELSE 1.0 * (growth.past_yr - growth.yr_b4) / growth.yr_b4
+    END
+FROM ({growth_sql}) AS growth
+WHERE obj.id = growth.id AND (
+    obj.score_past_yr IS DISTINCT FROM growth.past_yr
+    OR obj.score_yr_b4 IS DISTINCT FROM growth.yr_b4
+)
+"""
+
+
+def _work_topic_links_sql(field: str) -> str:
+    """
+    SQL giving (work_id, topic_id) pairs for topics connected to works using `field`
+    """
+    work_field = Work._meta.get_field(field)
+    if work_field.many_to_many:
+        return f'SELECT work_id, topic_id FROM {work_field.remote_field.through._meta.db_table}'
+    return (
+        f'SELECT id AS work_id, {work_field.column} AS topic_id FROM {Work._meta.db_table} '
+        f'WHERE {work_field.column} IS NOT NULL'
+    )
+
+
+@atomic
+def update_growth_fields(work_set: WorkSet) -> Counter:
+    """
+    Recomputes the growth fields of works and topics in `work_set` directly in the database.
+    Hits of the last two years are summed up once per work into a temporary table and the
+    topic values are computed from it, only rows with changed values are updated.
+    """
     stats = Counter()
-    fields_to_update = ['score_past_yr', 'score_yr_b4', 'absolute_growth', 'relative_growth']
-    models_list = [
-        Work,
-        Author,
-        Publisher,
-        Language,
-        SubjectCategory,
-        WorkCategory,
-        OwnerInstitution,
-    ]
-    qs_list = [
-        model.objects.filter(work_set=work_set).annotate_relative_growth() for model in models_list
-    ]
-    for qs in qs_list:
-        logger.info(f'Updating {qs.model.__name__} objects...')
-        with atomic():
-            objs_to_update = []
-            for obj in tqdm(qs.iterator(chunk_size=chunk_size), total=qs.count()):
-                if (
-                    obj.score_past_yr == obj.annotated_score_past_yr
-                    and obj.score_yr_b4 == obj.annotated_score_yr_b4
-                ):
-                    continue
-                for field in fields_to_update:
-                    setattr(obj, field, getattr(obj, f'annotated_{field}'))
-                objs_to_update.append(obj)
-                if objs_to_update and len(objs_to_update) % chunk_size == 0:
-                    qs.model.objects.bulk_update(objs_to_update, fields_to_update, batch_size=1000)
-                    stats[f'{qs.model.__name__}_objects_updated'] += chunk_size
-                    objs_to_update = []
-            qs.model.objects.bulk_update(objs_to_update, fields_to_update, batch_size=1000)
-            stats[f'{qs.model.__name__}_objects_updated'] += len(objs_to_update)
+    b4_12_mo = timezone.localdate() - timedelta(days=DAYS_IN_YR)
+    b4_24_mo = b4_12_mo - timedelta(days=DAYS_IN_YR)
+    with connection.cursor() as cursor:
+        logger.info('Computing growth of works')
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE work_growth AS '
+            f'SELECT work.id, '
+            f'COALESCE(SUM(hit.value) FILTER (WHERE hit.date >= %s), 0)::integer AS past_yr, '
+            f'COALESCE(SUM(hit.value) FILTER (WHERE hit.date < %s), 0)::integer AS yr_b4 '
+            f'FROM {Work._meta.db_table} work '
+            f'LEFT JOIN {WorkHit._meta.db_table} hit '
+            f'ON hit.work_id = work.id AND hit.date >= %s '
+            f'WHERE work.work_set_id = %s GROUP BY work.id',
+            [b4_12_mo, b4_12_mo, b4_24_mo, work_set.pk],
+        )
+        cursor.execute('CREATE UNIQUE INDEX ON work_growth (id)')
+        cursor.execute(
+            GROWTH_UPDATE_SQL.format(
+                table=Work._meta.db_table, growth_sql='SELECT * FROM work_growth'
+            )
+        )
+        stats['Work_objects_updated'] = cursor.rowcount
+        for model, field in GROWTH_TOPIC_FIELDS:
+            logger.info('Updating growth of %s objects', model.__name__)
+            growth_sql = (
+                f'SELECT topic.id, '
+                f'COALESCE(SUM(growth.past_yr), 0)::integer AS past_yr, '
+                f'COALESCE(SUM(growth.yr_b4), 0)::integer AS yr_b4 '
+                f'FROM {model._meta.db_table} topic '
+                f'LEFT JOIN ({_work_topic_links_sql(field)}) link ON link.topic_id = topic.id '
+                f'LEFT JOIN work_growth growth ON growth.id = link.work_id '
+                f'WHERE topic.work_set_id = %s GROUP BY topic.id'
+            )
+            cursor.execute(
+                GROWTH_UPDATE_SQL.format(table=model._meta.db_table, growth_sql=growth_sql),
+                [work_set.pk],
+            )
+            stats[f'{model.__name__}_objects_updated'] = cursor.rowcount
+        cursor.execute('DROP TABLE work_growth')
+    bump_data_generation(work_set)
     return stats
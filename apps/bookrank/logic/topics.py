@@ -1,25 +1,249 @@
+import json
 import logging
 import operator
-from collections import Counter
+import zlib
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from csv import DictReader
 from functools import reduce
+from itertools import islice
 from time import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
-from anytree import NodeMixin
-from anytree.exporter import DictExporter
 from django.conf import settings
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Sum, QuerySet, Q, IntegerField, Count
+from django.db.models import Sum, QuerySet, Q, IntegerField, Count, OuterRef, Subquery
 from django.db.models.functions import Coalesce, Cast
 from django.db.transaction import atomic
+from django.utils.timezone import now
 from tqdm import tqdm
 
-from bookrank.models import SubjectCategory
+from bookrank.models import SubjectCategory, SubjectTreeSnapshot, WorkSet
 from core.logic.query import prefix_query_filter
 
 logger = logging.getLogger(__name__)
 
 
+EXTRACTION_BATCH_SIZE = 1000
+
+
+class WorkData(NamedTuple):
+    """
+    The part of `Work` used by topic extractors
+    """
+
+    pk: int
+    uid: str
+    extra_data: dict
+
+
+class TopicExtraction(NamedTuple):
+    """
+    Description of extraction of one type of explicit topics. Topics connected using
+    a foreign key of `Work` named `attr_name` are used when `connector_cls` is not given.
+    """
+
+    name: str
+    extractor: Callable
+    topic_cls: type
+    connector_cls: Optional[type] = None
+    attr_name: Optional[str] = None
+    id_attr: str = 'name'
+    topic_filter: Optional[dict] = None
+    topic_extra_attrs: Optional[dict] = None
+    controlled_dictionary: bool = False
+
+    def create_writer(self, work_set: 'WorkSet') -> 'TopicWriter':
+        if self.connector_cls:
+            return M2MTopicWriter(
+                work_set,
+                self.topic_cls,
+                self.connector_cls,
+                id_attr=self.id_attr,
+                topic_filter=self.topic_filter,
+                topic_extra_attrs=self.topic_extra_attrs,
+                controlled_dictionary=self.controlled_dictionary,
+            )
+        return FKTopicWriter(
+            work_set,
+            self.topic_cls,
+            self.attr_name or self.name,
+            id_attr=self.id_attr,
+            controlled_dictionary=self.controlled_dictionary,
+        )
+
+
+def _work_batches(work_qs: QuerySet, batch_size: int = EXTRACTION_BATCH_SIZE):
+    """
+    Yields lists of `WorkData`, only the 'aleph' part of `extra_data` is read from the database
+    """
+    iterator = work_qs.values_list('pk', 'uid', 'extra_data__aleph').iterator(chunk_size=batch_size)
+    while batch := list(islice(iterator, batch_size)):
+        yield [
+            WorkData(pk, uid, {'aleph': aleph} if aleph is not None else {})
+            for pk, uid, aleph in batch
+        ]
+
+
+class TopicWriter:
+    """
+    Writes topics extracted from a batch of works into the database. Topics which do not
+    exist are created, so there should be only one writer for each topic type at a time.
+    """
+
+    def __init__(
+        self,
+        work_set: 'WorkSet',
+        topic_cls,
+        id_attr='name',
+        topic_filter=None,
+        topic_extra_attrs=None,
+        controlled_dictionary=False,
+    ):
+        self.work_set = work_set
+        self.topic_cls = topic_cls
+        self.id_attr = id_attr
+        self.topic_filter = topic_filter or {}
+        self.topic_extra_attrs = topic_extra_attrs or {}
+        self.controlled_dictionary = controlled_dictionary
+        self.stats = Counter()
+        t = time()
+        self.topics = {
+            getattr(topic, id_attr): topic.pk
+            for topic in topic_cls.objects.filter(work_set=work_set, **self.topic_filter)
+        }
+        logging.info("Have %d topics: %f s", len(self.topics), time() - t)
+
+    def get_or_create_topic(self, topic_name, extra_attrs=None) -> Tuple[Optional[int], bool]:
+        """
+        Returns pk of the topic and whether it was created. The pk is None for unknown topics
+        of controlled dictionaries.
+        """
+        topic_db_id = self.topics.get(topic_name)
+        if topic_db_id:
+            return topic_db_id, False
+        if self.controlled_dictionary:
+            self.stats['error'] += 1
+            logger.error(f'Unknown value "{topic_name}" for controlled dictionary {self.topic_cls}')
+            return None, False
+        # put the static extra attrs to the dynamic
+        extra_attrs = {**(extra_attrs or {}), **self.topic_extra_attrs}
+        topic = self.topic_cls.objects.create(
+            work_set=self.work_set, **{self.id_attr: topic_name}, **extra_attrs
+        )
+        self.topics[topic_name] = topic.pk
+        self.stats['created'] += 1
+        return topic.pk, True
+
+    def write(self, results: List[Tuple[WorkData, list]]) -> None:
+        """
+        :param results: works and the (name, subtype, weight) triples extracted from them
+        """
+        raise NotImplementedError()
+
+
+class FKTopicWriter(TopicWriter):
+    """
+    Sets the foreign key `attr_name` of works to the extracted topic. Changed works
+    are updated using one query per distinct topic in the batch.
+    """
+
+    def __init__(self, work_set: 'WorkSet', topic_cls, attr_name, **kwargs):
+        super().__init__(work_set, topic_cls, **kwargs)
+        self.attr_name = attr_name
+
+    def write(self, results: List[Tuple[WorkData, list]]) -> None:
+        id_attr_name = self.attr_name + '_id'
+        work_model = self.work_set.works.model
+        current = dict(
+            work_model.objects.filter(pk__in=[work.pk for work, _ in results]).values_list(
+                'pk', id_attr_name
+            )
+        )
+        to_update = defaultdict(list)
+        for work, topic_names_subtypes_and_weights in results:
+            if len(topic_names_subtypes_and_weights) > 1:
+                logger.error(
+                    'More than one value for foreign-key based explicit topic "%s", ' 'work: "%s"',
+                    self.topic_cls.__name__,
+                    work.uid,
+                )
+            if (
+                topic_names_subtypes_and_weights
+                and topic_names_subtypes_and_weights[0][0] is not None
+            ):
+                # if name is None, we deal with it the same way as if there was not name
+                topic_name, _subtype_name, _ext_weight = topic_names_subtypes_and_weights[0]
+                topic_db_id, _created = self.get_or_create_topic(topic_name)
+                if current.get(work.pk) == topic_db_id:
+                    self.stats['skipped'] += 1
+                else:
+                    to_update[topic_db_id].append(work.pk)
+                    self.stats['connected'] += 1
+            elif current.get(work.pk) is not None:
+                # there was no value, we clean it up
+                to_update[None].append(work.pk)
+                self.stats['disconnected'] += 1
+        # `last_updated` is set the same way as `save` would do it
+        update_time = now()
+        for topic_db_id, work_ids in to_update.items():
+            work_model.objects.filter(pk__in=work_ids).update(
+                **{id_attr_name: topic_db_id, 'last_updated': update_time}
+            )
+
+
+class M2MTopicWriter(TopicWriter):
+    """
+    Connects works to the extracted topics using `connector_cls` and removes connections
+    to topics which were not extracted. Existing connections are loaded for the whole batch
+    and the changes are written using one insert and one delete.
+    """
+
+    def __init__(self, work_set: 'WorkSet', topic_cls, connector_cls, **kwargs):
+        super().__init__(work_set, topic_cls, **kwargs)
+        self.connector_cls = connector_cls
+        self.connector_filter = prefix_query_filter(self.topic_filter, 'topic__')
+
+    def write(self, results: List[Tuple[WorkData, list]]) -> None:
+        # topic_id -> connector pk for each work of the batch
+        db_connectors = defaultdict(dict)
+        for pk, work_id, topic_id in self.connector_cls.objects.filter(
+            work_id__in=[work.pk for work, _ in results], **self.connector_filter
+        ).values_list('pk', 'work_id', 'topic_id'):
+            db_connectors[work_id][topic_id] = pk
+        connector_instances = []
+        to_delete = []
+        for work, topic_names_subtypes_and_weights in results:
+            db_topic_ids = db_connectors[work.pk]
+            seen_topic_ids = set()
+            for topic_name, _subtype_name, _ext_weight in topic_names_subtypes_and_weights:
+                extra_attrs = {}
+                if type(topic_name) is dict:
+                    extra_attrs = dict(topic_name)
+                    topic_name = extra_attrs.pop(self.id_attr)
+                topic_db_id, created = self.get_or_create_topic(topic_name, extra_attrs)
+                if not topic_db_id:
+                    continue
+                if topic_db_id in db_topic_ids or topic_db_id in seen_topic_ids:
+                    self.stats['skipped'] += 1
+                else:
+                    connector_instances.append(
+                        self.connector_cls(work_id=work.pk, topic_id=topic_db_id)
+                    )
+                    if not created:
+                        self.stats['connected'] += 1
+                seen_topic_ids.add(topic_db_id)
+            # delete obsolete
+            obsolete = [
+                pk for topic_id, pk in db_topic_ids.items() if topic_id not in seen_topic_ids
+            ]
+            if obsolete:
+                self.stats['disconnected'] += 1
+                to_delete += obsolete
+        if to_delete:
+            self.connector_cls.objects.filter(pk__in=to_delete).delete()
+        self.connector_cls.objects.bulk_create(connector_instances)
+
+
 def extract_fk_explicit_topics_from_works(
     work_set: 'WorkSet',
     topic_extractor,
@@ -29,56 +253,15 @@ def extract_fk_explicit_topics_from_works(
     newer_than=None,
     controlled_dictionary=False,
 ) -> Counter:
-    stats = Counter()
-    t = time()
-    topic_filter = {}
-    topics = {
-        getattr(topic, id_attr): topic.pk
-        for topic in topic_cls.objects.filter(work_set=work_set, **topic_filter)
-    }
-    logging.info("Have topics: %f", time() - t)
-    work_qs = work_set.works.all()
-    if newer_than:
-        work_qs = work_qs.filter(last_updated__gt=newer_than)
-    for i, work in enumerate(work_qs.iterator()):  # type: (int, 'Work')
-        topic_names_subtypes_and_weights = topic_extractor(work)
-        if len(topic_names_subtypes_and_weights) > 1:
-            logger.error(
-                'More than one value for foreign-key based explicit topic "%s", ' 'work: "%s"',
-                topic_cls.__name__,
-                work.uid,
-            )
-        if topic_names_subtypes_and_weights and topic_names_subtypes_and_weights[0][0] is not None:
-            # if name is None, we deal with it the same way as if there was not name
-            topic_name, _subtype_name, _ext_weight = topic_names_subtypes_and_weights[0]
-            topic_db_id = topics.get(topic_name)
-            # create the topic if it is not present
-            if not topic_db_id:
-                if controlled_dictionary:
-                    stats['error'] += 1
-                    logger.error(
-                        f'Unknown value "{topic_name}" for controlled dictionary {topic_cls}'
-                    )
-                else:
-                    topic = topic_cls.objects.create(name=topic_name, work_set=work_set)
-                    topics[topic_name] = topic.pk
-                    topic_db_id = topic.pk
-                    stats['created'] += 1
-            if getattr(work, attr_name + '_id') == topic_db_id:
-                stats['skipped'] += 1
-            else:
-                setattr(work, attr_name + '_id', topic_db_id)
-                work.save()
-                stats['connected'] += 1
-        else:
-            # there was no value, check if we should clean it up
-            if getattr(work, attr_name + '_id') is not None:
-                setattr(work, attr_name + '_id', None)
-                work.save()
-                stats['disconnected'] += 1
-        if i and i % 1000 == 0:
-            logging.info("Extracted topics from %d works in %.2f seconds: %s", i, time() - t, stats)
-    return stats
+    extraction = TopicExtraction(
+        attr_name,
+        topic_extractor,
+        topic_cls,
+        attr_name=attr_name,
+        id_attr=id_attr,
+        controlled_dictionary=controlled_dictionary,
+    )
+    return extract_explicit_topics(work_set, [extraction], newer_than=newer_than)[attr_name]
 
 
 def extract_m2m_explicit_topics_from_works(
@@ -92,68 +275,91 @@ def extract_m2m_explicit_topics_from_works(
     newer_than=None,
     controlled_dictionary=False,
 ) -> Counter:
-    stats = Counter()
-    t = time()
-    if topic_filter is None:
-        topic_filter = {}
-    if topic_extra_attrs is None:
-        topic_extra_attrs = {}
-    topics = {
-        getattr(topic, id_attr): topic.pk
-        for topic in topic_cls.objects.filter(work_set=work_set, **topic_filter)
-    }
-    logging.info("Have %d topics: %f s", len(topics), time() - t)
-    connector_instances = []
+    extraction = TopicExtraction(
+        topic_cls.__name__,
+        topic_extractor,
+        topic_cls,
+        connector_cls=connector_cls,
+        id_attr=id_attr,
+        topic_filter=topic_filter,
+        topic_extra_attrs=topic_extra_attrs,
+        controlled_dictionary=controlled_dictionary,
+    )
+    return extract_explicit_topics(work_set, [extraction], newer_than=newer_than)[
+        topic_cls.__name__
+    ]
+
+
+# extractors used by the worker processes of `extract_explicit_topics`
+_worker_extractors: List[Callable] = []
+
+
+def _init_worker(extractors: List[Callable]) -> None:
+    global _worker_extractors
+    _worker_extractors = extractors
+
+
+def _extract_batch(extractors: List[Callable], works: List[WorkData]) -> List[list]:
+    """
+    Returns the topics extracted from `works` for each of `extractors`
+    """
+    return [[(work, extractor(work)) for work in works] for extractor in extractors]
+
+
+def _extract_batch_in_worker(works: List[WorkData]) -> List[list]:
+    return _extract_batch(_worker_extractors, works)
+
+
+def extract_explicit_topics(
+    work_set: 'WorkSet',
+    extractions: List[TopicExtraction],
+    newer_than=None,
+    jobs: int = 1,
+    batch_size: int = EXTRACTION_BATCH_SIZE,
+) -> Dict[str, Counter]:
+    """
+    Runs all `extractions` over the works of `work_set` reading the data of each work only
+    once. With `jobs` > 1, the extractors run in a pool of processes, while all database writes
+    (including creation of new topics) are done by the current process, so that topic names
+    stay unique. Each batch of works is written in its own transaction.
+
+    :return: stats for each extraction by its name
+    """
+    writers = [extraction.create_writer(work_set) for extraction in extractions]
+    extractors = [extraction.extractor for extraction in extractions]
     work_qs = work_set.works.all()
     if newer_than:
         work_qs = work_qs.filter(last_updated__gt=newer_than)
-    connector_filter = prefix_query_filter(topic_filter, 'topic__')
-    for i, work in enumerate(work_qs.iterator()):  # type: (int, 'Work')
-        # logging.info("Extracted authors from %d works (%f)", i, time()-t)
-        topic_names_subtypes_and_weights = topic_extractor(work)
-        db_topic_ids = {
-            wt.topic_id for wt in connector_cls.objects.filter(work=work, **connector_filter)
-        }
-        seen_topic_ids = set()
-        for topic_name, _subtype_name, _ext_weight in topic_names_subtypes_and_weights:
-            extra_attrs = {}
-            if type(topic_name) is dict:
-                _topic_name = topic_name.pop(id_attr)
-                extra_attrs = topic_name
-                topic_name = _topic_name
-            topic_db_id = topics.get(topic_name)
-            if topic_db_id:
-                if topic_db_id in db_topic_ids:
-                    stats['skipped'] += 1
-                else:
-                    connector_instances.append(connector_cls(work=work, topic_id=topic_db_id))
-                    db_topic_ids.add(topic_db_id)
-                    stats['connected'] += 1
-                seen_topic_ids.add(topic_db_id)
-            else:
-                if controlled_dictionary:
-                    stats['error'] += 1
-                    logger.error(
-                        f'Unknown value "{topic_name}" for controlled dictionary {topic_cls}'
-                    )
-                else:
-                    # put the static extra attrs to the dynamic
-                    extra_attrs.update(topic_extra_attrs)
-                    topic = topic_cls.objects.create(
-                        work_set=work_set, **{id_attr: topic_name}, **extra_attrs
-                    )
-                    topics[topic_name] = topic.pk
-                    connector_instances.append(connector_cls(work=work, topic_id=topic.pk))
-                    stats['created'] += 1
-        # delete obsolete
-        to_delete = db_topic_ids - seen_topic_ids
-        if to_delete:
-            stats['disconnected'] += 1
-            connector_cls.objects.filter(work=work, topic_id__in=to_delete).delete()
-        if i and i % 1000 == 0:
-            logging.info("Extracted topics from %d works in %.2f seconds: %s", i, time() - t, stats)
-    connector_cls.objects.bulk_create(connector_instances)
-    return stats
+    t = time()
+    processed = 0
+
+    def write(works, results):
+        nonlocal processed
+        with atomic():
+            for writer, writer_results in zip(writers, results):
+                writer.write(writer_results)
+        processed += len(works)
+        logging.info("Extracted topics from %d works in %.2f seconds", processed, time() - t)
+
+    batches = _work_batches(work_qs, batch_size)
+    if jobs <= 1:
+        for works in batches:
+            write(works, _extract_batch(extractors, works))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker, initargs=(extractors,)
+        ) as executor:
+            # only a limited number of batches is read ahead to keep memory usage in check
+            pending = deque()
+            for works in batches:
+                pending.append((works, executor.submit(_extract_batch_in_worker, works)))
+                if len(pending) >= 2 * jobs:
+                    works, future = pending.popleft()
+                    write(works, future.result())
+            while pending:
+                works, future = pending.popleft()
+                write(works, future.result())
+    return {extraction.name: writer.stats for extraction, writer in zip(extractions, writers)}
 
 
 marc_auth_type_to_weight = {'aut': 1.0, 'dis': 1.0, 'com': 0.8, 'edt': 0.9, '-': 1.0}
@@ -297,81 +503,134 @@ def marc_work_category(work: 'Work') -> [(str, str, float)]:
     return [(settings.DEFAULT_WORK_CATEGORY_NAME, None, 1.0)]
 
 
-class SubjectNode(NodeMixin):
-    def __init__(self, id, name, uid, score=None, parent=None, children=None):
-        self.id = id
-        self.name = name
-        self.uid = uid
-        self.score = score
-        self.parent = parent
-        if children:
-            self.children = children
+# fields of subject tree nodes which are summed up the tree, by score type
+SUBJECT_TREE_SUMMED_FIELDS = {
+    'score': ['score', 'work_count'],
+    'candidates_count': [],
+    'growth': ['score_past_yr', 'score_yr_b4', 'absolute_growth'],
+}
+# score types for which the tree does not depend on anything but the work set data
+SUBJECT_TREE_SNAPSHOT_SCORE_TYPES = ('score', 'growth')
+
+
+def subtree_candidates_count(cand_cnt_filters: dict) -> Coalesce:
+    """
+    Expression for the number of distinct candidates of a subject category and all its
+    descendants (found by the MPTT `lft`/`rght` range) matching `cand_cnt_filters`
+    """
+    subtree = (
+        SubjectCategory.objects.filter(
+            tree_id=OuterRef('tree_id'), lft__gte=OuterRef('lft'), rght__lte=OuterRef('rght')
+        )
+        .exclude(uid__regex=r'^\d')
+        .filter(candidates__isnull=False, **cand_cnt_filters)
+        .order_by()
+        .values('tree_id')
+        .annotate(count=Count('candidates', distinct=True))
+        .values('count')
+    )
+    return Coalesce(Subquery(subtree, output_field=IntegerField()), 0)
 
 
 def build_subject_tree(root: SubjectCategory, score_type: str, cand_cnt_filters: dict) -> list:
-    score_type_to_extra_fields = {
-        'score': ['score'],
-        'candidates_count': ['score'],
-        'growth': ['score_past_yr', 'score_yr_b4', 'absolute_growth', 'relative_growth'],
-    }
-    root_node = SubjectNode(root.pk, root.name, root.uid)
     qs: QuerySet = root.get_descendants().exclude(uid__regex=r'^\d')
-    base_fields = ['pk', 'name', 'uid', 'parent_id']
-    extra_fields = score_type_to_extra_fields[score_type]
+    summed_fields = SUBJECT_TREE_SUMMED_FIELDS[score_type]
     if score_type == 'candidates_count':
-        extra_filters = Q(candidates__isnull=False, **cand_cnt_filters)
-        qs = qs.annotate(score=ArrayAgg('candidates__pk', filter=extra_filters))
+        qs = qs.annotate(acc_score=subtree_candidates_count(cand_cnt_filters))
+        node_fields = ['acc_score']
     elif score_type == 'score':
-        qs = qs.annotate(score=Coalesce(Cast('static_score__score_all', IntegerField()), 0))
-        qs = qs.annotate(work_count=Coalesce(Count('works'), 0))
-        base_fields.append('work_count')
-    qs = qs.order_by('level', 'name').values(*[x for x in base_fields + extra_fields])
+        qs = qs.annotate(
+            score=Cast('static_score_all', IntegerField()),
+            work_count=Coalesce(Count('works'), 0),
+        )
+        node_fields = summed_fields
+    else:
+        node_fields = summed_fields + ['relative_growth']
+    records = list(
+        qs.order_by('level', 'name').values('pk', 'name', 'uid', 'parent_id', *node_fields)
+    )
+    root_node = {}
     pk_to_node = {root.pk: root_node}
-    for rec in qs.iterator(chunk_size=10_000):
-        pk = rec['pk']
-        node = SubjectNode(pk, rec['name'], rec['uid'])
-        pk_to_node[pk] = node
-        node.parent = pk_to_node[rec['parent_id']]
-        if 'work_count' in rec:
-            node.work_count = rec['work_count']
-        for field in extra_fields:
-            setattr(node, field, rec[field])
-    for rec in qs.reverse().iterator(chunk_size=10_000):
+    # parents always come before their children
+    for rec in records:
+        node = {'id': rec['pk'], 'name': rec['name'], 'uid': rec['uid']}
+        if score_type == 'growth':
+            node['score'] = None
+        for field in node_fields:
+            node[field] = rec[field]
+        pk_to_node[rec['pk']] = node
+        pk_to_node[rec['parent_id']].setdefault('children', []).append(node)
+    for rec in reversed(records):
         node = pk_to_node[rec['pk']]
-        for field in extra_fields:
-            if field == 'relative_growth':
-                node.acc_relative_growth = (
-                    (node.acc_absolute_growth / node.acc_score_yr_b4)
-                    if node.acc_score_yr_b4
-                    else None
-                )
-                continue
-            if score_type == 'candidates_count':
-                init_val = rec[field] or []
-            else:
-                init_val = rec[field]
-            setattr(node, f'acc_{field}', init_val)
-            if node.children:
-                setattr(
-                    node,
-                    f'acc_{field}',
-                    sum((getattr(c, f'acc_{field}') for c in node.children), init_val),
-                )
-        if score_type == 'score':
-            if node.children:
-                node.acc_work_count = sum(
-                    (c.acc_work_count for c in node.children), node.work_count
-                )
-            else:
-                node.acc_work_count = node.work_count
+        children = node.get('children', [])
+        for field in summed_fields:
+            # growth fields are empty until they are computed for the first time
+            node[f'acc_{field}'] = sum(
+                (child[f'acc_{field}'] for child in children), node[field] or 0
+            )
+        if score_type == 'growth':
+            node['acc_relative_growth'] = (
+                (node['acc_absolute_growth'] / node['acc_score_yr_b4'])
+                if node['acc_score_yr_b4']
+                else None
+            )
+    return root_node.get('children', [])
 
-    if score_type == 'candidates_count':
-        for rec in qs:
-            pk = rec['pk']
-            pk_to_node[pk].acc_score = len(set(pk_to_node[pk].acc_score))
-            del pk_to_node[pk].score
-    exporter = DictExporter()
-    return exporter.export(root_node)['children']
+
+def get_subject_tree(root: SubjectCategory, score_type: str, cand_cnt_filters: dict) -> list:
+    """
+    Returns the subject tree under `root` - trees which do not depend on candidates are
+    served from snapshots which are recomputed when the data of the work set change
+    """
+    if score_type not in SUBJECT_TREE_SNAPSHOT_SCORE_TYPES:
+        return build_subject_tree(root, score_type, cand_cnt_filters)
+    generation = WorkSet.objects.values_list('data_generation', flat=True).get(pk=root.work_set_id)
+    data = (
+        SubjectTreeSnapshot.objects.filter(
+            root=root, score_type=score_type, data_generation=generation
+        )
+        .values_list('data', flat=True)
+        .first()
+    )
+    if data is not None:
+        return json.loads(zlib.decompress(data))
+    return update_subject_tree_snapshot(root, score_type, generation)
+
+
+def update_subject_tree_snapshot(root: SubjectCategory, score_type: str, generation: int) -> list:
+    """
+    Computes the tree under `root` and stores it as a snapshot for `generation` of the work set
+    data. Returns the tree.
+    """
+    tree = build_subject_tree(root, score_type, {})
+    SubjectTreeSnapshot.objects.update_or_create(
+        root=root,
+        score_type=score_type,
+        defaults={
+            'data_generation': generation,
+            'data': zlib.compress(json.dumps(tree, separators=(',', ':')).encode('utf-8')),
+        },
+    )
+    return tree
+
+
+def update_subject_tree_snapshots(work_set: WorkSet) -> int:
+    """
+    Precomputes snapshots of subject trees of `work_set` - for the roots of all the trees and
+    for other subjects which were already requested. Returns the number of snapshots.
+    """
+    generation = WorkSet.objects.values_list('data_generation', flat=True).get(pk=work_set.pk)
+    roots = (
+        SubjectCategory.objects.filter(work_set=work_set)
+        .filter(Q(level=0) | Q(tree_snapshots__isnull=False))
+        .distinct()
+    )
+    count = 0
+    for root in roots:
+        for score_type in SUBJECT_TREE_SNAPSHOT_SCORE_TYPES:
+            update_subject_tree_snapshot(root, score_type, generation)
+            count += 1
+    return count
 
 
 @atomic
@@ -1,14 +1,17 @@
 import itertools as it
 import re
-from collections import Counter
+from collections import Counter, defaultdict
 from datetime import date
 from decimal import Decimal, InvalidOperation
 from string import whitespace
+from typing import Iterable, List, Tuple
 
 from django.conf import settings
 
 from ..models import Work, WorkCopy
 
+BATCH_SIZE = 1000
+
 
 def format_date(date_str: str) -> date:
     if not date_str:
@@ -75,13 +78,19 @@ def create_copies(work: Work, stats: Counter) -> None:
     stats['work_copies_created'] += len(created)
 
 
-def update_copies(work: Work, stats: Counter) -> None:
+def copy_update_fields() -> list:
+    fields = [field.split('__')[0] for field in settings.WORKCOPIES_FIELDMAP]
+    if 'price' in fields:
+        fields.append('currency')
+    return fields
+
+
+def plan_copies_update(work: Work, old_copies: Iterable[WorkCopy]) -> Tuple[list, list, list]:
+    """
+    Compares copies of the `work` stored in the database (ordered by creation) with its Aleph
+    data and returns lists of copies to create, copies to update and pks of copies to delete.
+    """
     data = work.extra_data.get('aleph', {}).get('copies', [])
-    old_copies = work.copies.order_by('created')
-    field_map = [field.split('__') for field in settings.WORKCOPIES_FIELDMAP]
-    fields_to_update = [field[0] for field in field_map]
-    if 'price' in fields_to_update:
-        fields_to_update.append('currency')
     for_update = []
     for_create = []
     pks_for_delete = []
@@ -98,9 +107,53 @@ def update_copies(work: Work, stats: Counter) -> None:
             for_create.append(copy_obj)
         if to_update:
             for_update.append(copy_obj)
+    return for_create, for_update, pks_for_delete
+
+
+def update_copies(work: Work, stats: Counter) -> None:
+    for_create, for_update, pks_for_delete = plan_copies_update(
+        work, work.copies.order_by('created')
+    )
     deleted_count, _ = work.copies.filter(pk__in=pks_for_delete).delete()
     stats['work_copies_deleted'] += deleted_count
     created = WorkCopy.objects.bulk_create(for_create)
     stats['work_copies_created'] += len(created)
-    WorkCopy.objects.bulk_update(for_update, fields_to_update)
+    WorkCopy.objects.bulk_update(for_update, copy_update_fields())
     stats['work_copies_updated'] += len(for_update)
+
+
+def create_copies_bulk(works: List[Work], stats: Counter) -> None:
+    """
+    Same as `create_copies` for many works at once
+    """
+    copies = [
+        assign_fields(WorkCopy(work=work), copy_dict, True)[0]
+        for work in works
+        for copy_dict in work.extra_data.get('aleph', {}).get('copies', [])
+    ]
+    created = WorkCopy.objects.bulk_create(copies, batch_size=BATCH_SIZE)
+    stats['work_copies_created'] += len(created)
+
+
+def update_copies_bulk(works: List[Work], stats: Counter) -> None:
+    """
+    Same as `update_copies` for many works at once - existing copies of all the works are
+    fetched in one query and the changes are written in bulk
+    """
+    old_copies = defaultdict(list)
+    for work_copy in WorkCopy.objects.filter(work__in=works).order_by('work_id', 'created'):
+        old_copies[work_copy.work_id].append(work_copy)
+    all_create = []
+    all_update = []
+    all_delete = []
+    for work in works:
+        for_create, for_update, pks_for_delete = plan_copies_update(work, old_copies[work.pk])
+        all_create.extend(for_create)
+        all_update.extend(for_update)
+        all_delete.extend(pks_for_delete)
+    deleted_count, _ = WorkCopy.objects.filter(pk__in=all_delete).delete()
+    stats['work_copies_deleted'] += deleted_count
+    created = WorkCopy.objects.bulk_create(all_create, batch_size=BATCH_SIZE)
+    stats['work_copies_created'] += len(created)
+    WorkCopy.objects.bulk_update(all_update, copy_update_fields(), batch_size=BATCH_SIZE)
+    stats['work_copies_updated'] += len(all_update)
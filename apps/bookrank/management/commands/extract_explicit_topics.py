@@ -10,21 +10,27 @@ from Works and create the connections between works and topics
 """
 
 import logging
+from functools import partial
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import transaction
 from django.utils.timezone import now
 
 from core.models import SingletonValue
 from core.logic.updates import get_last_date, update_last_date
+from hits.logic.topic_aggregates import (
+    refresh_topic_aggregates,
+    topic_aggregates_available,
+    topics_of_works,
+)
 from ...logic.command_help import get_workset_by_name_or_command_error
+from ...logic.response_cache import bump_data_generation
 from ...logic.topics import (
+    TopicExtraction,
+    extract_explicit_topics,
     marc_author_topics,
     marc_publisher_topics,
-    extract_m2m_explicit_topics_from_works,
     marc_psh_topics_simple,
-    extract_fk_explicit_topics_from_works,
     marc_owner_institution_topics,
     marc_topics_by_type,
 )
@@ -67,6 +73,14 @@ class Command(BaseCommand):
             ],
             help="Only run for the selected topic type.",
         )
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            dest='jobs',
+            default=1,
+            help="Number of processes used to extract topics from works.",
+        )
         parser.add_argument(
             '-a',
             '--all',
@@ -78,91 +92,83 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         workset = get_workset_by_name_or_command_error(options['work_set'], self)
         logger.info('Working with workset: %s', workset)
-        logger.info('Extracting foreign-key based topics')
         work_category_extractor = getattr(topics, settings.WORK_CATEGORY_EXTRACTOR)
         logger.debug('Using work category extractor: %s', work_category_extractor)
-        for name, extractor, model_cls in (
-            ('owner_institution', marc_owner_institution_topics, OwnerInstitution),
-            ('category', work_category_extractor, WorkCategory),
-        ):
-            if options['limit'] in ('', name):
-                logger.info('Starting extraction of "%s"', name)
-                last_update = (
-                    get_last_date(name, logger) if not options['ignore_last_update'] else None
-                )
-                with transaction.atomic():
-                    stats = extract_fk_explicit_topics_from_works(
-                        workset, extractor, model_cls, name, newer_than=last_update
-                    )
-                logger.info("Sync stats: %s", stats)
-                update_last_date(name)
-
-        logger.info('Extracting many-to-many based topics')
         # prepare PSH
         psh_root, created = SubjectCategory.objects.get_or_create(
             uid='PSH-ROOT', parent=None, work_set=workset, defaults={'name': 'PSH'}
         )
         if created:
             logger.info('Created subject category tree root for PSH')
-        psh_topic_filter = {'tree_id': psh_root.tree_id}
         # prepare czenas tree
         czenas_root, created = SubjectCategory.objects.get_or_create(
             uid='CZENAS-ROOT', parent=None, work_set=workset, defaults={'name': 'CZENAS'}
         )
         if created:
             logger.info('Created subject category tree root for CZENAS')
-        czenas_topic_filter = {'tree_id': czenas_root.tree_id}
-        marc_czenas_extractor = lambda work: marc_topics_by_type(work, 'czenas')
-        # topics with function based extractors
-        for (
-            name,
-            extractor,
-            model_cls,
-            connector_cls,
-            id_attr,
-            topic_filter,
-            topic_extra_attrs,
-            cont_dict,
-        ) in (
-            ('author', marc_author_topics, Author, AuthorWork, 'name', {}, None, False),
-            ('publisher', marc_publisher_topics, Publisher, PublisherWork, 'name', {}, None, False),
-            (
-                'psh',
-                marc_psh_topics_simple,
-                SubjectCategory,
-                SubjectCategoryWork,
-                'uid',
-                psh_topic_filter,
-                None,
-                True,
-            ),
-            (
-                'czenas',
-                marc_czenas_extractor,
-                SubjectCategory,
-                SubjectCategoryWork,
-                'uid',
-                czenas_topic_filter,
-                {'parent': czenas_root},
-                False,
-            ),
-        ):
-            if options['limit'] in ('', name):
-                logger.info('Starting extraction of "%s"', name)
-                last_update = (
-                    get_last_date(name, logger) if not options['ignore_last_update'] else None
+        extractions = [
+            extraction
+            for extraction in (
+                # foreign-key based topics
+                TopicExtraction(
+                    'owner_institution', marc_owner_institution_topics, OwnerInstitution
+                ),
+                TopicExtraction('category', work_category_extractor, WorkCategory),
+                # many-to-many based topics
+                TopicExtraction('author', marc_author_topics, Author, AuthorWork),
+                TopicExtraction('publisher', marc_publisher_topics, Publisher, PublisherWork),
+                TopicExtraction(
+                    'psh',
+                    marc_psh_topics_simple,
+                    SubjectCategory,
+                    SubjectCategoryWork,
+                    id_attr='uid',
+                    topic_filter={'tree_id': psh_root.tree_id},
+                    controlled_dictionary=True,
+                ),
+                TopicExtraction(
+                    'czenas',
+                    partial(marc_topics_by_type, topic_type='czenas'),
+                    SubjectCategory,
+                    SubjectCategoryWork,
+                    id_attr='uid',
+                    topic_filter={'tree_id': czenas_root.tree_id},
+                    topic_extra_attrs={'parent': czenas_root},
+                ),
+            )
+            if options['limit'] in ('', extraction.name)
+        ]
+        # all the works changed since the oldest of the last updates must be processed
+        newer_than = None
+        if not options['ignore_last_update']:
+            last_updates = [get_last_date(extraction.name, logger) for extraction in extractions]
+            if last_updates and None not in last_updates:
+                newer_than = min(last_updates)
+        logger.info(
+            'Starting extraction of %s', ', '.join(extraction.name for extraction in extractions)
+        )
+        # topics of the processed works before and after extraction are those whose aggregates
+        # may change
+        topic_models = {extraction.topic_cls for extraction in extractions}
+        changed_topics = None
+        if topic_aggregates_available(workset):
+            if newer_than:
+                work_ids = list(
+                    workset.works.filter(last_updated__gt=newer_than).values_list('pk', flat=True)
                 )
-                with transaction.atomic():
-                    stats = extract_m2m_explicit_topics_from_works(
-                        workset,
-                        extractor,
-                        model_cls,
-                        connector_cls,
-                        id_attr=id_attr,
-                        topic_filter=topic_filter,
-                        topic_extra_attrs=topic_extra_attrs,
-                        newer_than=last_update,
-                        controlled_dictionary=cont_dict,
-                    )
-                logger.info("Sync stats: %s", stats)
-                update_last_date(name)
+                changed_topics = topics_of_works(topic_models, work_ids)
+            else:
+                changed_topics = {model: None for model in topic_models}
+        all_stats = extract_explicit_topics(
+            workset, extractions, newer_than=newer_than, jobs=options['jobs']
+        )
+        if changed_topics and newer_than:
+            for model, topic_ids in topics_of_works(topic_models, work_ids).items():
+                changed_topics[model] |= topic_ids
+        for extraction in extractions:
+            logger.info('Sync stats for "%s": %s', extraction.name, all_stats[extraction.name])
+            update_last_date(extraction.name)
+        stats = refresh_topic_aggregates(workset, changed_topics) if changed_topics else None
+        if stats is not None:
+            logger.info("Topic hit aggregates refreshed: %s", stats)
+        bump_data_generation(workset)
@@ -8,19 +8,26 @@ from collections import Counter
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
-from django.db.models import Exists, OuterRef
+from django.db.models import Exists, OuterRef, Subquery
 from django.db.transaction import atomic
+from django.utils.timezone import now
 from tqdm import tqdm
 
 from aleph.logic.data_manipulation import get_title_from_marc, extract_isbn
 from aleph.models import AlephEntry
 from ...logic.marc import extract_publication_years_from_marc
+from ...logic.response_cache import bump_data_generation
 from ...logic.aleph import convert_date_string
-from ...logic.work_copies import create_copies, update_copies
+from ...logic.work_copies import create_copies_bulk, update_copies_bulk
 from ...models import Work, WorkCategory, WorkSet, Language
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 1000
+
+# fields of `Work` computed from the Aleph data by `Command.work_values`
+WORK_SYNC_FIELDS = ['name', 'lang_id', 'start_yop', 'end_yop', 'isbn', 'catalog_date']
+
 
 class Command(BaseCommand):
 
@@ -35,6 +42,13 @@ class Command(BaseCommand):
         parser.add_argument('-f', '--filter-file', type=str, dest='filter_file')
         parser.add_argument('-a', '--all', action='store_true', dest='all')
         parser.add_argument('-d', '--delete', action='store_true', dest='delete_extra')
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Number of entries synced in one transaction',
+        )
 
     @classmethod
     def read_uids(cls, filename) -> set:
@@ -47,7 +61,159 @@ class Command(BaseCommand):
                 uids.add(rec.get('uid'))
         return uids
 
-    @atomic
+    @classmethod
+    def same_aleph_data(cls, work: Work, aleph_entry: AlephEntry) -> bool:
+        if work.aleph_hash and aleph_entry.content_hash:
+            return work.aleph_hash == aleph_entry.content_hash
+        return work.extra_data.get('aleph', {}) == aleph_entry.raw_data
+
+    @classmethod
+    def mark_unchanged_works(cls, work_pks: list):
+        """
+        Updates `last_updated` of works to mark them as seen and fills in the `aleph_hash`
+        if it was not known yet
+        """
+        if work_pks:
+            entry_hash = AlephEntry.objects.filter(uid=OuterRef('uid')).values('content_hash')[:1]
+            Work.objects.filter(pk__in=work_pks).update(
+                last_updated=now(), aleph_hash=Subquery(entry_hash)
+            )
+
+    @classmethod
+    def skip_unchanged_entries(cls, workset: WorkSet, aleph_entry_queryset, aleph_exclude: dict):
+        """
+        Removes entries whose work already contains the same data from `aleph_entry_queryset`
+        and marks these works as seen using one UPDATE.
+
+        :return: the filtered queryset and number of works marked as seen
+        """
+        unchanged_work_filter = Work.objects.filter(
+            work_set=workset, uid=OuterRef('uid'), aleph_hash=OuterRef('content_hash')
+        ).exclude(aleph_hash='')
+        seen_count = (
+            Work.objects.filter(work_set=workset)
+            .exclude(aleph_hash='')
+            .filter(
+                Exists(
+                    AlephEntry.objects.filter(
+                        uid=OuterRef('uid'),
+                        content_hash=OuterRef('aleph_hash'),
+                        last_updated__gt=OuterRef('last_updated'),
+                    ).exclude(**aleph_exclude)
+                )
+            )
+            .update(last_updated=now())
+        )
+        return aleph_entry_queryset.exclude(Exists(unchanged_work_filter)), seen_count
+
+    def sync_chunk(self, workset: WorkSet, uids: list, process_all: bool):
+        """
+        Syncs works with entries for a chunk of `uids`. Existing works and their copies are
+        fetched for the whole chunk and changes are written in bulk.
+        """
+        uid_to_work = {
+            work.uid: work for work in Work.objects.filter(work_set=workset, uid__in=uids)
+        }
+        sync_time = now()
+        to_create = []
+        to_update = []
+        unchanged_pks = []
+        copies_to_update = []
+        for aleph_entry in AlephEntry.objects.filter(uid__in=uids).order_by('uid'):
+            if settings.ALEPH_IGNORE_FUNCTION:
+                if settings.ALEPH_IGNORE_FUNCTION(aleph_entry):
+                    logger.info('Skipping ignored entry: %s', aleph_entry.uid)
+                    self.stats['skipped'] += 1
+                    self.ignored_to_delete.add(aleph_entry.uid)
+                    continue
+            values = self.work_values(workset, aleph_entry)
+            work = uid_to_work.get(aleph_entry.uid)
+            if work:
+                if self.same_aleph_data(work, aleph_entry) and all(
+                    getattr(work, field) == value for field, value in values.items()
+                ):
+                    self.stats['skipped'] += 1
+                    unchanged_pks.append(work.pk)
+                    # copies are derived from the aleph data which did not change
+                    if process_all:
+                        copies_to_update.append(work)
+                    continue
+                copies_changed = work.extra_data.get('aleph', {}).get(
+                    'copies'
+                ) != aleph_entry.raw_data.get('copies')
+                for field, value in values.items():
+                    setattr(work, field, value)
+                work.extra_data['aleph'] = aleph_entry.raw_data
+                work.aleph_hash = aleph_entry.content_hash
+                work.last_updated = sync_time
+                to_update.append(work)
+                self.stats['updated'] += 1
+                if process_all or copies_changed:
+                    copies_to_update.append(work)
+            else:
+                to_create.append(
+                    Work(
+                        uid=aleph_entry.uid,
+                        work_set=workset,
+                        extra_data={'aleph': aleph_entry.raw_data},
+                        aleph_hash=aleph_entry.content_hash,
+                        **values,
+                    )
+                )
+                self.stats['created'] += 1
+        Work.objects.bulk_update(
+            to_update, [*WORK_SYNC_FIELDS, 'extra_data', 'aleph_hash', 'last_updated']
+        )
+        Work.objects.bulk_create(to_create)
+        self.mark_unchanged_works(unchanged_pks)
+        update_copies_bulk(copies_to_update, self.copies_stats)
+        create_copies_bulk(to_create, self.copies_stats)
+
+    def work_values(self, workset: WorkSet, aleph_entry: AlephEntry) -> dict:
+        """
+        Computes values of `WORK_SYNC_FIELDS` from the Aleph data
+        """
+        lang_code = aleph_entry.raw_data.get('lang')
+        if lang_code is not None:
+            lang_id = self.lang_code_to_topic_id.get(lang_code)
+            if lang_id is None:
+                lang_topic = Language.objects.create(name=lang_code, work_set=workset)
+                self.lang_code_to_topic_id[lang_code] = lang_topic.pk
+                lang_id = lang_topic.pk
+        else:
+            lang_id = None
+        if catalog_date := aleph_entry.raw_data.get('catalog_date', '').strip():
+            if settings.CATALOG_DATE_FORMAT_FUNCTION:
+                fmt = settings.CATALOG_DATE_FORMAT_FUNCTION(catalog_date, aleph_entry)
+            else:
+                fmt = settings.CATALOG_DATE_FORMAT
+            try:
+                catalog_date = convert_date_string(catalog_date, fmt=fmt)
+            except (ValueError, IndexError) as exc:
+                self.catalog_date_stats['error'] += 1
+                logger.error(
+                    'Error converting date "%s": %s (UID: %s)',
+                    catalog_date,
+                    exc,
+                    aleph_entry.uid,
+                )
+                catalog_date = None
+            else:
+                self.catalog_date_stats['ok'] += 1
+        else:
+            self.catalog_date_stats['empty'] += 1
+            catalog_date = None
+        # publication data
+        start_yop, end_yop = extract_publication_years_from_marc(aleph_entry.raw_data)
+        return {
+            'name': get_title_from_marc(aleph_entry),
+            'lang_id': lang_id,
+            'start_yop': start_yop,
+            'end_yop': end_yop,
+            'isbn': extract_isbn(aleph_entry.raw_data),
+            'catalog_date': catalog_date,
+        }
+
     def handle(self, *args, **options):
         # get or create workset
         try:
@@ -60,7 +226,10 @@ class Command(BaseCommand):
                 logger.info("Created workset '%s', UUID: %s", workset.name, workset.uuid)
         logger.debug("Using workset '%s', UUID: %s", workset.name, workset.uuid)
         # let's import
-        stats = Counter()
+        self.stats = Counter()
+        self.catalog_date_stats = Counter()
+        self.copies_stats = Counter()
+        self.ignored_to_delete = set()
         basic_aleph_exclude = {
             'raw_data__lib_custom__0__a__in': settings.DISALLOWED_WORK_CATEGORIES
         }
@@ -81,122 +250,46 @@ class Command(BaseCommand):
                 .exclude(has_newer_work=True)
                 .exclude(**basic_aleph_exclude)
             )
-        lang_code_to_topic_id = {
+            if not settings.ALEPH_IGNORE_FUNCTION:
+                aleph_entry_queryset, skipped = self.skip_unchanged_entries(
+                    workset, aleph_entry_queryset, basic_aleph_exclude
+                )
+                self.stats['skipped'] += skipped
+        self.lang_code_to_topic_id = {
             topic['name']: topic['pk']
             for topic in Language.objects.filter(work_set=workset).values('pk', 'name')
         }
-        seen_work_pks = set()
-        total = aleph_entry_queryset.count()
-        catalog_date_stats = Counter()
-        copies_stats = Counter()
-        ignored_to_delete = set()
-        if total:
-            for aleph_entry in tqdm(aleph_entry_queryset.iterator(), total=total):
-                if settings.ALEPH_IGNORE_FUNCTION:
-                    if settings.ALEPH_IGNORE_FUNCTION(aleph_entry):
-                        logger.info('Skipping ignored entry: %s', aleph_entry.uid)
-                        stats['skipped'] += 1
-                        ignored_to_delete.add(aleph_entry.uid)
-                        continue
-                lang_code = aleph_entry.raw_data.get('lang')
-                if lang_code is not None:
-                    lang_id = lang_code_to_topic_id.get(lang_code)
-                    if lang_id is None:
-                        lang_topic = Language.objects.create(name=lang_code, work_set=workset)
-                        lang_code_to_topic_id[lang_code] = lang_topic.pk
-                        lang_id = lang_topic.pk
-                else:
-                    lang_id = None
-                if catalog_date := aleph_entry.raw_data.get('catalog_date', '').strip():
-                    if settings.CATALOG_DATE_FORMAT_FUNCTION:
-                        fmt = settings.CATALOG_DATE_FORMAT_FUNCTION(catalog_date, aleph_entry)
-                    else:
-                        fmt = settings.CATALOG_DATE_FORMAT
-                    try:
-                        catalog_date = convert_date_string(catalog_date, fmt=fmt)
-                    except (ValueError, IndexError) as exc:
-                        catalog_date_stats['error'] += 1
-                        logger.error(
-                            'Error converting date "%s": %s (UID: %s)',
-                            catalog_date,
-                            exc,
-                            aleph_entry.uid,
-                        )
-                        catalog_date = None
-                    else:
-                        catalog_date_stats['ok'] += 1
-                else:
-                    catalog_date_stats['empty'] += 1
-                    catalog_date = None
-
-                # publication data
-                start_yop, end_yop = extract_publication_years_from_marc(aleph_entry.raw_data)
-                # find a name
-                name = get_title_from_marc(aleph_entry)
-                isbn_list = extract_isbn(aleph_entry.raw_data)
-                try:
-                    work = Work.objects.get(work_set=workset, uid=aleph_entry.uid)
-                except Work.DoesNotExist:
-                    work = None
-                if work:
-                    if (
-                        work.name == name
-                        and work.lang_id == lang_id
-                        and work.start_yop == start_yop
-                        and work.end_yop == end_yop
-                        and work.extra_data.get('aleph', {}) == aleph_entry.raw_data
-                        and work.isbn == isbn_list
-                        and work.catalog_date == catalog_date
-                    ):
-                        stats['skipped'] += 1
-                        work.save()  # we save to update last_updated date
-                    else:
-                        work.name = name
-                        work.extra_data['aleph'] = aleph_entry.raw_data
-                        work.lang_id = lang_id
-                        work.start_yop = start_yop
-                        work.end_yop = end_yop
-                        work.isbn = isbn_list
-                        work.catalog_date = catalog_date
-                        work.save()
-                        stats['updated'] += 1
-                    if options['all'] or work.extra_data.get('aleph', {}).get(
-                        'copies'
-                    ) != aleph_entry.raw_data.get('copies'):
-                        update_copies(work, copies_stats)
-                else:
-                    work = Work.objects.create(
-                        uid=aleph_entry.uid,
-                        work_set=workset,
-                        name=name,
-                        lang_id=lang_id,
-                        extra_data={'aleph': aleph_entry.raw_data},
-                        start_yop=start_yop,
-                        end_yop=end_yop,
-                        isbn=isbn_list,
-                        catalog_date=catalog_date,
-                    )
-                    create_copies(work, copies_stats)
-                    stats['created'] += 1
-                seen_work_pks.add(work.pk)
+        uids = list(aleph_entry_queryset.order_by('uid').values_list('uid', flat=True))
+        if uids:
+            with tqdm(total=len(uids)) as progress:
+                for i in range(0, len(uids), options['batch_size']):
+                    chunk = uids[i : i + options['batch_size']]
+                    with atomic():
+                        self.sync_chunk(workset, chunk, options['all'])
+                    progress.update(len(chunk))
         else:
             # there was nothing to sync
             logger.info('Nothing to sync')
         # let's process entries to be deleted
+        self.delete_extra_works(options['delete_extra'], basic_aleph_exclude)
+        bump_data_generation(workset)
+        logger.info("Stats: %s", self.stats)
+        logger.info("Catalog date stats: %s", self.catalog_date_stats)
+        logger.info("Work copies stats: %s", self.copies_stats)
+
+    @atomic
+    def delete_extra_works(self, delete: bool, basic_aleph_exclude: dict):
         aleph_entry_filter = AlephEntry.objects.filter(uid=OuterRef('uid')).exclude(
             **basic_aleph_exclude
         )
         work_qs = Work.objects.annotate(has_entry=Exists(aleph_entry_filter)).filter(
             has_entry=False
         )
-        if options['delete_extra']:
-            stats['deleted'] = work_qs.delete()
-            stats['deleted'] = Work.objects.filter(uid__in=ignored_to_delete).delete()
+        if delete:
+            self.stats['deleted'] = work_qs.delete()
+            self.stats['deleted'] = Work.objects.filter(uid__in=self.ignored_to_delete).delete()
         else:
-            stats['to delete - not deleted'] = work_qs.count()
-            stats['to delete - not deleted'] += Work.objects.filter(
-                uid__in=ignored_to_delete
+            self.stats['to delete - not deleted'] = work_qs.count()
+            self.stats['to delete - not deleted'] += Work.objects.filter(
+                uid__in=self.ignored_to_delete
             ).count()
-        logger.info("Stats: %s", stats)
-        logger.info("Catalog date stats: %s", catalog_date_stats)
-        logger.info("Work copies stats: %s", copies_stats)
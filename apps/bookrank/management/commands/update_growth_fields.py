@@ -3,6 +3,7 @@ import logging
 from django.core.management.base import BaseCommand
 
 from ...logic.static_score import update_growth_fields
+from ...logic.topics import update_subject_tree_snapshots
 from ...models import WorkSet
 
 logger = logging.getLogger(__name__)
@@ -24,3 +25,4 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         work_set, _ = WorkSet.objects.get_or_create(name=options['work_set'])
         update_growth_fields(work_set)
+        logger.info('Updated %d subject tree snapshots', update_subject_tree_snapshots(work_set))
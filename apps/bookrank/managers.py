@@ -21,7 +21,7 @@ from django.db.models.functions import Coalesce, TruncYear, Least
 from django.utils import timezone
 from mptt.managers import TreeManager, TreeQuerySet
 
-from core.logic.query import prefix_query_filter
+from hits.logic.rollups import hit_sum_expression
 
 DAYS_IN_YR = 365
 
@@ -29,19 +29,34 @@ DAYS_IN_YR = 365
 class BaseScoresQuerySet(QuerySet):
     works_prefix = ''
 
+    @property
+    def hit_work_lookup(self) -> str:
+        """
+        Lookup from a hit's `work` to the objects of this queryset
+        """
+        if not self.works_prefix:
+            return 'work'
+        return f'work__{self.model._meta.get_field("works").remote_field.name}'
+
+    def hit_score(self, hit_date_filter=None, hit_type_filter=None, work_filter=None):
+        """
+        Expression giving the sum of hits related to each object. It uses hit rollups
+        where possible, so it should be preferred over `Sum('workhit__value')`.
+        """
+        return hit_sum_expression(
+            self.hit_work_lookup,
+            date_filter=hit_date_filter,
+            hit_type_filter=hit_type_filter,
+            work_filter=work_filter,
+        )
+
     def scores_for_last_two_yrs(self):
-        b4_12_mo = timezone.now() - timedelta(days=DAYS_IN_YR)
+        b4_12_mo = timezone.localdate() - timedelta(days=DAYS_IN_YR)
         b4_24_mo = b4_12_mo - timedelta(days=DAYS_IN_YR)
-        past_yr_filter = Q(**{f'{self.works_prefix}workhit__date__gte': b4_12_mo})
-        yr_b4_filter = Q(**{f'{self.works_prefix}workhit__date__gte': b4_24_mo}) & Q(
-            **{f'{self.works_prefix}workhit__date__lt': b4_12_mo}
-        )
         return self.annotate(
-            annotated_score_past_yr=Coalesce(
-                Sum(f'{self.works_prefix}workhit__value', filter=past_yr_filter), 0
-            ),
+            annotated_score_past_yr=Coalesce(self.hit_score({'date__gte': b4_12_mo}), 0),
             annotated_score_yr_b4=Coalesce(
-                Sum(f'{self.works_prefix}workhit__value', filter=yr_b4_filter), 0
+                self.hit_score({'date__gte': b4_24_mo, 'date__lt': b4_12_mo}), 0
             ),
         )
 
@@ -92,16 +107,14 @@ class WorkQuerySet(BaseScoresQuerySet):
         )
 
     def annotate_score(self, score_type='full_score', hit_date_filter=None, low_level=False):
-        hit_filter = Q()
+        if score_type != 'acquisition_score':
+            return self.annotate(score=Coalesce(self.hit_score(hit_date_filter), 0))
         qs = self
-        if score_type == 'acquisition_score':
-            date_field = 'acquisition_date'
-            if low_level:
-                qs = qs.annotate_acquisition_date()
-                date_field = 'annotated_acquisition_date'
-            hit_filter = Q(workhit__date__lte=F(date_field) + timedelta(days=365))
-        elif hit_date_filter:
-            hit_filter = Q(**prefix_query_filter(hit_date_filter, 'workhit__'))
+        date_field = 'acquisition_date'
+        if low_level:
+            qs = qs.annotate_acquisition_date()
+            date_field = 'annotated_acquisition_date'
+        hit_filter = Q(workhit__date__lte=F(date_field) + timedelta(days=365))
         return qs.annotate(score=Coalesce(Sum('workhit__value', filter=hit_filter), 0))
 
     def new_works_acquisition_score(self):
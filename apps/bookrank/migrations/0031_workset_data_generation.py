@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('bookrank', '0030_work_static_fields_update')]
+
+    operations = [
+        migrations.AddField(
+            model_name='workset',
+            name='data_generation',
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text='Incremented whenever hits, scores or topics of the workset change - '
+                'used to invalidate cached analytics responses',
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [('bookrank', '0031_workset_data_generation')]
+
+    operations = [
+        migrations.AddField(
+            model_name='work',
+            name='aleph_hash',
+            field=models.CharField(
+                blank=True,
+                default='',
+                help_text='`content_hash` of the AlephEntry stored in `extra_data`, empty if not '
+                'known',
+                max_length=32,
+            ),
+        )
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+TOPIC_TABLES = [
+    'bookrank_author',
+    'bookrank_language',
+    'bookrank_ownerinstitution',
+    'bookrank_publisher',
+    'bookrank_subjectcategory',
+    'bookrank_workcategory',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookrank', '0032_work_aleph_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='static_score_all',
+            field=models.FloatField(
+                db_index=True,
+                default=0,
+                help_text='`score_all` from `static_score` in a typed column used for ordering',
+            ),
+        ),
+        migrations.AddField(
+            model_name='language',
+            name='static_score_all',
+            field=models.FloatField(
+                db_index=True,
+                default=0,
+                help_text='`score_all` from `static_score` in a typed column used for ordering',
+            ),
+        ),
+        migrations.AddField(
+            model_name='ownerinstitution',
+            name='static_score_all',
+            field=models.FloatField(
+                db_index=True,
+                default=0,
+                help_text='`score_all` from `static_score` in a typed column used for ordering',
+            ),
+        ),
+        migrations.AddField(
+            model_name='publisher',
+            name='static_score_all',
+            field=models.FloatField(
+                db_index=True,
+                default=0,
+                help_text='`score_all` from `static_score` in a typed column used for ordering',
+            ),
+        ),
+        migrations.AddField(
+            model_name='subjectcategory',
+            name='static_score_all',
+            field=models.FloatField(
+                db_index=True,
+                default=0,
+                help_text='`score_all` from `static_score` in a typed column used for ordering',
+            ),
+        ),
+        migrations.AddField(
+            model_name='workcategory',
+            name='static_score_all',
+            field=models.FloatField(
+                db_index=True,
+                default=0,
+                help_text='`score_all` from `static_score` in a typed column used for ordering',
+            ),
+        ),
+    ] + [
+        migrations.RunSQL(
+            f"UPDATE {table} SET static_score_all = "
+            f"COALESCE((static_score ->> 'score_all')::float, 0);",
+            migrations.RunSQL.noop,
+        )
+        for table in TOPIC_TABLES
+    ]
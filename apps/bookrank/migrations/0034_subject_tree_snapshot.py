@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookrank', '0033_static_score_all'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubjectTreeSnapshot',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('score_type', models.CharField(max_length=20)),
+                ('data_generation', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                (
+                    'root',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='tree_snapshots',
+                        to='bookrank.subjectcategory',
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('root', 'score_type')},
+            },
+        ),
+    ]
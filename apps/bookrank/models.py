@@ -25,6 +25,11 @@ class WorkSet(CreatedUpdatedMixin, models.Model):
     uuid = models.UUIDField(default=uuid4, unique=True)
     name = models.TextField(blank=True)
     description = models.TextField(blank=True)
+    data_generation = models.PositiveIntegerField(
+        default=0,
+        help_text='Incremented whenever hits, scores or topics of the workset change - used '
+        'to invalidate cached analytics responses',
+    )
 
     class Meta:
         ordering = ("-created",)
@@ -42,6 +47,11 @@ class ExplicitTopic(CreatedUpdatedMixin, models.Model):
     # used for calculating candidate score
     static_score = JSONField(default=dict, blank=True)
     normalized_score = JSONField(default=dict)
+    static_score_all = models.FloatField(
+        default=0,
+        db_index=True,
+        help_text='`score_all` from `static_score` in a typed column used for ordering',
+    )
     # static growth fields
     score_past_yr = models.IntegerField(blank=True, null=True)
     score_yr_b4 = models.IntegerField(blank=True, null=True)
@@ -56,6 +66,10 @@ class ExplicitTopic(CreatedUpdatedMixin, models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.static_score_all = self.static_score.get('score_all') or 0
+        super().save(*args, **kwargs)
+
 
 class Publisher(ExplicitTopic):
 
@@ -103,6 +117,24 @@ class SubjectCategory(ExplicitTopic, MPTTModel):
     objects = SubjectCategoryManager()
 
 
+class SubjectTreeSnapshot(models.Model):
+    """
+    Precomputed subject tree under `root` as served by the subject tree view - zlib compressed
+    JSON. It is valid only as long as the `data_generation` of the work set does not change.
+    """
+
+    root = models.ForeignKey(
+        SubjectCategory, on_delete=models.CASCADE, related_name='tree_snapshots'
+    )
+    score_type = models.CharField(max_length=20)
+    data_generation = models.PositiveIntegerField()
+    data = models.BinaryField()
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('root', 'score_type'),)
+
+
 class PublisherWork(models.Model):
 
     topic = models.ForeignKey(Publisher, on_delete=models.CASCADE)
@@ -129,6 +161,12 @@ class Work(CreatedUpdatedMixin, models.Model):
     work_set = models.ForeignKey(WorkSet, on_delete=models.CASCADE, related_name='works')
     abstract = models.TextField(blank=True)
     extra_data = JSONField(default=dict, blank=True)
+    aleph_hash = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        help_text='`content_hash` of the AlephEntry stored in `extra_data`, empty if not known',
+    )
     # explicit topics
     category = models.ForeignKey(
         WorkCategory, null=True, on_delete=models.SET_NULL, related_name='works'
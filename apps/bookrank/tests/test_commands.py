@@ -5,11 +5,20 @@ import pytest
 from django.core.management import call_command
 from django.utils.timezone import now
 
+from aleph.logic.data_import import content_hash
 from aleph.models import AlephEntry
 from bookrank.logic.cleanup import remove_unpaired_quotes, normalize_name
-from bookrank.logic.static_score import YEARS, update_static_scores
-from bookrank.models import Author, Publisher, SubjectCategory, Work, WorkSet
-from bookrank.tests.fake_data import WorkFactory
+from bookrank.logic.static_score import YEARS, update_growth_fields, update_static_scores
+from bookrank.models import (
+    Author,
+    Language,
+    Publisher,
+    SubjectCategory,
+    Work,
+    WorkCopy,
+    WorkSet,
+)
+from bookrank.tests.fake_data import AuthorFactory, WorkFactory, WorkSetFactory
 from candidates.models import Candidate
 from hits.models import WorkHit
 from hits.tests.fake_data import WorkHitFactory
@@ -208,6 +217,79 @@ class TestSyncWorksWithAleph:
         assert Work.objects.count() == 0
         call_command('sync_works_with_aleph', 'test')
         assert Work.objects.count() == 1
+        assert (
+            WorkSet.objects.get(name='test').data_generation > 0
+        ), 'cached responses must be invalidated'
+
+    def test_batches_with_copies(self):
+        for i in range(5):
+            data = {
+                "lang": "cze",
+                "title": [{"a": f"Title {i}"}],
+                "copies": [{"f": "100 Kč", "d": "20200101"}] * i,
+            }
+            AlephEntry.objects.create(uid=f'00000000{i}', raw_data=data)
+        call_command('sync_works_with_aleph', 'test', batch_size=2)
+        assert Work.objects.count() == 5
+        assert Language.objects.count() == 1
+        assert WorkCopy.objects.count() == 10
+        assert Work.objects.get(uid='000000003').copies.count() == 3
+        # one copy removed, one added, one changed
+        entry = AlephEntry.objects.get(uid='000000003')
+        entry.raw_data['copies'] = [{"f": "200 Kč", "d": "20200101"}]
+        entry.save()
+        entry = AlephEntry.objects.get(uid='000000001')
+        entry.raw_data['copies'].append({"f": "50 EUR", "d": "20210101"})
+        entry.raw_data['title'] = [{"a": "New title"}]
+        entry.save()
+        call_command('sync_works_with_aleph', 'test', batch_size=2)
+        assert WorkCopy.objects.count() == 9
+        assert list(Work.objects.get(uid='000000003').copies.values_list('price', flat=True)) == [
+            200
+        ]
+        work = Work.objects.get(uid='000000001')
+        assert work.name == 'New title'
+        assert list(work.copies.order_by('created').values_list('currency', flat=True)) == [
+            'CZK',
+            'EUR',
+        ]
+
+    def test_content_hash(self):
+        data = {"lang": "cze", "title": [{"a": "Foo bar baz"}], "catalog_date": "170305"}
+        entry = AlephEntry.objects.create(
+            uid='123456789', raw_data=data, content_hash=content_hash(data)
+        )
+        call_command('sync_works_with_aleph', 'test')
+        work = Work.objects.get()
+        assert work.aleph_hash == entry.content_hash
+        # the entry was seen again without change - the work is only marked as seen
+        AlephEntry.objects.filter(pk=entry.pk).update(last_updated=now() + timedelta(hours=1))
+        last_updated = work.last_updated
+        call_command('sync_works_with_aleph', 'test')
+        work.refresh_from_db()
+        assert work.last_updated > last_updated
+        assert work.name == 'Foo bar baz'
+        # the entry was changed
+        data = {**data, 'title': [{'a': 'New title'}]}
+        AlephEntry.objects.filter(pk=entry.pk).update(
+            raw_data=data, content_hash=content_hash(data), last_updated=now() + timedelta(hours=2)
+        )
+        call_command('sync_works_with_aleph', 'test')
+        work.refresh_from_db()
+        assert work.name == 'New title'
+        assert work.aleph_hash == content_hash(data)
+
+    def test_content_hash_filled_in(self):
+        data = {"lang": "cze", "title": [{"a": "Foo bar baz"}], "catalog_date": "170305"}
+        AlephEntry.objects.create(uid='123456789', raw_data=data)
+        call_command('sync_works_with_aleph', 'test')
+        work = Work.objects.get()
+        assert work.aleph_hash == ''
+        # hash was computed later on, e.g. by a new import
+        AlephEntry.objects.update(content_hash=content_hash(data), last_updated=now())
+        call_command('sync_works_with_aleph', 'test')
+        work.refresh_from_db()
+        assert work.aleph_hash == content_hash(data)
 
 
 @pytest.mark.django_db
@@ -245,6 +327,31 @@ class TestUpdateGrowthFields:
         else:
             assert work.relative_growth is None
 
+    def test_update_growth_fields_topics(self):
+        work_set = WorkSetFactory.create()
+        authors = AuthorFactory.create_batch(3, work_set=work_set)
+        works = [
+            WorkFactory.create(work_set=work_set, authors=authors[:2]),
+            WorkFactory.create(work_set=work_set, authors=authors[1:2]),
+            WorkFactory.create(work_set=work_set, authors=[]),
+        ]
+        today = now().date()
+        for i, work in enumerate(works):
+            for days_back in (10, 200, 400, 700, 800):
+                WorkHitFactory.create(
+                    work=work, date=today - timedelta(days=days_back), value=days_back + i
+                )
+        stats = update_growth_fields(work_set)
+        assert stats['Work_objects_updated'] == 3
+        for model in (Work, Author, Publisher, Language):
+            fields = ['score_past_yr', 'score_yr_b4', 'absolute_growth', 'relative_growth']
+            for obj in model.objects.filter(work_set=work_set).annotate_relative_growth():
+                for field in fields:
+                    assert getattr(obj, field) == pytest.approx(getattr(obj, f'annotated_{field}'))
+        assert Author.objects.get(pk=authors[2].pk).score_past_yr == 0
+        # nothing changed - nothing is updated
+        assert not any(update_growth_fields(work_set).values())
+
 
 @pytest.mark.django_db
 class TestExtractExplicitTopics:
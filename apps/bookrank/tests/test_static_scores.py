@@ -1,10 +1,21 @@
 from collections import Counter
+from datetime import date
 
 import pytest
 
-from bookrank.logic.static_score import update_static_scores
-from bookrank.tests.fake_data import WorkSetFactory, AuthorFactory, WorkFactory
-from hits.tests.fake_data import WorkHitFactory
+from bookrank.logic.static_score import (
+    SCORE_KEYS,
+    get_maximums,
+    maximums_after_deltas,
+    stored_maximums,
+    update_static_scores,
+)
+from bookrank.models import Author, Publisher
+from bookrank.tests.fake_data import WorkSetFactory, AuthorFactory, WorkFactory, PublisherFactory
+from candidates.tests.fake_data import CandidateFactory
+from hits.logic.workhit_data import sync_workhits_with_db
+from hits.models import WorkHit
+from hits.tests.fake_data import WorkHitFactory, HitTypeFactory
 
 
 @pytest.mark.django_db
@@ -22,3 +33,62 @@ class TestStaticScores:
         update_static_scores(work_set, stats)
         a1.refresh_from_db()
         assert a1.static_score['score_all'] == 47
+        assert a1.static_score_all == 47
+
+    @pytest.mark.parametrize('replace_existing', [False, True])
+    def test_incremental_update_matches_full_recompute(self, replace_existing):
+        work_set = WorkSetFactory.create()
+        a1, a2 = AuthorFactory.create_batch(2, work_set=work_set)
+        p1 = PublisherFactory.create(work_set=work_set)
+        CandidateFactory.create(authors=[a1, a2], publisher=p1)
+        work1 = WorkFactory.create(work_set=work_set, authors=[a1], publishers=[p1])
+        work2 = WorkFactory.create(work_set=work_set, authors=[a1, a2], publishers=[p1])
+        work3 = WorkFactory.create(work_set=work_set, authors=[a2])
+        hit_type = HitTypeFactory.create()
+        WorkHitFactory.create(date='2012-05-06', value=11, work=work1, typ=hit_type)
+        WorkHitFactory.create(date='2021-01-06', value=19, work=work2, typ=hit_type)
+        update_static_scores(work_set)
+        new_hits = [
+            WorkHit(work=work1, typ=hit_type, date=date(2012, 5, 6), value=5),
+            WorkHit(work=work2, typ=hit_type, date=date(2016, 3, 1), value=7),
+            WorkHit(work=work3, typ=hit_type, date=date(2021, 2, 1), value=100),
+        ]
+        stats = sync_workhits_with_db(hit_type, new_hits, replace_existing=replace_existing)
+        assert stats['replace' if replace_existing else 'no replace'] == 1
+        for model, field in ((Author, 'authors'), (Publisher, 'publishers')):
+            assert stored_maximums(model, field) == get_maximums(model.objects.all(), field)
+        models = (Author, Publisher)
+        incremental = {
+            model: {
+                obj.pk: (obj.static_score, obj.static_score_all, obj.normalized_score)
+                for obj in model.objects.filter(work_set=work_set)
+            }
+            for model in models
+        }
+        update_static_scores(work_set)
+        for model in models:
+            for obj in model.objects.filter(work_set=work_set):
+                assert incremental[model][obj.pk] == (
+                    obj.static_score,
+                    obj.static_score_all,
+                    obj.normalized_score,
+                )
+        a2.refresh_from_db()
+        assert a2.static_score['score_2020'] == 119
+        assert a2.static_score_all == a2.static_score['score_all']
+        assert a2.normalized_score['score_all'] == 100
+
+    def test_maximums_after_deltas(self):
+        work_set = WorkSetFactory.create()
+        a1 = AuthorFactory.create(work_set=work_set)
+        CandidateFactory.create(authors=[a1])
+        maxs = {f'{key}_max': 10.0 for key in SCORE_KEYS}
+        old = {key: 10 for key in SCORE_KEYS}
+        higher = {key: 12 for key in SCORE_KEYS}
+        lower = {key: 8 for key in SCORE_KEYS}
+        new_maxs = maximums_after_deltas(Author, 'authors', maxs, {a1.pk: old}, {a1.pk: higher})
+        assert new_maxs == {f'{key}_max': 12.0 for key in SCORE_KEYS}
+        assert maximums_after_deltas(Author, 'authors', maxs, {a1.pk: lower}, {a1.pk: old}) == maxs
+        assert (
+            maximums_after_deltas(Author, 'authors', maxs, {a1.pk: old}, {a1.pk: lower}) is None
+        ), 'the maximum decreased, all topics must be scanned'
@@ -1,6 +1,26 @@
 import pytest
 
-from ..logic.topics import marc_author_topics, marc_subject_topics
+from ..logic.topics import (
+    TopicExtraction,
+    extract_explicit_topics,
+    extract_fk_explicit_topics_from_works,
+    extract_m2m_explicit_topics_from_works,
+    marc_author_topics,
+    marc_lang_topics,
+    marc_owner_institution_topics,
+    marc_publisher_topics,
+    marc_subject_topics,
+)
+from ..models import (
+    Author,
+    AuthorWork,
+    Language,
+    OwnerInstitution,
+    Publisher,
+    PublisherWork,
+    Work,
+)
+from .fake_data import AuthorFactory, WorkFactory, WorkSetFactory
 
 
 @pytest.mark.django_db()
@@ -12,3 +32,77 @@ class TestTopicExtraction(object):
         subjects1 = marc_subject_topics(works[0])
         assert len(subjects1) == 2, "no psh stuff, it is handled in a separate function"
         assert subjects1[0] == ("629.331(091)", 'MRF', 1.0)
+
+
+@pytest.mark.django_db()
+class TestBatchedExtraction:
+    def test_m2m_extraction(self, django_assert_max_num_queries):
+        work_set = WorkSetFactory.create()
+        kept, removed = AuthorFactory.create_batch(2, work_set=work_set)
+        works = [
+            WorkFactory.create(
+                work_set=work_set,
+                authors=[kept, removed],
+                extra_data={'aleph': {'author': [{'a': kept.name}, {'a': f'New {i}'}]}},
+            )
+            for i in range(5)
+        ]
+        with django_assert_max_num_queries(30):
+            stats = extract_m2m_explicit_topics_from_works(
+                work_set, marc_author_topics, Author, AuthorWork
+            )
+        assert stats == {'skipped': 5, 'created': 5, 'disconnected': 5}
+        for i, work in enumerate(works):
+            assert {a.name for a in work.authors.all()} == {kept.name, f'New {i}'}
+        # second run changes nothing
+        stats = extract_m2m_explicit_topics_from_works(
+            work_set, marc_author_topics, Author, AuthorWork
+        )
+        assert stats == {'skipped': 10}
+
+    def test_fk_extraction(self):
+        work_set = WorkSetFactory.create()
+        works = [
+            WorkFactory.create(work_set=work_set, extra_data={'aleph': {'lang': lang}})
+            for lang in ('cze', 'eng', 'cze', None)
+        ]
+        stats = extract_fk_explicit_topics_from_works(work_set, marc_lang_topics, Language, 'lang')
+        assert stats == {'created': 2, 'connected': 3, 'disconnected': 1}
+        assert [
+            work.lang.name if work.lang else None
+            for work in Work.objects.filter(pk__in=[w.pk for w in works]).order_by('pk')
+        ] == ['cze', 'eng', 'cze', None]
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_extract_explicit_topics(self, jobs):
+        work_set = WorkSetFactory.create()
+        works = [
+            WorkFactory.create(
+                work_set=work_set,
+                authors=[],
+                publishers=[],
+                extra_data={
+                    'aleph': {
+                        'author': [{'a': f'Author {i % 3}'}],
+                        'pub': [{'b': f'Publisher {i % 2}'}],
+                        'lib_info': [{'a': 'ABBA 007'}],
+                    }
+                },
+            )
+            for i in range(7)
+        ]
+        extractions = [
+            TopicExtraction('author', marc_author_topics, Author, AuthorWork),
+            TopicExtraction('publisher', marc_publisher_topics, Publisher, PublisherWork),
+            TopicExtraction('owner_institution', marc_owner_institution_topics, OwnerInstitution),
+        ]
+        stats = extract_explicit_topics(work_set, extractions, jobs=jobs, batch_size=2)
+        assert stats['author'] == {'created': 3, 'connected': 4}
+        assert stats['publisher'] == {'created': 2, 'connected': 5}
+        assert stats['owner_institution'] == {'created': 1, 'connected': 7}
+        assert Author.objects.filter(work_set=work_set).count() == 3
+        for i, work in enumerate(works):
+            work.refresh_from_db()
+            assert [a.name for a in work.authors.all()] == [f'Author {i % 3}']
+            assert [p.name for p in work.publishers.all()] == [f'Publisher {i % 2}']
+            assert work.owner_institution.name == 'ABBA 007'
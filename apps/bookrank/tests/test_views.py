@@ -3,11 +3,21 @@ from datetime import date, timedelta
 
 import pytest
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.timezone import now
 
 from bookrank.logic.static_score import update_static_scores, update_growth_fields
-from bookrank.models import Publisher, SubjectCategory, Work, Author, AuthorWork
+from bookrank.logic.topics import update_subject_tree_snapshots
+from bookrank.models import (
+    Publisher,
+    SubjectCategory,
+    SubjectTreeSnapshot,
+    Work,
+    Author,
+    AuthorWork,
+)
 from bookrank.tests.fake_data import (
     WorkSetFactory,
     WorkFactory,
@@ -162,6 +172,34 @@ class TestFullSubjectTreeView:
         t2_rec = find_recursive(data, t2.pk)
         assert t2_rec['score'] == 6
 
+    def test_view_snapshot(self, admin_client):
+        """
+        Tests that the tree is served from a snapshot which is replaced when the data change
+        """
+        work_set = WorkSetFactory.create()
+        call_command(
+            'make_thema_tree', work_set, 'apps/bookrank/tests/data/thema_test_small_deep.json'
+        )
+        thema_root = SubjectCategory.objects.get(uid='THEMA-ROOT')
+        t1 = SubjectCategory.objects.get(uid="PNN")
+        work = WorkFactory.create(work_set=work_set, subject_categories=[t1])
+        WorkHitFactory.create(work=work, value=4, date=now().date() - timedelta(days=10))
+        update_static_scores(work_set)
+        assert update_subject_tree_snapshots(work_set) == 2, 'one root, score and growth'
+        url = reverse('bookrank:full_subject_tree', args=[work_set.uuid, thema_root.uid])
+        p_rec = [rec for rec in admin_client.get(url).json()['tree'] if rec['uid'] == 'P'][0]
+        assert p_rec['acc_score'] == 4
+        assert p_rec['acc_work_count'] == 1
+        SubjectCategory.objects.filter(uid='P').update(name='Changed')
+        p_rec = [rec for rec in admin_client.get(url).json()['tree'] if rec['uid'] == 'P'][0]
+        assert p_rec['name'] != 'Changed', 'the snapshot is used until the data change'
+        WorkHitFactory.create(work=work, value=3, date=now().date() - timedelta(days=5))
+        update_static_scores(work_set)
+        p_rec = [rec for rec in admin_client.get(url).json()['tree'] if rec['uid'] == 'P'][0]
+        assert p_rec['name'] == 'Changed'
+        assert p_rec['acc_score'] == 7
+        assert SubjectTreeSnapshot.objects.filter(root=thema_root).count() == 2
+
     @pytest.mark.parametrize(
         ['candidate_count_filters', 'scores'],
         [
@@ -214,6 +252,25 @@ class TestFullSubjectTreeView:
         j_parent_rec = find_recursive(data, j_parent.pk)
         assert [t1_rec['acc_score'], t2_rec['acc_score'], j_parent_rec['acc_score']] == scores
 
+    def test_view_with_candidates_not_cached(self, admin_client):
+        """
+        Candidates may change without a new data generation, so candidate counts are not cached
+        """
+        work_set = WorkSetFactory.create()
+        call_command(
+            'make_thema_tree', work_set, 'apps/bookrank/tests/data/thema_test_small_deep.json'
+        )
+        thema_root = SubjectCategory.objects.get(uid='THEMA-ROOT')
+        url = reverse('bookrank:full_subject_tree', args=[work_set.uuid, thema_root.uid])
+
+        def j_count():
+            tree = admin_client.get(url, {'score_type': 'candidates_count'}).json()['tree']
+            return [rec for rec in tree if rec['uid'] == 'J'][0]['acc_score']
+
+        assert j_count() == 0
+        CandidateFactory.create(subjects=[SubjectCategory.objects.get(uid='JBC')])
+        assert j_count() == 1
+
 
 @pytest.mark.django_db()
 class TestETFiltersViewSet:
@@ -255,6 +312,31 @@ class TestETFiltersViewSet:
         for rec in data:
             assert rec['candidates_count'] == (1 if rec['pk'] in c1_authors else 0)
 
+    def test_show_candidates_count_query_count(self, admin_client):
+        """
+        Candidate counts are computed for the whole page at once
+        """
+        query_counts = []
+        for batch_size in (2, 10):
+            work_set = WorkSetFactory.create(name=f'{batch_size} authors')
+            authors = AuthorFactory.create_batch(batch_size, work_set=work_set)
+            # the i-th author has i candidates
+            for i, author in enumerate(authors):
+                CandidateFactory.create_batch(i, authors=[author])
+            url = reverse('bookrank:et_filters-list', args=[work_set.uuid, 'author'])
+            # the first request also loads the session and the user
+            admin_client.get(url)
+            with CaptureQueriesContext(connection) as ctx:
+                resp = admin_client.get(url, {'show_candidates_count': 1})
+            assert resp.status_code == 200
+            query_counts.append(len(ctx.captured_queries))
+            data = resp.json()['results']
+            assert len(data) == batch_size
+            assert {rec['pk']: rec['candidates_count'] for rec in data} == {
+                author.pk: i for i, author in enumerate(authors)
+            }
+        assert query_counts[0] == query_counts[1]
+
     @pytest.mark.parametrize(['score_type'], [('score',), ('growth',)])
     def test_different_scores(self, admin_client, score_type):
         work_set = WorkSetFactory.create()
@@ -8,15 +8,12 @@ from django.core.exceptions import BadRequest
 from django.db.models import (
     F,
     Count,
-    Sum,
     Exists,
     OuterRef,
     Q,
     QuerySet,
     Prefetch,
     IntegerField,
-    Case,
-    When,
 )
 from django.db.models.functions import Coalesce, TruncYear, Cast
 from rest_framework import viewsets, status
@@ -29,7 +26,8 @@ from candidates.models import Candidate
 from hits.logic.request_attrs import date_filter_from_request
 from hits.models import HitType
 from . import models
-from .logic.topics import build_subject_tree
+from .logic.response_cache import cached_analytics_response
+from .logic.topics import get_subject_tree
 from .models import SubjectCategory
 from .serializers import (
     WorkSerializer,
@@ -97,7 +95,7 @@ class WorkViewSet(viewsets.ModelViewSet):
         )
         if search_string:
             queryset = queryset.annotate(
-                similarity=TrigramSimilarity('name', search_string), score=Sum('workhit__value')
+                similarity=TrigramSimilarity('name', search_string), score=queryset.hit_score()
             ).order_by('-similarity', F('score').desc(nulls_last=True))
         return queryset
 
@@ -126,6 +124,7 @@ class WorkViewSet(viewsets.ModelViewSet):
         return get_object_or_404(qs, pk=pk)
 
     @action(detail=False)
+    @cached_analytics_response()
     def top_items(self, request, workset_pk=None):
         date_filter = date_filter_from_request(request)
         qs = models.Work.objects.filter(work_set__uuid=workset_pk)
@@ -204,14 +203,14 @@ class ExplicitTopicViewSet(viewsets.ReadOnlyModelViewSet):
                 queryset = queryset.filter(name__icontains=word)
             queryset = queryset.annotate(
                 similarity=TrigramSimilarity('name', search_string),
-                score=Sum('works__workhit__value'),
+                score=queryset.hit_score(),
             ).order_by('-similarity', F('score').desc(nulls_last=True))
         else:
             # the following is a workaround for a veeery long query produced without this trick
             # in my tests, the original query did not finish in 30 min, while this one takes a
             # few soconds
             # queryset = model.objects.filter(pk__in=queryset)
-            queryset = queryset.annotate(score=Sum('works__workhit__value')).order_by(
+            queryset = queryset.annotate(score=queryset.hit_score()).order_by(
                 F('score').desc(nulls_last=True)
             )
         return queryset
@@ -298,26 +297,25 @@ class ETFilterViewSet(ExplicitTopicViewSet, BaseDataTableViewSet):
         if score_type == 'growth':
             qs = qs.order_by(F('relative_growth').desc(nulls_last=True))
         else:
-            qs = qs.annotate(
-                score=Case(
-                    When(
-                        static_score__has_key='score_all',
-                        then=Cast('static_score__score_all', IntegerField()),
-                    ),
-                    default=0,
-                )
-            ).order_by('-score')
+            qs = qs.annotate(score=Cast('static_score_all', IntegerField())).order_by(
+                '-static_score_all'
+            )
         return self.apply_filters(qs)
 
     def get_paginated_response(self, data):
         if self.request.query_params.get('show_candidates_count') == '1':
             field = self.topic_to_candidate_field[self.kwargs['topic_type']]
+            counts = self.get_candidates_counts(field, [obj['pk'] for obj in data])
             for obj in data:
-                obj['candidates_count'] = self.get_candidates_count(field, obj['pk'])
+                obj['candidates_count'] = counts.get(obj['pk'], 0)
         return super().get_paginated_response(data)
 
-    def get_candidates_count(self, field: str, pk: int) -> int:
-        initial_filter = {f'{field}__pk': pk}
+    def get_candidates_counts(self, field: str, pks: [int]) -> dict:
+        """
+        Returns a dict mapping topic pk to the number of candidates related to the topic
+        through `field`. All the topics are processed in one grouped query.
+        """
+        initial_filter = {f'{field}__pk__in': pks}
         # `candidate_count_filters` define filters on topics which candidates must have to be
         # counted in. This is used for example when the user selects a language and only wants to
         # see authors with candidates in the selected language
@@ -327,19 +325,29 @@ class ETFilterViewSet(ExplicitTopicViewSet, BaseDataTableViewSet):
             for name, ids in filters.items()
             if name != self.kwargs['topic_type']
         }
-        return Candidate.objects.filter(**initial_filter).filter(**q_filters).distinct().count()
+        return dict(
+            Candidate.objects.filter(**initial_filter)
+            .filter(**q_filters)
+            .order_by()
+            .values_list(field)
+            .annotate(count=Count('pk', distinct=True))
+        )
 
 
 class FullSubjectTreeView(GenericAPIView):
     http_method_names = ['get']
 
+    # candidates may change without a change of the data generation
+    @cached_analytics_response(
+        cache_if=lambda request: request.query_params.get('score_type') != 'candidates_count'
+    )
     def get(self, request, workset_uuid, root_node_uid):
         work_set = models.WorkSet.objects.get(uuid=workset_uuid)
         root_node = models.SubjectCategory.objects.get(uid=root_node_uid, work_set=work_set)
         score_type = request.query_params.get('score_type', 'score')
         cand_cnt_filters = request.query_params.get('candidate_count_filters', '{}')
         cand_cnt_filters = self.get_candidates_filters(cand_cnt_filters)
-        return Response({'tree': build_subject_tree(root_node, score_type, cand_cnt_filters)})
+        return Response({'tree': get_subject_tree(root_node, score_type, cand_cnt_filters)})
 
     @classmethod
     def get_candidates_filters(cls, filters_q) -> dict:
@@ -395,15 +403,10 @@ class WorkDataTableViewSet(RequestParameterExtractor, BaseDataTableViewSet):
         self.extra_fields = [c.replace(' ', '_') for c in self.columns]
         lo = self.request.query_params.get('lo_bound')
         hi = self.request.query_params.get('hi_bound')
+        qs = models.Work.objects.filter(work_set__uuid=self.kwargs.get('workset_pk'))
         annotation = {
             col.replace(' ', '_'): Coalesce(
-                Sum(
-                    'workhit__value',
-                    filter=Q(workhit__date__gte=lo)
-                    & Q(workhit__date__lt=hi)
-                    & Q(workhit__typ__name=col),
-                ),
-                0,
+                qs.hit_score({'date__gte': lo, 'date__lt': hi}, {'typ__name': col}), 0
             )
             for col in self.columns
         }
@@ -411,8 +414,7 @@ class WorkDataTableViewSet(RequestParameterExtractor, BaseDataTableViewSet):
             'full_score': reduce(operator.add, [F(col) for col in self.extra_fields])
         }
         return (
-            models.Work.objects.filter(work_set__uuid=self.kwargs.get('workset_pk'))
-            .annotate(**annotation)
+            qs.annotate(**annotation)
             .annotate(**full_score_annotation)
             .filter(full_score__gt=0)
             .order_by('-full_score')
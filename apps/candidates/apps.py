@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class CandidatesConfig(AppConfig):
     name = 'candidates'
+
+    def ready(self):
+        super().ready()
+        # noinspection PyUnresolvedReferences
+        from . import signals  # needed to register the signals
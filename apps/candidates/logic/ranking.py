@@ -0,0 +1,151 @@
+"""
+Precomputed rankings of candidates by a weighted sum of their facet scores.
+
+The candidate list is sorted by the weighted score on every page, so instead of computing the
+sum for all candidates with each request, the sums are stored in `CandidateRank` for the
+weights and score year of each saved `CandidatesSettings` profile (`CandidateRanking`).
+Saving a profile only creates a pending ranking, the ranks are computed in the background
+by `sync_rankings` and kept up to date together with candidate scores. Weights without a
+computed ranking are scored on the fly.
+"""
+
+from collections import Counter
+from typing import Optional, Union
+
+from django.db import connection
+from django.db.models import QuerySet
+from django.db.transaction import atomic
+
+from ..models import Candidate, CandidateRank, CandidateRanking, CandidateScore, CandidatesSettings
+
+FACETS = ('authors', 'languages', 'subjects', 'publisher')
+# score years as offered by the frontend, `scoreYearIdx` of a profile is an index into this
+SCORE_YEARS = ('2020', '2015', '2010', '2005', '2000', 'all')
+# weight ratios are compared with this number of decimal places
+WEIGHT_PRECISION = 6
+
+
+def _ranks_sql(candidates_sql: str, rankings_sql: str) -> str:
+    score = ' + '.join(f'COALESCE(s.{facet}_score, 0) * r.{facet}_weight' for facet in FACETS)
+    return (
+        f'INSERT INTO {CandidateRank._meta.db_table} AS cr (ranking_id, candidate_id, score) '
+        f'SELECT r.id, c.id, {score} '
+        f'FROM {CandidateRanking._meta.db_table} r CROSS JOIN ({candidates_sql}) c '
+        f'LEFT JOIN {CandidateScore._meta.db_table} s ON s.candidate_id = c.id '
+        f'AND s.score_type = r.score_type AND s.year = r.year '
+        f'WHERE r.id IN ({rankings_sql}) '
+        f'ON CONFLICT (ranking_id, candidate_id) DO UPDATE SET score = EXCLUDED.score '
+        f'WHERE cr.score IS DISTINCT FROM EXCLUDED.score'
+    )
+
+
+def update_rankings(candidates: QuerySet, rankings: Optional[QuerySet] = None) -> int:
+    """
+    Recomputes ranks of `candidates` in `rankings` (all by default) from their
+    `CandidateScore`s. Returns the number of ranks which were added or changed.
+    """
+    if rankings is None:
+        rankings = CandidateRanking.objects.all()
+    candidates_sql, candidates_params = candidates.order_by().values('pk').query.sql_with_params()
+    rankings_sql, rankings_params = rankings.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _ranks_sql(candidates_sql, rankings_sql), [*candidates_params, *rankings_params]
+        )
+        return cursor.rowcount
+
+
+def _ranking_key(weights: dict, year: Union[int, str]) -> Optional[tuple]:
+    # the frontend sends each weight divided by the sum of all weights, while profiles store
+    # the weights as set by the user - both are compared as rounded ratios
+    values = [float(weights.get(facet, 0)) for facet in FACETS]
+    total = sum(values)
+    if total <= 0:
+        return None
+    return (str(year), *(round(value / total, WEIGHT_PRECISION) for value in values))
+
+
+def profile_ranking_key(settings_obj: Optional[dict]) -> Optional[tuple]:
+    """
+    Returns the year and weight ratios of the ranking used by a profile with `settings_obj`
+    or None if the profile does not define them
+    """
+    try:
+        return _ranking_key(settings_obj['weights'], SCORE_YEARS[settings_obj['scoreYearIdx']])
+    except (TypeError, KeyError, IndexError, ValueError, AttributeError):
+        return None
+
+
+def _ranking_filter(key: tuple, score_type: str) -> dict:
+    year, *weight_values = key
+    return {
+        'score_type': score_type,
+        'year': year,
+        **{f'{facet}_weight': value for facet, value in zip(FACETS, weight_values)},
+    }
+
+
+def find_ranking(
+    weights: dict, year: Union[int, str], score_type: str = CandidateScore.SCORE_TYPE_NORMALIZED
+) -> Optional[CandidateRanking]:
+    """
+    Returns the computed ranking for `weights` and `year` if there is one
+    """
+    if not (key := _ranking_key(weights, year)):
+        return None
+    return CandidateRanking.objects.filter(ready=True, **_ranking_filter(key, score_type)).first()
+
+
+def request_profile_ranking(
+    profile: CandidatesSettings, score_type: str = CandidateScore.SCORE_TYPE_NORMALIZED
+) -> bool:
+    """
+    Makes sure there is a ranking for the weights and year of `profile`. New rankings are only
+    created as pending, their ranks are computed by `sync_rankings`. The internal profiles,
+    which are saved with every change of the settings, do not get a ranking.
+
+    Returns True if a new ranking was created.
+    """
+    if profile.internal or not (key := profile_ranking_key(profile.settings_obj)):
+        return False
+    _ranking, created = CandidateRanking.objects.get_or_create(**_ranking_filter(key, score_type))
+    return created
+
+
+def _rankings_by_key(score_type: str) -> dict:
+    # weights of rankings are stored as ratios already
+    return {
+        (ranking.year, *(getattr(ranking, f'{facet}_weight') for facet in FACETS)): ranking.pk
+        for ranking in CandidateRanking.objects.filter(score_type=score_type)
+    }
+
+
+@atomic
+def sync_rankings(score_type: str = CandidateScore.SCORE_TYPE_NORMALIZED) -> Counter:
+    """
+    Makes sure there are rankings for weights and years of all saved profiles, removes
+    rankings which are not used by any profile and computes the ranks of pending ones.
+    It is meant to run in the background together with the update of candidate scores.
+    """
+    stats = Counter()
+    wanted = {
+        key
+        for settings_obj in CandidatesSettings.objects.filter(internal=False).values_list(
+            'settings_obj', flat=True
+        )
+        if (key := profile_ranking_key(settings_obj))
+    }
+    existing = _rankings_by_key(score_type)
+    if obsolete := [pk for key, pk in existing.items() if key not in wanted]:
+        _deleted, details = CandidateRanking.objects.filter(pk__in=obsolete).delete()
+        stats['removed'] = details.get(CandidateRanking._meta.label, 0)
+    CandidateRanking.objects.bulk_create(
+        [CandidateRanking(**_ranking_filter(key, score_type)) for key in wanted - existing.keys()],
+        ignore_conflicts=True,
+    )
+    pending = CandidateRanking.objects.filter(score_type=score_type, ready=False)
+    if pending_ids := list(pending.values_list('pk', flat=True)):
+        pending = CandidateRanking.objects.filter(pk__in=pending_ids)
+        stats['ranks_created'] = update_rankings(Candidate.objects.all(), pending)
+        stats['computed'] = pending.update(ready=True)
+    return stats
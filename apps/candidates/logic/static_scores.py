@@ -1,57 +1,172 @@
+"""
+Precomputation of `Candidate.static_scores` and `Candidate.normalized_scores` - for each year
+the maximum score of the related authors, languages, subjects and the publisher.
+
+All years are computed at once using one grouped query per facet and written by a single
+UPDATE. Unless a full update is requested, only candidates which were changed or whose
+related topics were changed since the last run are processed. The scores are also copied
+into `CandidateScore` and the precomputed rankings of the candidates are updated.
+"""
+
 from collections import Counter
-from typing import Iterable, Optional, Callable, Any
+from typing import Any, Callable, Optional
+
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from django.db.transaction import atomic
+from django.utils import timezone
 
 from bookrank.logic.static_score import YEARS
-from ..models import Candidate
+from bookrank.models import Author, Language, Publisher, SubjectCategory
+from core.models import SingletonValue
+from ..models import (
+    AuthorCandidate,
+    Candidate,
+    CandidateRanking,
+    CandidateScore,
+    LanguageCandidate,
+    SubjectCategoryCandidate,
+)
+from .ranking import update_rankings
+
+SCORE_TYPES = ('static', 'normalized')
+# facet name -> (link model or None for the `Candidate` foreign key, topic model)
+FACETS = {
+    'authors': (AuthorCandidate, Author),
+    'languages': (LanguageCandidate, Language),
+    'subjects': (SubjectCategoryCandidate, SubjectCategory),
+    'publisher': (None, Publisher),
+}
+
+
+def _last_run_key(score_type: str) -> str:
+    return f'candidate_{score_type}_scores_updated'
+
+
+def changed_candidates(since) -> QuerySet:
+    """
+    Candidates changed since `since` or connected to a topic which was changed since then
+    """
+    q = Q(last_updated__gt=since) | Q(publisher__last_updated__gt=since)
+    for link_model, _topic_model in FACETS.values():
+        if link_model:
+            q |= Exists(
+                link_model.objects.filter(
+                    candidate_id=OuterRef('pk'), topic__last_updated__gt=since
+                )
+            )
+    return Candidate.objects.filter(q)
+
+
+def _facet_sql(facet: str, score_type: str) -> str:
+    link_model, topic_model = FACETS[facet]
+    score_field = f'{score_type}_score'
+    maxima = ', '.join(
+        f"MAX((t.{score_field} ->> 'score_{year}')::float) AS score_{year}"
+        for year in ['all', *YEARS]
+    )
+    if link_model:
+        return (
+            f'SELECT l.candidate_id, {maxima} '
+            f'FROM {link_model._meta.db_table} l '
+            f'JOIN {topic_model._meta.db_table} t ON t.id = l.topic_id '
+            f'WHERE l.candidate_id IN (SELECT id FROM to_update) '
+            f'GROUP BY l.candidate_id'
+        )
+    return (
+        f'SELECT c.id AS candidate_id, {maxima} '
+        f'FROM {Candidate._meta.db_table} c '
+        f'JOIN {topic_model._meta.db_table} t ON t.id = c.publisher_id '
+        f'WHERE c.id IN (SELECT id FROM to_update) '
+        f'GROUP BY c.id'
+    )
 
-trivial_weights = {'authors': 1.0, 'languages': 1.0, 'subjects': 1.0, 'publisher': 1.0}
 
+def _scores_sql(score_type: str, candidates_sql: str) -> str:
+    facet_ctes = ', '.join(f'{facet} AS ({_facet_sql(facet, score_type)})' for facet in FACETS)
+    year_objects = ', '.join(
+        f"'score_{year}', jsonb_build_object("
+        + ', '.join(
+            f"'{facet}_score', COALESCE({facet}.score_{year}, 0)::float" for facet in FACETS
+        )
+        + ')'
+        for year in ['all', *YEARS]
+    )
+    joins = ' '.join(f'LEFT JOIN {facet} ON {facet}.candidate_id = u.id' for facet in FACETS)
+    field = f'{score_type}_scores'
+    table = Candidate._meta.db_table
+    return (
+        f'WITH to_update AS ({candidates_sql}), {facet_ctes}, '
+        f'new_scores AS (SELECT u.id, jsonb_build_object({year_objects}) AS scores '
+        f'FROM to_update u {joins}) '
+        f'UPDATE {table} c SET {field} = c.{field} || new_scores.scores FROM new_scores '
+        f'WHERE c.id = new_scores.id AND c.{field} IS DISTINCT FROM c.{field} || new_scores.scores'
+    )
 
+
+def _typed_scores_sql(score_type: str, candidates_sql: str) -> str:
+    # copies the scores of `candidates_sql` from the json field into `CandidateScore`
+    columns = [f'{facet}_score' for facet in FACETS]
+    values = ', '.join(f"COALESCE((s.value ->> '{column}')::float, 0)" for column in columns)
+    new_values = ', '.join(f'EXCLUDED.{column}' for column in columns)
+    field = f'{score_type}_scores'
+    return (
+        f'INSERT INTO {CandidateScore._meta.db_table} AS cs '
+        f'(candidate_id, score_type, year, {", ".join(columns)}) '
+        f"SELECT c.id, %s, substring(s.key from 7), {values} "
+        f'FROM {Candidate._meta.db_table} c CROSS JOIN LATERAL jsonb_each(c.{field}) s '
+        f"WHERE c.id IN ({candidates_sql}) AND left(s.key, 6) = 'score_' "
+        f'ON CONFLICT (candidate_id, score_type, year) DO UPDATE SET '
+        + ', '.join(f'{column} = EXCLUDED.{column}' for column in columns)
+        + f' WHERE ({", ".join(f"cs.{column}" for column in columns)}) '
+        f'IS DISTINCT FROM ({new_values})'
+    )
+
+
+@atomic
 def update_candidates_static_scores(
-    candidates: Optional[Iterable[Candidate]] = None,
-    batch_size=10000,
+    candidates: Optional[QuerySet] = None,
     callback: Optional[Callable[[Any, int, dict], None]] = None,
     score_type: str = 'static',
-):
+    full: bool = False,
+) -> Counter:
     """
-    if `callback` is given, it will be called after each batch has been processed with the
-    following arguments:
+    Updates `{score_type}_scores` of `candidates` (all by default). Without `full`, only
+    candidates changed since the last run are considered when `candidates` are not given.
+
+    if `callback` is given, it will be called after the update with the following arguments:
 
-    1/ the currently processed year
-    2/ the number of processed records for that year
+    1/ the score type
+    2/ the number of updated records
     3/ overall stats as a Counter/dict
     """
+    if score_type not in SCORE_TYPES:
+        raise ValueError(f'Unknown score type: {score_type}')
     stats = Counter()
-    if not candidates:
-        candidates = Candidate.objects.all()
-    for year in ['all', *YEARS]:
-        to_save = []
-        for i, candidate in enumerate(
-            candidates.annotate_score_lowlevel(trivial_weights, year, score_type).iterator()
-        ):
-            # for some reason, None sometimes creeps into the scores, even though it should not,
-            # so we `or` it with 0.0 to make sure only numbers are used
-            scores = {
-                'authors_score': candidate.authors_score or 0.0,
-                'languages_score': candidate.languages_score or 0.0,
-                'subjects_score': candidate.subjects_score or 0.0,
-                'publisher_score': candidate.publisher_score or 0.0,
-            }
-            key = f'score_{year}'
-            old_scores = getattr(candidate, f'{score_type}_scores')
-            if old_scores.get(key) != scores:
-                old_scores[key] = scores
-                to_save.append(candidate)
-                stats['updated'] += 1
-            else:
-                stats['unchanged'] += 1
-            if i and i % batch_size == 0:
-                Candidate.objects.bulk_update(to_save, [f'{score_type}_scores'])
-                to_save = []
-                if callback:
-                    try:
-                        callback(year, i, stats)
-                    except Exception:
-                        pass  # we ignore any errors in the callback function
-        Candidate.objects.bulk_update(to_save, [f'{score_type}_scores'])
+    start = timezone.now()
+    last_run_key = _last_run_key(score_type)
+    if candidates is None:
+        last_run = (
+            SingletonValue.objects.filter(key=last_run_key).values_list('date', flat=True).first()
+        )
+        if full or not last_run:
+            candidates = Candidate.objects.all()
+        else:
+            candidates = changed_candidates(last_run)
+        SingletonValue.objects.update_or_create(key=last_run_key, defaults={'date': start})
+    candidates_sql, params = candidates.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(_scores_sql(score_type, candidates_sql), params)
+        stats['updated'] = cursor.rowcount
+        cursor.execute(_typed_scores_sql(score_type, candidates_sql), [score_type, *params])
+    # pending rankings are computed for all candidates at once by `sync_rankings`
+    stats['ranks_updated'] = update_rankings(
+        candidates, CandidateRanking.objects.filter(score_type=score_type, ready=True)
+    )
+    stats['unchanged'] = Candidate.objects.count() - stats['updated']
+    if callback:
+        try:
+            callback(score_type, stats['updated'], stats)
+        except Exception:
+            pass  # we ignore any errors in the callback function
     return stats
@@ -1,17 +1,20 @@
 import re
-import json
-from copy import deepcopy
+from collections import Counter, defaultdict
 from decimal import Decimal
 from html import unescape
-from typing import Callable, Optional, Type, Union
+from typing import Callable, List, Optional, Tuple, Type
 
 from django.db import models
+from django.db.transaction import atomic
+from django.utils import timezone
 from django.utils.html import strip_tags
 import xmltodict
 
 from bookrank.models import Author, Language, Publisher, WorkSet
+from source_data.logic.compression import raw_data_bytes
 from source_data.models import DataRecord
-from ..models import Agent
+from ..models import Agent, AuthorCandidate, Candidate, CandidateRanking, LanguageCandidate
+from .ranking import update_rankings
 
 DIRECT_VALS = {
     'title': [('Title', {}), ('TitleText', '')],
@@ -23,11 +26,32 @@ DIRECT_VALS = {
     'product_format': [('ProductForm', '')],
 }
 EXTRA_FIELDS = ('RecordReference', 'ProductIdentifier', 'Subject', 'MediaFile')
+CANDIDATE_SYNC_FIELDS = [
+    *DIRECT_VALS,
+    'abstract',
+    'extra_data',
+    'publication_year',
+    'publisher',
+    'agent',
+    'data_record',
+    'last_updated',
+]
+STATS_KEYS = ('publishers_created', 'agents_created')
+# m2m field name -> through model
+M2M_FIELDS = {'authors': AuthorCandidate, 'languages': LanguageCandidate}
 
 
 def extract_product_data(record: DataRecord) -> dict:
-    raw_data = xmltodict.parse(record.raw_data.data.tobytes())
-    product_data = json.loads(json.dumps(raw_data['ONIXMessage']['Product']))
+    return parse_product_data(raw_data_bytes(record.raw_data), product_only=bool(record.header_id))
+
+
+def parse_product_data(raw_data: bytes, product_only: bool = False) -> dict:
+    raw_data = xmltodict.parse(raw_data)
+    if product_only:
+        # only the product is stored, the header is not needed here
+        product_data = raw_data['Product']
+    else:
+        product_data = raw_data['ONIXMessage']['Product']
     if isinstance(product_data, list):
         return product_data[0]
     return product_data
@@ -52,63 +76,45 @@ class NamedModelManager:
         return pk, created
 
 
-class RecordToCandidateDict:
-    def __init__(self, record: DataRecord, work_set: WorkSet) -> None:
-        self.record = extract_product_data(record)
-        self.work_set = work_set
+class ProductParser:
+    """
+    Extracts candidate data from ONIX Product data. Values which refer to other objects
+    (publisher, agent, authors, languages) are returned by name, so that parsing does not
+    need the database and may be done in worker processes.
+    """
 
-    def map_fields(
-        self,
-        agent_map,
-        publisher_manager: NamedModelManager,
-        lang_manager: NamedModelManager,
-        author_manager: NamedModelManager,
-    ) -> dict:
-        pub_name = re.sub(r' \(.+\)$', '', self.record['Publisher']['PublisherName'])
-        pub_name = self.recursive_unescape(strip_tags(pub_name))
-        publisher, pub_created = publisher_manager.get_by_name(pub_name)
+    def __init__(self, product_data: dict) -> None:
+        self.record = product_data
 
+    def parse(self) -> dict:
+        pub_name = re.sub(r' \(.+\)$', '', self.record['Publisher']['PublisherName'])
         market_rep = self.record['MarketRepresentation']
-        agent_key = (market_rep['AgentName'], market_rep['EmailAddress'])
-        agent = agent_map.get(agent_key)
-        agent_created = False
-        if not agent:
-            agent, agent_created = Agent.objects.get_or_create(
-                name=agent_key[0], email=agent_key[1]
-            )
-            agent_map[agent_key] = agent  # store for other records
-
         return {
             'data': {
                 **{k: self.extract_nested_vals(v) for k, v in DIRECT_VALS.items()},
-                'publisher_id': publisher,
-                'agent': agent,
                 'abstract': self.get_abstract(),
                 'extra_data': {k: self.record.get(k, {}) for k in EXTRA_FIELDS},
                 'publication_year': self.get_pub_year(),
             },
-            'publishers_created': pub_created,
-            'agents_created': agent_created,
-            'authors': self.extract_m2m_data(
-                'Contributor', 'PersonName', author_manager, fmt_func=self.format_author_name
+            'publisher': self.recursive_unescape(strip_tags(pub_name)),
+            'agent': (market_rep['AgentName'], market_rep['EmailAddress']),
+            'authors': self.extract_names(
+                'Contributor', 'PersonName', fmt_func=self.format_author_name
             ),
-            'languages': self.extract_m2m_data('Language', 'LanguageCode', lang_manager),
+            'languages': self.extract_names('Language', 'LanguageCode'),
         }
 
     def extract_nested_vals(self, keys: list):
-        val = deepcopy(self.record)
+        # `get` does not modify the data, so they need not be copied
+        val = self.record
         for el in keys:
             val = val.get(*el)
         val = self.recursive_unescape(strip_tags(val))
         return self.remove_latex(val)
 
-    def extract_m2m_data(
-        self,
-        onix_outer: str,
-        onix_inner: str,
-        manager: NamedModelManager,
-        fmt_func: Optional[Callable[[str], str]] = None,
-    ) -> dict:
+    def extract_names(
+        self, onix_outer: str, onix_inner: str, fmt_func: Optional[Callable[[str], str]] = None
+    ) -> List[str]:
         obj_li = self.record.get(onix_outer)
         if not obj_li:
             obj_li = []
@@ -117,14 +123,7 @@ class RecordToCandidateDict:
         names = [obj[onix_inner] for obj in obj_li]
         if fmt_func:
             names = [fmt_func(name) for name in names]
-        model_objs = []
-        num_created = 0
-        for name in names:
-            model_obj, created = manager.get_by_name(name=name)
-            model_objs.append(model_obj)
-            if created:
-                num_created += 1
-        return {'entries': model_objs, 'num_created': num_created}
+        return names
 
     def format_author_name(self, author: str) -> str:
         author = self.recursive_unescape(strip_tags(author))
@@ -161,3 +160,170 @@ class RecordToCandidateDict:
         for m in matches:
             s = s.replace(m, m.replace('$', ''))
         return s
+
+
+class RecordToCandidateDict(ProductParser):
+    def __init__(self, record: DataRecord, work_set: WorkSet) -> None:
+        super().__init__(extract_product_data(record))
+        self.work_set = work_set
+
+    def map_fields(
+        self,
+        agent_map,
+        publisher_manager: NamedModelManager,
+        lang_manager: NamedModelManager,
+        author_manager: NamedModelManager,
+    ) -> dict:
+        return resolve_candidate_data(
+            self.parse(), agent_map, publisher_manager, lang_manager, author_manager
+        )
+
+
+def resolve_candidate_data(
+    parsed: dict,
+    agent_map,
+    publisher_manager: NamedModelManager,
+    lang_manager: NamedModelManager,
+    author_manager: NamedModelManager,
+) -> dict:
+    """
+    Replaces names in the output of `ProductParser.parse` by the corresponding objects,
+    creating them when necessary
+    """
+    publisher, pub_created = publisher_manager.get_by_name(parsed['publisher'])
+    agent_key = parsed['agent']
+    agent = agent_map.get(agent_key)
+    agent_created = False
+    if not agent:
+        agent, agent_created = Agent.objects.get_or_create(name=agent_key[0], email=agent_key[1])
+        agent_map[agent_key] = agent  # store for other records
+    return {
+        'data': {**parsed['data'], 'publisher_id': publisher, 'agent': agent},
+        'publishers_created': pub_created,
+        'agents_created': agent_created,
+        'authors': _resolve_names(parsed['authors'], author_manager),
+        'languages': _resolve_names(parsed['languages'], lang_manager),
+    }
+
+
+def _resolve_names(names: List[str], manager: NamedModelManager) -> dict:
+    model_objs = []
+    num_created = 0
+    for name in names:
+        model_obj, created = manager.get_by_name(name=name)
+        model_objs.append(model_obj)
+        if created:
+            num_created += 1
+    return {'entries': model_objs, 'num_created': num_created}
+
+
+def parse_records(records: List[Tuple[int, str, bytes, bool]]) -> List[Tuple[int, str, dict]]:
+    """
+    Parses (record pk, isbn, raw data, product_only) tuples into (record pk, isbn, parsed data).
+    Runs in worker processes.
+    """
+    return [
+        (pk, isbn, ProductParser(parse_product_data(raw_data, product_only)).parse())
+        for pk, isbn, raw_data, product_only in records
+    ]
+
+
+class CandidateWriter:
+    """
+    Creates or updates candidates from parsed records in bulk - existing candidates and their
+    authors and languages are fetched for the whole batch at once.
+    """
+
+    def __init__(self, work_set: WorkSet, use_transactions: bool = True):
+        self.agent_map = {(agent.name, agent.email): agent for agent in Agent.objects.all()}
+        self.publisher_manager = NamedModelManager(work_set, Publisher)
+        self.lang_manager = NamedModelManager(work_set, Language)
+        self.author_manager = NamedModelManager(work_set, Author)
+        self.use_transactions = use_transactions
+        self.stats = Counter()
+
+    def write(self, records: List[Tuple[int, str, dict]]) -> None:
+        if self.use_transactions:
+            with atomic():
+                self._write(records)
+        else:
+            self._write(records)
+
+    def _write(self, records: List[Tuple[int, str, dict]]) -> None:
+        isbn_to_candidate = {
+            candidate.isbn: candidate
+            for candidate in Candidate.objects.filter(isbn__in=[isbn for _pk, isbn, _ in records])
+        }
+        now = timezone.now()
+        to_create = []
+        to_update = []
+        m2m_data = []
+        for record_pk, isbn, parsed in records:
+            data_dict = resolve_candidate_data(
+                parsed,
+                self.agent_map,
+                self.publisher_manager,
+                self.lang_manager,
+                self.author_manager,
+            )
+            candidate = isbn_to_candidate.get(isbn)
+            created = candidate is None
+            if not created:
+                for key, value in data_dict['data'].items():
+                    setattr(candidate, key, value)
+                # the data_record to use for this candidate may have changed
+                candidate.data_record_id = record_pk
+                candidate.last_updated = now
+                to_update.append(candidate)
+            else:
+                candidate = Candidate(isbn=isbn, data_record_id=record_pk, **data_dict['data'])
+                to_create.append(candidate)
+            m2m_data.append((candidate, data_dict))
+            self.update_stats(created, data_dict)
+        Candidate.objects.bulk_update(to_update, CANDIDATE_SYNC_FIELDS)
+        Candidate.objects.bulk_create(to_create)
+        if to_create:
+            # new candidates get a rank in each computed ranking right away (with a zero score
+            # until they are scored), the candidate list relies on every candidate having one
+            update_rankings(
+                Candidate.objects.filter(pk__in=[candidate.pk for candidate in to_create]),
+                CandidateRanking.objects.filter(ready=True),
+            )
+        self.update_m2m_fields(m2m_data)
+
+    @classmethod
+    def update_m2m_fields(cls, m2m_data: List[Tuple[Candidate, dict]]) -> None:
+        """
+        Same as `set` of each m2m field of each candidate, only in bulk
+        """
+        candidate_ids = [candidate.pk for candidate, _data in m2m_data]
+        for field_name, through in M2M_FIELDS.items():
+            existing = defaultdict(lambda: defaultdict(list))
+            for pk, candidate_id, topic_id in through.objects.filter(
+                candidate_id__in=candidate_ids
+            ).values_list('pk', 'candidate_id', 'topic_id'):
+                existing[candidate_id][topic_id].append(pk)
+            to_delete = []
+            to_create = []
+            for candidate, data_dict in m2m_data:
+                wanted = set(data_dict[field_name]['entries'])
+                current = existing[candidate.pk]
+                for topic_id, pks in current.items():
+                    if topic_id not in wanted:
+                        to_delete.extend(pks)
+                to_create.extend(
+                    through(candidate_id=candidate.pk, topic_id=topic_id)
+                    for topic_id in wanted - current.keys()
+                )
+            through.objects.filter(pk__in=to_delete).delete()
+            through.objects.bulk_create(to_create)
+
+    def update_stats(self, candidate_created: bool, data: dict) -> None:
+        if candidate_created:
+            self.stats['candidates_created'] += 1
+        else:
+            self.stats['candidates_updated'] += 1
+        for key in STATS_KEYS:
+            self.stats[key] += int(data[key])
+        for key in M2M_FIELDS:
+            self.stats[f'{key}_created'] += data[key]['num_created']
@@ -1,21 +1,22 @@
 import logging
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 
 from django.core.management.base import BaseCommand
-from django.db import transaction
 from django.db.models import Q, F
 from tqdm import tqdm
 
+from source_data.logic.compression import raw_data_bytes
 from source_data.models import DataRecord
-from bookrank.models import Author, Language, WorkSet, Publisher
-from ...models import Candidate, Agent
-from ...logic.sync_candidates_utils import RecordToCandidateDict, NamedModelManager
+from bookrank.logic.response_cache import bump_data_generation
+from bookrank.logic.static_score import forget_maximums
+from bookrank.models import WorkSet
+from ...logic.sync_candidates_utils import CandidateWriter, parse_records
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_WORKSET = 'Aleph'
-STATS_KEYS = ('publishers_created', 'agents_created')
-M2M_FIELDS = ('authors', 'languages')
+BATCH_SIZE = 1000
 
 
 class Command(BaseCommand):
@@ -44,7 +45,13 @@ class Command(BaseCommand):
             '--disable-transactions',
             dest='disable_transactions',
             action='store_true',
-            help="Do not manage transactions inside code - WARNING leads to very slow progress!",
+            help="Do not manage transactions inside code - each batch is not committed at once",
+        )
+        parser.add_argument(
+            '-b', '--batch-size', type=int, default=BATCH_SIZE, help='Records written at once'
+        )
+        parser.add_argument(
+            '-j', '--jobs', type=int, default=1, help='Number of processes parsing the records'
         )
 
     def handle(self, *args, **options):
@@ -54,12 +61,6 @@ class Command(BaseCommand):
         # DISTINCT ON query which selects the distinct object based on the ordering applied
         # so in our case, it always gets us the newest object for a unique isbn13
 
-        # prefetch related objects
-        agent_map = {(agent.name, agent.email): agent for agent in Agent.objects.all()}
-        publisher_manager = NamedModelManager(work_set, Publisher)
-        lang_manager = NamedModelManager(work_set, Language)
-        author_manager = NamedModelManager(work_set, Author)
-
         # prepare the query
         # we cannot do the distinct operation together with the filters because the query
         # would not be correct - for duplicated isbn when we process the newest record, it would
@@ -70,75 +71,55 @@ class Command(BaseCommand):
             .order_by('isbn13', '-timestamp')
             .distinct('isbn13')
         )
-        data_records = DataRecord.objects.select_related('raw_data').filter(
-            id__in=data_records_to_consider
-        )
+        data_records = DataRecord.objects.filter(id__in=data_records_to_consider)
         if not options['ignore_last_updated']:
             data_records = data_records.filter(
                 Q(candidate__isnull=True) | Q(last_updated__gt=F('candidate__last_updated'))
             )
-        total = data_records.count()
-        stats['total'] = total
+        # the ids are fetched in advance, so that processed records falling out of the query
+        # do not influence which records are processed
+        record_ids = list(data_records.order_by('pk').values_list('pk', flat=True))
+        stats['total'] = len(record_ids)
 
-        # process all records
-        #
-        # Note:
-        # we use manual transaction management to speed things up (about 2-3x) and that does not
-        # work well with data_records.iterator. The problem is that the cursor used for each
-        # batch by the iterator becomes invalid at the end of the iteration and the iterator
-        # crashed with an error.
-        #
-        # To get around this, we use a different method which goes over the matching data records
-        # by batches and then re-queries after each batch. In real life, it has the same speed
-        # and other advantages as using iterator without its peculiarities.
-        use_transactions = not options.get('disable_transactions', False)
-        if use_transactions:
-            transaction.set_autocommit(False)
-        with tqdm(total=total) as progress:
-            go_on = True
-            start, end = 0, 1000
-            while go_on:
-                go_on = False
-                for i, record in enumerate(data_records[start:end]):
-                    data_dict = RecordToCandidateDict(record, work_set).map_fields(
-                        agent_map, publisher_manager, lang_manager, author_manager
-                    )
-                    candidate, created = Candidate.objects.update_or_create(
-                        isbn=record.isbn13, defaults={'data_record': record, **data_dict['data']}
-                    )
-                    if candidate.data_record != record:
-                        # the data_record to use for this candidate may have changed
-                        candidate.data_record = record
-                        candidate.save()
-                    self.update_m2m_fields(data_dict, candidate)
-                    self.update_stats(stats, created, data_dict)
-                    if i and i % 100 == 0 and use_transactions:
-                        transaction.commit()
-                    progress.update()
-                    go_on = True
-                # when ignoring last update, processed records do not automatically fall out
-                # of the query, so we have to skip them "manually"
-                if options['ignore_last_updated']:
-                    start += 1000
-                    end += 1000
-                if use_transactions:
-                    transaction.commit()
-        if use_transactions:
-            transaction.set_autocommit(True)
+        writer = CandidateWriter(
+            work_set, use_transactions=not options.get('disable_transactions', False)
+        )
+        batches = self.record_batches(record_ids, options['batch_size'])
+        with tqdm(total=len(record_ids)) as progress:
+            if options['jobs'] <= 1:
+                for batch in batches:
+                    writer.write(parse_records(batch))
+                    progress.update(len(batch))
+            else:
+                with ProcessPoolExecutor(max_workers=options['jobs']) as executor:
+                    # we keep only a few batches in flight not to read all the data ahead
+                    pending = deque()
+                    for batch in batches:
+                        pending.append(executor.submit(parse_records, batch))
+                        if len(pending) >= 2 * options['jobs']:
+                            result = pending.popleft().result()
+                            writer.write(result)
+                            progress.update(len(result))
+                    while pending:
+                        result = pending.popleft().result()
+                        writer.write(result)
+                        progress.update(len(result))
+        stats.update(writer.stats)
+        # topics connected to candidates changed, so maximums of scores have to be recomputed
+        forget_maximums()
+        bump_data_generation(work_set)
         logger.info(stats)
 
-    def update_m2m_fields(self, full_data: dict, candidate: Candidate) -> None:
-        for field_name in M2M_FIELDS:
-            field = getattr(candidate, field_name)
-            data = full_data[field_name]
-            field.set(data['entries'])
-
-    def update_stats(self, stats: Counter, candidate_created: bool, data: dict) -> None:
-        if candidate_created:
-            stats['candidates_created'] += 1
-        else:
-            stats['candidates_updated'] += 1
-        for key in STATS_KEYS:
-            stats[key] += int(data[key])
-        for key in M2M_FIELDS:
-            stats[f'{key}_created'] = data[key]['num_created']
+    @classmethod
+    def record_batches(cls, record_ids: list, batch_size: int):
+        """
+        Yields batches of input for `parse_records`
+        """
+        for i in range(0, len(record_ids), batch_size):
+            records = DataRecord.objects.filter(pk__in=record_ids[i : i + batch_size]).order_by(
+                'pk'
+            )
+            yield [
+                (record.pk, record.isbn13, raw_data_bytes(record.raw_data), bool(record.header_id))
+                for record in records.select_related('raw_data')
+            ]
@@ -6,7 +6,9 @@ from django.db.transaction import atomic
 
 from bookrank.models import WorkSet
 from bookrank.logic.static_score import update_static_scores as update_topics_static_scores
-from ...logic.static_scores import update_candidates_static_scores
+from bookrank.logic.topics import update_subject_tree_snapshots
+from ...logic.ranking import sync_rankings
+from ...logic.static_scores import SCORE_TYPES, update_candidates_static_scores
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,13 @@ class Command(BaseCommand):
             nargs='?',
             help=f"Work set name, if not present, {DEFAULT_WORKSET} is assumed",
         )
+        parser.add_argument(
+            '-a',
+            '--all',
+            dest='full',
+            action='store_true',
+            help='Update all candidates, not only those changed since the last run',
+        )
 
     def handle(self, *args, **options):
         work_set, _ = WorkSet.objects.get_or_create(name=options['work_set'])
@@ -32,13 +41,8 @@ class Command(BaseCommand):
         with atomic():
             update_topics_static_scores(work_set, topics_stats)
             logger.info(topics_stats)
-        with atomic():
-            stats = update_candidates_static_scores(callback=self.callback, score_type='static')
-            logger.info('Overall stats for static scores: %s', stats)
-        with atomic():
-            stats = update_candidates_static_scores(callback=self.callback, score_type='normalized')
-            logger.info('Overall stats for normalized scores: %s', stats)
-
-    @classmethod
-    def callback(cls, year, number, stats):
-        logger.info('Year: %s; records: %d  (stats: %s)', year, number, stats)
+        logger.info('Updated %d subject tree snapshots', update_subject_tree_snapshots(work_set))
+        for score_type in SCORE_TYPES:
+            stats = update_candidates_static_scores(score_type=score_type, full=options['full'])
+            logger.info('Overall stats for %s scores: %s', score_type, stats)
+        logger.info('Rankings of saved profiles: %s', sync_rankings())
@@ -1,7 +1,18 @@
 from typing import Union
 
-from django.db.models.fields.json import KeyTextTransform, KeyTransform
-from django.db.models import Manager, QuerySet, FloatField, F, Subquery, OuterRef, Max, Value
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models import (
+    F,
+    FilteredRelation,
+    FloatField,
+    Manager,
+    Max,
+    OuterRef,
+    Q,
+    QuerySet,
+    Subquery,
+    Value,
+)
 from django.db.models.functions import Coalesce, Cast
 
 
@@ -48,22 +59,18 @@ class CandidateQuerySet(QuerySet):
         )
 
     def annotate_score(self, weights: dict, year: Union[int, str], score_type: str) -> QuerySet:
-        qs = self
+        # typed copies of the precomputed scores in `CandidateScore` - at most one row matches
+        qs = self.annotate(
+            selected_scores=FilteredRelation(
+                'scores', condition=Q(scores__score_type=score_type, scores__year=str(year))
+            )
+        )
         for k, v in weights.items():
             qs = qs.annotate(
                 **{
                     f'{k}_score': v
-                    * (
-                        Cast(
-                            Coalesce(
-                                KeyTextTransform(
-                                    f'{k}_score',
-                                    KeyTransform(f'score_{year}', f'{score_type}_scores'),
-                                ),
-                                Value('0'),
-                            ),
-                            FloatField(),
-                        )
+                    * Coalesce(
+                        F(f'selected_scores__{k}_score'), Value(0), output_field=FloatField()
                     )
                 }
             )
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FILL_SCORES = '''
+INSERT INTO candidates_candidatescore
+    (candidate_id, score_type, year, authors_score, languages_score, subjects_score,
+     publisher_score)
+SELECT c.id, '{score_type}', substring(s.key from 7),
+    COALESCE((s.value ->> 'authors_score')::float, 0),
+    COALESCE((s.value ->> 'languages_score')::float, 0),
+    COALESCE((s.value ->> 'subjects_score')::float, 0),
+    COALESCE((s.value ->> 'publisher_score')::float, 0)
+FROM candidates_candidate c CROSS JOIN LATERAL jsonb_each(c.{score_type}_scores) s
+WHERE left(s.key, 6) = 'score_';
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('candidates', '0017_candidate_normalized_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandidateScore',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                (
+                    'score_type',
+                    models.CharField(
+                        choices=[('static', 'static'), ('normalized', 'normalized')], max_length=10
+                    ),
+                ),
+                ('year', models.CharField(help_text='year of the score or "all"', max_length=4)),
+                ('authors_score', models.FloatField(default=0)),
+                ('languages_score', models.FloatField(default=0)),
+                ('subjects_score', models.FloatField(default=0)),
+                ('publisher_score', models.FloatField(default=0)),
+                (
+                    'candidate',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='scores',
+                        to='candidates.candidate',
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='candidatescore',
+            constraint=models.UniqueConstraint(
+                fields=('candidate', 'score_type', 'year'),
+                include=('authors_score', 'languages_score', 'subjects_score', 'publisher_score'),
+                name='candidates_score_unique',
+            ),
+        ),
+        migrations.RunSQL(FILL_SCORES.format(score_type='static'), migrations.RunSQL.noop),
+        migrations.RunSQL(FILL_SCORES.format(score_type='normalized'), migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('candidates', '0018_candidatescore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CandidateRanking',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                (
+                    'score_type',
+                    models.CharField(
+                        choices=[('static', 'static'), ('normalized', 'normalized')], max_length=10
+                    ),
+                ),
+                ('year', models.CharField(help_text='year of the score or "all"', max_length=4)),
+                ('authors_weight', models.FloatField()),
+                ('languages_weight', models.FloatField()),
+                ('subjects_weight', models.FloatField()),
+                ('publisher_weight', models.FloatField()),
+            ],
+            options={
+                'unique_together': {
+                    (
+                        'score_type',
+                        'year',
+                        'authors_weight',
+                        'languages_weight',
+                        'subjects_weight',
+                        'publisher_weight',
+                    )
+                },
+            },
+        ),
+        migrations.CreateModel(
+            name='CandidateRank',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('score', models.FloatField()),
+                (
+                    'candidate',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='ranks',
+                        to='candidates.candidate',
+                    ),
+                ),
+                (
+                    'ranking',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='ranks',
+                        to='candidates.candidateranking',
+                    ),
+                ),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        models.F('ranking'),
+                        models.OrderBy(models.F('score'), descending=True, nulls_last=True),
+                        name='candidates_rank_score_idx',
+                    )
+                ],
+                'unique_together': {('ranking', 'candidate')},
+            },
+        ),
+    ]
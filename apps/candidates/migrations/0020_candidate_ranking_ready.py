@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('candidates', '0019_candidate_ranking'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='candidaterank',
+            name='candidates_rank_score_idx',
+        ),
+        migrations.AddField(
+            model_name='candidateranking',
+            name='ready',
+            field=models.BooleanField(
+                default=False, help_text='ranks of all candidates were computed, pending otherwise'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='candidaterank',
+            index=models.Index(
+                models.F('ranking'),
+                models.OrderBy(models.F('score'), descending=True, nulls_last=True),
+                models.OrderBy(models.F('candidate'), descending=True),
+                name='candidates_rank_order_idx',
+            ),
+        ),
+    ]
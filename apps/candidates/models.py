@@ -1,7 +1,7 @@
 from decimal import Decimal
 
 from django.db import models
-from django.db.models import JSONField
+from django.db.models import F, JSONField
 from django.contrib.auth import get_user_model
 
 from bookrank.models import Work
@@ -112,6 +112,87 @@ class Candidate(CreatedUpdatedMixin, models.Model):
     objects = CandidateManager()
 
 
+class CandidateScore(models.Model):
+    '''
+    scores from `Candidate.static_scores` and `Candidate.normalized_scores` in typed columns,
+    one row per candidate, score type and year - used for ranking of candidates
+    '''
+
+    SCORE_TYPE_STATIC = 'static'
+    SCORE_TYPE_NORMALIZED = 'normalized'
+    SCORE_TYPE_CHOICES = (
+        (SCORE_TYPE_STATIC, 'static'),
+        (SCORE_TYPE_NORMALIZED, 'normalized'),
+    )
+
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='scores')
+    score_type = models.CharField(max_length=10, choices=SCORE_TYPE_CHOICES)
+    year = models.CharField(max_length=4, help_text='year of the score or "all"')
+    authors_score = models.FloatField(default=0)
+    languages_score = models.FloatField(default=0)
+    subjects_score = models.FloatField(default=0)
+    publisher_score = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            # the scores are included, so that ranking and sorting of candidates by them
+            # is served by an index-only scan instead of fetching rows from the table
+            models.UniqueConstraint(
+                fields=['candidate', 'score_type', 'year'],
+                include=['authors_score', 'languages_score', 'subjects_score', 'publisher_score'],
+                name='candidates_score_unique',
+            )
+        ]
+
+
+class CandidateRanking(models.Model):
+    '''
+    ranking of candidates by a weighted sum of their facet scores from one year - the sums
+    for all candidates are precomputed in `CandidateRank`
+    '''
+
+    score_type = models.CharField(max_length=10, choices=CandidateScore.SCORE_TYPE_CHOICES)
+    year = models.CharField(max_length=4, help_text='year of the score or "all"')
+    authors_weight = models.FloatField()
+    languages_weight = models.FloatField()
+    subjects_weight = models.FloatField()
+    publisher_weight = models.FloatField()
+    ready = models.BooleanField(
+        default=False, help_text='ranks of all candidates were computed, pending otherwise'
+    )
+
+    class Meta:
+        unique_together = (
+            (
+                'score_type',
+                'year',
+                'authors_weight',
+                'languages_weight',
+                'subjects_weight',
+                'publisher_weight',
+            ),
+        )
+
+
+class CandidateRank(models.Model):
+
+    ranking = models.ForeignKey(CandidateRanking, on_delete=models.CASCADE, related_name='ranks')
+    candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE, related_name='ranks')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = (('ranking', 'candidate'),)
+        # matches the ordering used by the candidate list (nulls last, ties by descending pk)
+        indexes = [
+            models.Index(
+                F('ranking'),
+                F('score').desc(nulls_last=True),
+                F('candidate').desc(),
+                name='candidates_rank_order_idx',
+            )
+        ]
+
+
 class CandidateWorkLink(models.Model):
 
     candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE)
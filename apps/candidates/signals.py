@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .logic.ranking import request_profile_ranking
+from .models import CandidatesSettings
+
+
+@receiver(post_save, sender=CandidatesSettings)
+def create_profile_ranking(sender, instance, **kwargs):
+    """
+    Saved profiles get a precomputed ranking of candidates, it is computed in the background
+    """
+    request_profile_ranking(instance)
@@ -2,7 +2,9 @@ import pytest
 from django.core.management import call_command
 from django.utils.timezone import now
 
-from candidates.models import Candidate
+from bookrank.models import Author
+from candidates.logic.ranking import SCORE_YEARS, sync_rankings
+from candidates.models import Candidate, CandidateRanking, CandidatesSettings
 from source_data.models import DataRecord
 
 THEMA_CREATE_FILE = 'apps/bookrank/tests/data/thema_cats.json'
@@ -26,6 +28,51 @@ class TestSyncCandidatesToDataRecords:
         assert len(candidate_langs) == 1
         assert candidate_langs[0].name == 'candidates_test_lang'
 
+    def test_batches_and_jobs(self, work_set, data_records):
+        call_command('sync_candidates_to_data_records', work_set.name, batch_size=2, jobs=2)
+        assert Candidate.objects.count() == data_records.count()
+        data = {
+            candidate.isbn: (
+                candidate.title,
+                candidate.publisher.name,
+                set(candidate.authors.values_list('name', flat=True)),
+                set(candidate.languages.values_list('name', flat=True)),
+            )
+            for candidate in Candidate.objects.all()
+        }
+        Candidate.objects.all().delete()
+        call_command('sync_candidates_to_data_records', work_set.name)
+        assert {
+            candidate.isbn: (
+                candidate.title,
+                candidate.publisher.name,
+                set(candidate.authors.values_list('name', flat=True)),
+                set(candidate.languages.values_list('name', flat=True)),
+            )
+            for candidate in Candidate.objects.all()
+        } == data
+
+    def test_resync_m2m(self, work_set, data_records, isbn):
+        call_command('sync_candidates_to_data_records', work_set.name)
+        candidate = Candidate.objects.get(isbn=isbn)
+        author = Author.objects.create(name='Extra, Author', work_set=work_set)
+        candidate.authors.add(author)
+        assert candidate.authors.count() == 2
+        call_command('sync_candidates_to_data_records', work_set.name, ignore_last_updated=True)
+        assert list(candidate.authors.values_list('name', flat=True)) == ['Candidates, Test Author']
+        assert Candidate.objects.count() == data_records.count()
+
+    def test_new_candidates_ranked(self, admin_user, work_set, data_records):
+        CandidatesSettings.objects.create(
+            user=admin_user,
+            name='test',
+            settings_obj={'weights': {'authors': 1}, 'scoreYearIdx': SCORE_YEARS.index('all')},
+        )
+        sync_rankings()
+        call_command('sync_candidates_to_data_records', work_set.name)
+        ranking = CandidateRanking.objects.get()
+        assert ranking.ranks.count() == Candidate.objects.count() > 0
+
     def test_duplicated_isbns(self, work_set, data_records):
         assert DataRecord.objects.count() == len(data_records)
         first_record = DataRecord.objects.get(pk=data_records[0].pk)
@@ -0,0 +1,87 @@
+import pytest
+
+from bookrank.models import Author
+from candidates.logic.ranking import SCORE_YEARS, find_ranking, sync_rankings
+from candidates.logic.static_scores import update_candidates_static_scores
+from candidates.models import Candidate, CandidateRank, CandidateRanking, CandidatesSettings
+from candidates.tests.fake_data import CandidateFactory
+
+# weights as stored in profiles and the ratios sent by the frontend
+WEIGHTS = {'authors': 5, 'languages': 2, 'subjects': 10, 'publisher': 3}
+RATIOS = {'authors': 0.25, 'languages': 0.1, 'subjects': 0.5, 'publisher': 0.15}
+
+
+def create_profile(user, weights=WEIGHTS, year='all', internal=False):
+    return CandidatesSettings.objects.create(
+        user=user,
+        name='test',
+        internal=internal,
+        settings_obj={'weights': dict(weights), 'scoreYearIdx': SCORE_YEARS.index(year)},
+    )
+
+
+@pytest.mark.django_db()
+class TestCandidateRanking:
+    def test_profile_ranking(self, admin_user, candidates, authors):
+        candidate = candidates.order_by('pk').first()
+        candidate.authors.add(authors[0])
+        Author.objects.filter(pk=authors[0].pk).update(normalized_score={'score_all': 40})
+        update_candidates_static_scores(score_type='normalized')
+        profile = create_profile(admin_user)
+        assert CandidateRanking.objects.filter(ready=False).count() == 1, 'pending ranking'
+        assert not CandidateRank.objects.exists(), 'ranks are not computed on save'
+        assert find_ranking(RATIOS, 'all') is None
+        assert sync_rankings() == {'ranks_created': candidates.count(), 'computed': 1}
+        ranking = find_ranking(RATIOS, 'all')
+        assert find_ranking(WEIGHTS, 'all').pk == ranking.pk, 'weights are compared as ratios'
+        assert ranking.ranks.count() == candidates.count()
+        assert ranking.ranks.get(candidate=candidate).score == 10
+        expected = {
+            c.pk: c.score for c in Candidate.objects.annotate_score(RATIOS, 'all', 'normalized')
+        }
+        ranks = dict(ranking.ranks.values_list('candidate_id', 'score'))
+        assert ranks == pytest.approx(expected)
+        create_profile(admin_user)
+        assert CandidateRanking.objects.count() == 1, 'the same ranking is shared'
+        profile.settings_obj['weights']['authors'] = 1
+        profile.save()
+        stats = sync_rankings()
+        assert stats['removed'] == 0, 'still used by the other profile'
+        assert stats['computed'] == 1
+        assert find_ranking({**WEIGHTS, 'authors': 1}, 'all').ranks.count() == candidates.count()
+
+    def test_profile_deleted(self, admin_user, candidates):
+        profile = create_profile(admin_user, year='2020')
+        sync_rankings()
+        ranking = find_ranking(WEIGHTS, '2020')
+        assert ranking is not None
+        profile.delete()
+        assert sync_rankings() == {'removed': 1}
+        assert not CandidateRanking.objects.exists()
+        assert not CandidateRank.objects.filter(ranking_id=ranking.pk).exists()
+
+    def test_internal_profile_not_ranked(self, admin_user, candidates):
+        create_profile(admin_user, internal=True)
+        assert sync_rankings() == {}
+        assert not CandidateRanking.objects.exists()
+
+    def test_ranks_follow_scores(self, admin_user, candidates, authors):
+        candidate = candidates.order_by('pk').first()
+        candidate.authors.add(authors[0])
+        create_profile(admin_user)
+        sync_rankings()
+        ranking = find_ranking(WEIGHTS, 'all')
+        assert ranking.ranks.get(candidate=candidate).score == 0
+        author = Author.objects.get(pk=authors[0].pk)
+        author.normalized_score = {'score_all': 80}
+        author.save()
+        stats = update_candidates_static_scores(score_type='normalized')
+        assert stats['ranks_updated'] == 1
+        assert ranking.ranks.get(candidate=candidate).score == 20
+        # new candidates are ranked once they are scored
+        new = CandidateFactory.create()
+        assert not ranking.ranks.filter(candidate=new).exists()
+        update_candidates_static_scores(
+            Candidate.objects.filter(pk=new.pk), score_type='normalized'
+        )
+        assert ranking.ranks.get(candidate=new).score == 0
@@ -4,7 +4,9 @@ from datetime import date
 import pytest
 
 from bookrank.logic.static_score import update_static_scores
+from bookrank.models import Author
 from candidates.logic.static_scores import YEARS, update_candidates_static_scores
+from candidates.models import Candidate, CandidateScore
 from hits.models import WorkHit
 
 
@@ -42,7 +44,42 @@ class TestCandidateManager:
                     'subjects_score': (5.0 * (j + 1) * (i + 1)),
                     'publisher_score': (5.0 * (j + 1) * (i + 1)),
                 }
+        # typed copies of the scores are used for ranking
+        for candidate in candidates_list:
+            score = CandidateScore.objects.get(candidate=candidate, score_type='static', year='all')
+            assert score.authors_score == candidate.static_scores['score_all']['authors_score']
+            assert score.publisher_score == candidate.static_scores['score_all']['publisher_score']
+        assert CandidateScore.objects.filter(score_type='static').count() == candidates.count() * (
+            len(YEARS) + 1
+        )
         # test that updating again does update anything
         stats = update_candidates_static_scores()
         assert stats['updated'] == 0, 'nothing should be updated - data has not changed'
         assert stats['unchanged'] > 0, 'all should be unchanged'
+
+    def test_update_only_changed(self, candidates, authors):
+        candidate, other = candidates[:2]
+        candidate.authors.add(authors[0])
+        stats = update_candidates_static_scores()
+        assert stats['updated'] == len(candidates), 'first run processes all candidates'
+        author = Author.objects.get(pk=authors[0].pk)
+        author.static_score = {'score_all': 10}
+        author.save()
+        Candidate.objects.filter(pk=other.pk).update(static_scores={})
+        stats = update_candidates_static_scores()
+        assert stats['updated'] == 1, 'only the candidate of the changed author'
+        candidate.refresh_from_db()
+        assert candidate.static_scores['score_all']['authors_score'] == 10
+        assert candidate.static_scores['score_2020']['authors_score'] == 0
+        assert candidate.scores.get(score_type='static', year='all').authors_score == 10
+        other.refresh_from_db()
+        assert other.static_scores == {}, 'neither the candidate nor its topics changed'
+        stats = update_candidates_static_scores(full=True)
+        assert stats['updated'] == 1
+        other.refresh_from_db()
+        assert other.static_scores['score_all'] == {
+            'authors_score': 0,
+            'languages_score': 0,
+            'subjects_score': 0,
+            'publisher_score': 0,
+        }
@@ -5,6 +5,9 @@ from django.core.management import call_command
 from django.urls import reverse
 
 from bookrank.models import Author, Work
+from candidates.logic.static_scores import update_candidates_static_scores
+from candidates.logic.ranking import SCORE_YEARS, sync_rankings
+from candidates.managers import CandidateQuerySet
 from candidates.models import Candidate, CandidatesSettings
 from candidates.tests.fake_data import CandidateFactory
 
@@ -41,6 +44,51 @@ class TestCandidateViewSet:
         assert resp_isbns == list(candidates.order_by('-isbn').values_list('isbn', flat=True))
         assert len(results) == candidates.count()
 
+    @pytest.mark.parametrize(['profile'], [(None,), ('pending',), ('ranked',)])
+    def test_list_score(self, admin_client, admin_user, candidates, authors, profile, monkeypatch):
+        """
+        Scores are read from the ranking of a saved profile once it is computed, the weights
+        are stored in the profile as set by the user and sent by the frontend as ratios
+        """
+        candidate = candidates.order_by('pk').first()
+        candidate.authors.add(authors[0])
+        Author.objects.filter(pk=authors[0].pk).update(normalized_score={'score_all': 50})
+        update_candidates_static_scores(score_type='normalized')
+        # not scored yet
+        CandidateFactory.create()
+        weights = {'authors': 2, 'languages': 1, 'subjects': 1, 'publisher': 1}
+        if profile:
+            CandidatesSettings.objects.create(
+                user=admin_user,
+                name='test',
+                settings_obj={'weights': weights, 'scoreYearIdx': SCORE_YEARS.index('all')},
+            )
+        if profile == 'ranked':
+            sync_rankings()
+
+            def annotate_score(*args, **kwargs):
+                raise AssertionError('the precomputed ranking must be used')
+
+            monkeypatch.setattr(CandidateQuerySet, 'annotate_score', annotate_score)
+        q = {
+            'show_score': 'true',
+            'score_year': 'all',
+            'weights': json.dumps({k: v / sum(weights.values()) for k, v in weights.items()}),
+            'order_by': '-score',
+        }
+        results = self.helper(admin_client, q=q)
+        assert len(results) == Candidate.objects.count()
+        assert results[0]['pk'] == candidate.pk
+        assert results[0]['score'] == pytest.approx(20)
+        assert all(obj['score'] == 0 for obj in results[1:])
+
+    def test_list_score_without_year(self, admin_client, candidates):
+        weights = {'authors': 1, 'languages': 1, 'subjects': 1, 'publisher': 1}
+        q = {'show_score': 'true', 'weights': json.dumps(weights), 'order_by': '-score'}
+        results = self.helper(admin_client, q=q)
+        assert len(results) == candidates.count()
+        assert all(obj['score'] == 0 for obj in results)
+
     def test_list_filters(self, admin_client, candidates, isbn):
         author = Author.objects.get(name='Candidates, Test Author')
         q = {'filters': json.dumps({"author": [author.pk]})}
@@ -2,7 +2,7 @@ import csv
 import json
 from urllib.parse import parse_qs
 
-from django.db.models import OuterRef, Exists, Q, prefetch_related_objects
+from django.db.models import F, OuterRef, Exists, FilteredRelation, Q, prefetch_related_objects
 from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.decorators import action
@@ -12,7 +12,8 @@ from rest_framework.viewsets import ModelViewSet
 from bookrank.views import BaseDataTableViewSet
 from . import models
 from . import serializers
-from .models import Candidate
+from .logic.ranking import find_ranking
+from .models import Candidate, CandidateScore
 
 DEFAULT_SETTINGS_OBJ = {
     'filters': {},
@@ -86,10 +87,19 @@ class CandidateViewSet(BaseDataTableViewSet):
                 qs = qs.exclude(q)
 
         if self.request.query_params.get('show_score', False):
-            year = self.request.query_params.get('score_year')
+            year = self.request.query_params.get('score_year') or 'all'
             weights = json.loads(self.request.query_params.get('weights'))
             weights = {k: float(v) for k, v in weights.items()}
-            qs = qs.annotate_score(weights, year, 'normalized')
+            if ranking := find_ranking(weights, year):
+                # every candidate has a rank in a computed ranking, so the ranks are joined
+                # directly and the rank index serves the ordering and pagination
+                qs = (
+                    qs.annotate(rank=FilteredRelation('ranks', condition=Q(ranks__ranking=ranking)))
+                    .filter(rank__isnull=False)
+                    .annotate(score=F('rank__score'))
+                )
+            else:
+                qs = qs.annotate_score(weights, year, CandidateScore.SCORE_TYPE_NORMALIZED)
         return self.apply_filters(qs)
 
     @action(detail=True, methods=['post'])
@@ -0,0 +1,79 @@
+"""
+Management of yearly partitions of the `WorkHit` table.
+
+The table is partitioned by `date` (see migration `0005_workhit_partitioning`). Hits which do
+not fall into any yearly partition end up in the default partition, so partitions for future
+years should be created in advance using the `create_workhit_partitions` command.
+"""
+
+import logging
+import re
+from typing import Iterable, List
+
+from django.db import connection
+from django.db.transaction import atomic
+
+from ..models import WorkHit
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME_RE = re.compile(r'_y(\d{4})$')
+
+
+def partition_name(year: int) -> str:
+    return f'{WorkHit._meta.db_table}_y{year}'
+
+
+def default_partition_name() -> str:
+    return f'{WorkHit._meta.db_table}_default'
+
+
+def existing_partition_years() -> List[int]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass',
+            [WorkHit._meta.db_table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted(int(m.group(1)) for name in names if (m := PARTITION_NAME_RE.search(name)))
+
+
+@atomic
+def create_partition(year: int) -> int:
+    """
+    Creates partition for `year` and moves hits for this year from the default partition
+    into it. Returns the number of moved hits.
+    """
+    table = WorkHit._meta.db_table
+    partition = partition_name(year)
+    start, end = f'{year}-01-01', f'{year + 1}-01-01'
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS)')
+        # hits from the default partition must be moved, otherwise attaching would fail
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {default_partition_name()} '
+            f'WHERE date >= %s AND date < %s RETURNING *) '
+            f'INSERT INTO {partition} SELECT * FROM moved',
+            [start, end],
+        )
+        moved = cursor.rowcount
+        cursor.execute(
+            f'ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (%s) TO (%s)',
+            [start, end],
+        )
+    logger.info('Created partition %s, moved %d hits into it', partition, moved)
+    return moved
+
+
+def create_partitions(years: Iterable[int]) -> List[int]:
+    """
+    Creates partitions for those of `years` which do not have them yet.
+    Returns the list of years for which the partition was created.
+    """
+    existing = set(existing_partition_years())
+    created = []
+    for year in sorted(set(years) - existing):
+        create_partition(year)
+        created.append(year)
+    return created
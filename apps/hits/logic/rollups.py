@@ -0,0 +1,331 @@
+"""
+Maintenance and querying of pre-aggregated WorkHit rollups.
+
+The rollups (`WorkHitMonth` and `WorkHitYear`) contain sums of `WorkHit.value` per work, hit
+type and period. Queries for hit sums are split into parts which align with the rollup
+granularity and only the ragged edges of the requested date range are computed from the raw
+`WorkHit` table.
+
+Rollups are only used after they were built using the `rebuild_workhit_rollups` command.
+From then on, they are updated incrementally whenever hits are loaded through
+`sync_workhits_with_db`. Hits written by other means must be followed by a rebuild.
+"""
+
+import logging
+import operator
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from functools import reduce
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, NullIf, TruncMonth, TruncYear
+from django.db.transaction import atomic
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.logic.query import prefix_query_filter
+from core.models import SingletonValue
+from ..models import WorkHit, WorkHitMonth, WorkHitYear
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_KEY = 'workhit_rollups'
+BATCH_SIZE = 10_000
+
+DateRange = Tuple[Optional[date], Optional[date]]
+
+
+def rollups_available() -> bool:
+    """
+    Rollups are only trusted after they were fully built at least once
+    """
+    return SingletonValue.objects.filter(key=ROLLUPS_KEY).exists()
+
+
+def month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def year_start(value: date) -> date:
+    return value.replace(month=1, day=1)
+
+
+def _next_month(value: date) -> date:
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def _month_ceil(value: date) -> date:
+    return value if value.day == 1 else _next_month(value)
+
+
+def _year_ceil(value: date) -> date:
+    return value if (value.month, value.day) == (1, 1) else date(value.year + 1, 1, 1)
+
+
+def date_range_from_filter(date_filter: dict) -> Optional[DateRange]:
+    """
+    Converts a filter on the `date` attribute into a tuple (start, end) where `start` is
+    inclusive and `end` is exclusive. Missing bounds are represented by None.
+    Returns None if the filter cannot be expressed this way.
+    """
+    start = end = None
+    for key, value in date_filter.items():
+        if isinstance(value, datetime):
+            return None
+        if isinstance(value, str):
+            try:
+                value = parse_date(value)
+            except ValueError:
+                return None
+        if not isinstance(value, date):
+            return None
+        if key == 'date__gte':
+            start = max(start, value) if start else value
+        elif key == 'date__gt':
+            value += timedelta(days=1)
+            start = max(start, value) if start else value
+        elif key == 'date__lt':
+            end = min(end, value) if end else value
+        elif key == 'date__lte':
+            value += timedelta(days=1)
+            end = min(end, value) if end else value
+        else:
+            return None
+    return start, end
+
+
+def split_date_range(start: Optional[date], end: Optional[date]) -> Dict[str, List[DateRange]]:
+    """
+    Splits the date range into parts which may be computed from yearly and monthly rollups
+    and the remaining parts which must be computed from the raw data (`day`).
+    """
+    parts = {'day': [], 'month': [], 'year': []}
+    month_from = _month_ceil(start) if start else None
+    month_to = month_start(end) if end else None
+    if month_from and month_to and month_from >= month_to:
+        parts['day'].append((start, end))
+        return parts
+    if start != month_from:
+        parts['day'].append((start, month_from))
+    if end != month_to:
+        parts['day'].append((month_to, end))
+    year_from = _year_ceil(month_from) if month_from else None
+    year_to = year_start(month_to) if month_to else None
+    if year_from and year_to and year_from >= year_to:
+        parts['month'].append((month_from, month_to))
+        return parts
+    if month_from != year_from:
+        parts['month'].append((month_from, year_from))
+    if month_to != year_to:
+        parts['month'].append((year_to, month_to))
+    parts['year'].append((year_from, year_to))
+    return parts
+
+
+def _date_range_to_q(start: Optional[date], end: Optional[date]) -> Q:
+    out = {}
+    if start:
+        out['date__gte'] = start
+    if end:
+        out['date__lt'] = end
+    return Q(**out)
+
+
+def hit_sources_for_date_filter(date_filter: dict) -> list:
+    """
+    Returns a list of (model, Q) tuples which together cover the hits matching `date_filter`
+    """
+    if not rollups_available():
+        return [(WorkHit, Q(**date_filter))]
+    if not date_filter:
+        return [(WorkHitYear, Q())]
+    date_range = date_range_from_filter(date_filter)
+    if date_range is None:
+        return [(WorkHit, Q(**date_filter))]
+    start, end = date_range
+    if start and end and start >= end:
+        return [(WorkHit, Q(**date_filter))]
+    level_to_model = {'day': WorkHit, 'month': WorkHitMonth, 'year': WorkHitYear}
+    return [
+        (level_to_model[level], reduce(operator.or_, [_date_range_to_q(*r) for r in ranges]))
+        for level, ranges in split_date_range(start, end).items()
+        if ranges
+    ]
+
+
+def hit_sum_expression(
+    work_lookup: str,
+    date_filter: Optional[dict] = None,
+    hit_type_filter: Optional[dict] = None,
+    work_filter: Optional[dict] = None,
+):
+    """
+    Creates an expression which computes the sum of hits related to `OuterRef('pk')`.
+
+    :param work_lookup: lookup from the hit `work` to the outer object - `work` for works,
+                        `work__authors` for authors, etc.
+    :param date_filter: filter on hit date, e.g. from `date_filter_from_request`
+    :param hit_type_filter: filter on hit type, e.g. `{'typ_id': 1}`
+    :param work_filter: filter on the works whose hits should be considered
+    :return: the sum of hits, None if there are no matching hits
+    """
+    base_filter = {
+        **(hit_type_filter or {}),
+        **prefix_query_filter(work_filter or {}, 'work__'),
+        work_lookup: OuterRef('pk'),
+    }
+    sums = [
+        Subquery(
+            model.objects.filter(q, **base_filter)
+            .order_by()
+            .values(work_lookup)
+            .annotate(total=Sum('value'))
+            .values('total'),
+            output_field=IntegerField(),
+        )
+        for model, q in hit_sources_for_date_filter(date_filter or {})
+    ]
+    if len(sums) == 1:
+        return sums[0]
+    # the parts must be coalesced to be summed up, but we want to keep the semantics of `Sum`
+    # which gives NULL when there is nothing to sum
+    return NullIf(reduce(operator.add, [Coalesce(s, 0) for s in sums]), 0)
+
+
+def hit_sum_total(
+    date_filter: Optional[dict] = None,
+    hit_type_filter: Optional[dict] = None,
+    work_filter: Optional[dict] = None,
+) -> Optional[int]:
+    """
+    Computes the sum of all hits matching the filters. The meaning of the parameters is the
+    same as in `hit_sum_expression`.
+    """
+    base_filter = {**(hit_type_filter or {}), **prefix_query_filter(work_filter or {}, 'work__')}
+    total = None
+    for model, q in hit_sources_for_date_filter(date_filter or {}):
+        part = model.objects.filter(q, **base_filter).aggregate(sum=Sum('value'))['sum']
+        if part is not None:
+            total = (total or 0) + part
+    return total
+
+
+def hit_model_for_period(step: str, date_filter: dict):
+    """
+    Returns the model from which hit sums for periods of length `step` may be computed
+    without any loss of precision given the `date_filter`.
+    """
+    if step not in ('month', 'year') or not rollups_available():
+        return WorkHit
+    if not date_filter:
+        return WorkHitYear if step == 'year' else WorkHitMonth
+    date_range = date_range_from_filter(date_filter)
+    if date_range is None:
+        return WorkHit
+    bounds = [bound for bound in date_range if bound]
+    if step == 'year' and all(bound == year_start(bound) for bound in bounds):
+        return WorkHitYear
+    if all(bound.day == 1 for bound in bounds):
+        return WorkHitMonth
+    return WorkHit
+
+
+def hit_deltas(hits: Iterable[WorkHit], sign: int = 1) -> Counter:
+    """
+    Converts hits into a Counter of values keyed by (work_id, typ_id, date) suitable
+    for `update_rollups`
+    """
+    deltas = Counter()
+    for hit in hits:
+        date_val = parse_date(hit.date) if isinstance(hit.date, str) else hit.date
+        deltas[(hit.work_id, hit.typ_id, date_val)] += sign * hit.value
+    return deltas
+
+
+def update_rollups(deltas: Counter) -> Counter:
+    """
+    Adds values from `deltas` (as created by `hit_deltas`) to the rollups. Only the rollup
+    records for the periods and works present in `deltas` are touched.
+    """
+    stats = Counter()
+    if not deltas or not rollups_available():
+        return stats
+    for model, truncate in ((WorkHitMonth, month_start), (WorkHitYear, year_start)):
+        period_deltas = Counter()
+        for (work_id, typ_id, date_val), value in deltas.items():
+            period_deltas[(work_id, typ_id, truncate(date_val) if date_val else None)] += value
+        _apply_rollup_deltas(model, period_deltas, stats)
+    logger.debug('Rollups updated: %s', stats)
+    return stats
+
+
+def _apply_rollup_deltas(model, deltas: Counter, stats: Counter) -> None:
+    work_to_keys = defaultdict(list)
+    for key, value in deltas.items():
+        if value:
+            work_to_keys[key[0]].append(key)
+    work_ids = sorted(work_to_keys)
+    for i in range(0, len(work_ids), BATCH_SIZE):
+        batch_keys = [
+            key for work_id in work_ids[i : i + BATCH_SIZE] for key in work_to_keys[work_id]
+        ]
+        dates = {key[2] for key in batch_keys}
+        date_q = Q(date__in=[d for d in dates if d])
+        if None in dates:
+            date_q |= Q(date__isnull=True)
+        existing = {
+            (rec.work_id, rec.typ_id, rec.date): rec
+            for rec in model.objects.filter(date_q, work_id__in=work_ids[i : i + BATCH_SIZE])
+        }
+        to_update = []
+        to_create = []
+        for key in batch_keys:
+            rec = existing.get(key)
+            if rec:
+                rec.value += deltas[key]
+                to_update.append(rec)
+            else:
+                work_id, typ_id, date_val = key
+                to_create.append(
+                    model(work_id=work_id, typ_id=typ_id, date=date_val, value=deltas[key])
+                )
+        model.objects.bulk_update(to_update, ['value'], batch_size=1000)
+        model.objects.bulk_create(to_create, batch_size=1000)
+        stats[f'{model.__name__}_updated'] += len(to_update)
+        stats[f'{model.__name__}_created'] += len(to_create)
+
+
+@atomic
+def rebuild_rollups() -> Counter:
+    """
+    Recomputes all rollups from raw hits and marks the rollups as available
+    """
+    stats = Counter()
+    for model, trunc in ((WorkHitMonth, TruncMonth), (WorkHitYear, TruncYear)):
+        logger.info('Rebuilding %s', model.__name__)
+        model.objects.all().delete()
+        rows = (
+            WorkHit.objects.annotate(period=trunc('date'))
+            .values('work_id', 'typ_id', 'period')
+            .annotate(total=Sum('value'))
+            .order_by()
+        )
+        to_create = []
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            to_create.append(
+                model(
+                    work_id=row['work_id'],
+                    typ_id=row['typ_id'],
+                    date=row['period'],
+                    value=row['total'],
+                )
+            )
+            if len(to_create) >= BATCH_SIZE:
+                model.objects.bulk_create(to_create)
+                stats[f'{model.__name__}_created'] += len(to_create)
+                to_create = []
+        model.objects.bulk_create(to_create)
+        stats[f'{model.__name__}_created'] += len(to_create)
+    SingletonValue.objects.update_or_create(key=ROLLUPS_KEY, defaults={'date': timezone.now()})
+    return stats
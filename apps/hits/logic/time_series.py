@@ -0,0 +1,119 @@
+"""
+Support for hit statistics in time - complete (dense) time series computed in the database
+and metadata about all hits which is kept in `SingletonValue` and invalidated whenever hits
+are written.
+"""
+
+import json
+import logging
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import Exists, Max, Min, OuterRef, QuerySet
+from django.utils.dateparse import parse_date
+
+from core.models import SingletonValue
+from ..models import HitType, WorkHit
+from .rollups import date_range_from_filter
+
+logger = logging.getLogger(__name__)
+
+METADATA_KEY = 'workhit_metadata'
+
+STEP_TO_INTERVAL = {'year': '1 year', 'month': '1 month', 'week': '1 week', 'day': '1 day'}
+
+
+def invalidate_hit_metadata() -> None:
+    SingletonValue.objects.filter(key=METADATA_KEY).delete()
+
+
+def get_hit_metadata() -> dict:
+    """
+    Returns ids of hit types which have any hits and the date of the first and last hit.
+    The values are computed only when not already stored.
+    """
+    try:
+        data = json.loads(SingletonValue.objects.get(key=METADATA_KEY).text)
+    except SingletonValue.DoesNotExist:
+        logger.debug('Computing hit metadata')
+        bounds = WorkHit.objects.aggregate(min_date=Min('date'), max_date=Max('date'))
+        data = {
+            'hit_type_ids': list(
+                HitType.objects.filter(Exists(WorkHit.objects.filter(typ_id=OuterRef('pk'))))
+                .order_by('pk')
+                .values_list('pk', flat=True)
+            ),
+            'min_date': bounds['min_date'].isoformat() if bounds['min_date'] else None,
+            'max_date': bounds['max_date'].isoformat() if bounds['max_date'] else None,
+        }
+        SingletonValue.objects.update_or_create(
+            key=METADATA_KEY, defaults={'text': json.dumps(data)}
+        )
+    for key in ('min_date', 'max_date'):
+        if data[key]:
+            data[key] = parse_date(data[key])
+    return data
+
+
+def truncate_date(value: date, step: str) -> date:
+    """
+    Python counterpart of the Trunc* database functions
+    """
+    if step == 'year':
+        return value.replace(month=1, day=1)
+    if step == 'month':
+        return value.replace(day=1)
+    if step == 'week':
+        return value - timedelta(days=value.weekday())
+    return value
+
+
+def series_bounds(
+    step: str, date_filter: dict, metadata: Optional[dict] = None
+) -> Tuple[Optional[date], Optional[date]]:
+    """
+    Returns the first and last period (truncated according to `step`) of the time series -
+    the dates of the first and last hit limited by the `date_filter`.
+    """
+    metadata = metadata or get_hit_metadata()
+    start, end = metadata['min_date'], metadata['max_date']
+    if start is None:
+        return None, None
+    if date_filter:
+        date_range = date_range_from_filter(date_filter)
+        if date_range is None:
+            # the filter cannot be converted into bounds, we ask the database
+            bounds = WorkHit.objects.filter(**date_filter).aggregate(
+                min_date=Min('date'), max_date=Max('date')
+            )
+            start, end = bounds['min_date'], bounds['max_date']
+            if start is None:
+                return None, None
+        else:
+            if date_range[0]:
+                start = max(start, date_range[0])
+            if date_range[1]:
+                end = min(end, date_range[1] - timedelta(days=1))
+    return truncate_date(start, step), truncate_date(end, step)
+
+
+def dense_time_series(data: QuerySet, start: date, end: date, step: str) -> List[tuple]:
+    """
+    Joins the grouped data to a series of all periods between `start` and `end`, so that
+    periods without data are present as well.
+
+    :param data: queryset with `unit` (the truncated date), `typ` and `score`
+    :return: list of (unit, typ_id, score) ordered by unit; typ_id and score are None for
+             periods without data
+    """
+    sql, params = data.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT series.unit::date, data.typ_id, data.score '
+            f'FROM generate_series(%s::date, %s::date, %s::interval) AS series(unit) '
+            f'LEFT JOIN ({sql}) data ON data.unit::date = series.unit::date '
+            f'ORDER BY series.unit, data.typ_id',
+            [start, end, STEP_TO_INTERVAL[step], *params],
+        )
+        return cursor.fetchall()
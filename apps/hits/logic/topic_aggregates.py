@@ -0,0 +1,297 @@
+"""
+Maintenance and querying of hit sums pre-aggregated per explicit topic, hit type and month.
+
+The aggregates (`TopicHitMonth` and `TopicWorkCount`) are built per workset using the
+`rebuild_topic_hit_aggregates` command. From then on, they are updated incrementally when hits
+are loaded and rebuilt for the changed topics after explicit topic extraction.
+
+They may only be used for queries which do not filter works and whose date filter is aligned
+to whole months, other queries must be computed from the hits.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import TruncMonth
+from django.db.transaction import atomic
+from django.utils import timezone
+
+from bookrank.logic.static_score import work_topic_links
+from bookrank.models import (
+    Author,
+    Language,
+    OwnerInstitution,
+    Publisher,
+    SubjectCategory,
+    WorkCategory,
+    WorkSet,
+)
+from core.models import SingletonValue
+from ..models import TopicHitMonth, TopicWorkCount, WorkHit, WorkHitMonth
+from .rollups import BATCH_SIZE, date_range_from_filter, month_start, rollups_available
+
+logger = logging.getLogger(__name__)
+
+# topic model and name of the `Work` field pointing to it
+TOPIC_FIELDS = (
+    (Author, 'authors'),
+    (Publisher, 'publishers'),
+    (Language, 'lang'),
+    (SubjectCategory, 'subject_categories'),
+    (OwnerInstitution, 'owner_institution'),
+    (WorkCategory, 'category'),
+)
+
+
+def topic_type_for_model(model) -> str:
+    return model._meta.model_name
+
+
+def _available_key(work_set: WorkSet) -> str:
+    return f'topic_hit_aggregates_{work_set.pk}'
+
+
+def topic_aggregates_available(work_set: WorkSet) -> bool:
+    return SingletonValue.objects.filter(key=_available_key(work_set)).exists()
+
+
+def _month_range_from_filter(date_filter: dict):
+    """
+    Returns (start, end) of the filter if both are aligned to whole months, None otherwise
+    """
+    date_range = date_range_from_filter(date_filter)
+    if date_range is None:
+        return None
+    if any(bound and bound.day != 1 for bound in date_range):
+        return None
+    return date_range
+
+
+def topic_aggregates_usable(
+    work_set: WorkSet, date_filter: Optional[dict], work_filter: Optional[dict]
+) -> bool:
+    if work_filter:
+        return False
+    if date_filter and _month_range_from_filter(date_filter) is None:
+        return False
+    return topic_aggregates_available(work_set)
+
+
+def topic_hit_sum_expression(
+    model, date_filter: Optional[dict] = None, hit_type_filter: Optional[dict] = None
+):
+    """
+    Creates an expression which computes the sum of hits for the topic `OuterRef('pk')`
+    from the aggregates. Check `topic_aggregates_usable` before using it.
+    """
+    q = Q()
+    if date_filter:
+        start, end = _month_range_from_filter(date_filter)
+        if start:
+            q &= Q(date__gte=start)
+        if end:
+            q &= Q(date__lt=end)
+    return Subquery(
+        TopicHitMonth.objects.filter(
+            q,
+            topic_type=topic_type_for_model(model),
+            topic_id=OuterRef('pk'),
+            **(hit_type_filter or {}),
+        )
+        .order_by()
+        .values('topic_id')
+        .annotate(total=Sum('value'))
+        .values('total'),
+        output_field=IntegerField(),
+    )
+
+
+def topic_work_count_expression(model):
+    return Subquery(
+        TopicWorkCount.objects.filter(
+            topic_type=topic_type_for_model(model), topic_id=OuterRef('pk')
+        ).values('work_count')[:1],
+        output_field=IntegerField(),
+    )
+
+
+@atomic
+def rebuild_topic_aggregates(work_set: WorkSet) -> Counter:
+    """
+    Recomputes all aggregates for `work_set` from the hits and marks them as available
+    """
+    stats = Counter()
+    for model, field in TOPIC_FIELDS:
+        _build_topic_aggregates(work_set, model, field, None, stats)
+    SingletonValue.objects.update_or_create(
+        key=_available_key(work_set), defaults={'date': timezone.now()}
+    )
+    return stats
+
+
+def _build_topic_aggregates(
+    work_set: WorkSet, model, field: str, topic_ids: Optional[list], stats: Counter
+) -> None:
+    """
+    Recomputes aggregates of topics `topic_ids` of `model` - all topics if `topic_ids` is None
+    """
+    topic_type = topic_type_for_model(model)
+    logger.info('Rebuilding hit aggregates for %s', topic_type)
+    hit_months = TopicHitMonth.objects.filter(work_set=work_set, topic_type=topic_type)
+    work_counts = TopicWorkCount.objects.filter(work_set=work_set, topic_type=topic_type)
+    topics = model.objects.filter(work_set=work_set)
+    hits_filter = {f'work__{field}__isnull': False}
+    if topic_ids is not None:
+        hit_months = hit_months.filter(topic_id__in=topic_ids)
+        work_counts = work_counts.filter(topic_id__in=topic_ids)
+        topics = topics.filter(pk__in=topic_ids)
+        hits_filter = {f'work__{field}__in': topic_ids}
+    hit_months.delete()
+    work_counts.delete()
+    if rollups_available():
+        source = WorkHitMonth.objects.annotate(month=F('date'))
+    else:
+        source = WorkHit.objects.annotate(month=TruncMonth('date'))
+    rows = (
+        source.filter(work__work_set=work_set, **hits_filter)
+        .values(f'work__{field}', 'typ_id', 'month')
+        .annotate(total=Sum('value'))
+        .order_by()
+    )
+    to_create = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        to_create.append(
+            TopicHitMonth(
+                work_set=work_set,
+                topic_type=topic_type,
+                topic_id=row[f'work__{field}'],
+                typ_id=row['typ_id'],
+                date=row['month'],
+                value=row['total'],
+            )
+        )
+        if len(to_create) >= BATCH_SIZE:
+            TopicHitMonth.objects.bulk_create(to_create)
+            stats['TopicHitMonth_created'] += len(to_create)
+            to_create = []
+    TopicHitMonth.objects.bulk_create(to_create)
+    stats['TopicHitMonth_created'] += len(to_create)
+    counts = (
+        topics.annotate(work_count=Count('works', distinct=True))
+        .filter(work_count__gt=0)
+        .values_list('pk', 'work_count')
+    )
+    to_create = [
+        TopicWorkCount(work_set=work_set, topic_type=topic_type, topic_id=pk, work_count=work_count)
+        for pk, work_count in counts.iterator(chunk_size=BATCH_SIZE)
+    ]
+    TopicWorkCount.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    stats['TopicWorkCount_created'] += len(to_create)
+
+
+def topics_of_works(models, work_ids: list) -> Dict[type, set]:
+    """
+    Returns ids of topics of each of `models` connected to works `work_ids`
+    """
+    model_to_field = dict(TOPIC_FIELDS)
+    out = {}
+    for model in models:
+        topic_ids = set()
+        for i in range(0, len(work_ids), BATCH_SIZE):
+            topic_ids.update(
+                topic_id
+                for _work_id, topic_id in work_topic_links(
+                    model_to_field[model], work_ids[i : i + BATCH_SIZE]
+                )
+            )
+        out[model] = topic_ids
+    return out
+
+
+def update_topic_aggregates(work_set: WorkSet, hit_deltas: Counter) -> Counter:
+    """
+    Adds changes in hits (as produced by `rollups.hit_deltas`) to the aggregates of the topics
+    connected to the affected works. Does nothing if the aggregates were not built yet.
+    """
+    stats = Counter()
+    if not hit_deltas or not topic_aggregates_available(work_set):
+        return stats
+    work_deltas = defaultdict(Counter)
+    for (work_id, typ_id, date_val), value in hit_deltas.items():
+        if value:
+            work_deltas[work_id][(typ_id, month_start(date_val) if date_val else None)] += value
+    work_ids = sorted(work_deltas)
+    for model, field in TOPIC_FIELDS:
+        topic_deltas = defaultdict(Counter)
+        for i in range(0, len(work_ids), BATCH_SIZE):
+            for work_id, topic_id in work_topic_links(field, work_ids[i : i + BATCH_SIZE]):
+                topic_deltas[topic_id].update(work_deltas[work_id])
+        _apply_topic_deltas(work_set, topic_type_for_model(model), topic_deltas, stats)
+    logger.debug('Topic hit aggregates updated: %s', stats)
+    return stats
+
+
+def _apply_topic_deltas(
+    work_set: WorkSet, topic_type: str, topic_deltas: dict, stats: Counter
+) -> None:
+    topic_ids = sorted(topic_deltas)
+    for i in range(0, len(topic_ids), BATCH_SIZE):
+        batch = topic_ids[i : i + BATCH_SIZE]
+        existing = {
+            (rec.topic_id, rec.typ_id, rec.date): rec
+            for rec in TopicHitMonth.objects.filter(topic_type=topic_type, topic_id__in=batch)
+        }
+        to_update = []
+        to_create = []
+        for topic_id in batch:
+            for (typ_id, month), value in topic_deltas[topic_id].items():
+                rec = existing.get((topic_id, typ_id, month))
+                if rec:
+                    rec.value += value
+                    to_update.append(rec)
+                else:
+                    to_create.append(
+                        TopicHitMonth(
+                            work_set=work_set,
+                            topic_type=topic_type,
+                            topic_id=topic_id,
+                            typ_id=typ_id,
+                            date=month,
+                            value=value,
+                        )
+                    )
+        TopicHitMonth.objects.bulk_update(to_update, ['value'], batch_size=1000)
+        TopicHitMonth.objects.bulk_create(to_create, batch_size=1000)
+        stats['TopicHitMonth_updated'] += len(to_update)
+        stats['TopicHitMonth_created'] += len(to_create)
+
+
+@atomic
+def refresh_topic_aggregates(
+    work_set: WorkSet, topics: Optional[Dict[type, Optional[set]]] = None
+) -> Optional[Counter]:
+    """
+    Rebuilds the aggregates after topics were changed, but only if they are in use.
+
+    :param topics: maps topic model to ids of topics which changed (None for all topics of the
+                   model) - only aggregates of those are rebuilt. All aggregates are rebuilt if
+                   not given.
+    """
+    if not topic_aggregates_available(work_set):
+        return None
+    if topics is None:
+        return rebuild_topic_aggregates(work_set)
+    stats = Counter()
+    for model, field in TOPIC_FIELDS:
+        if model not in topics:
+            continue
+        topic_ids = topics[model]
+        if topic_ids is None:
+            _build_topic_aggregates(work_set, model, field, None, stats)
+            continue
+        topic_ids = sorted(topic_ids)
+        for i in range(0, len(topic_ids), BATCH_SIZE):
+            _build_topic_aggregates(work_set, model, field, topic_ids[i : i + BATCH_SIZE], stats)
+    return stats
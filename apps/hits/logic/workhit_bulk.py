@@ -0,0 +1,362 @@
+"""
+Streaming loader of WorkHit data intended for large CSV files.
+
+Instead of creating one `WorkHit` object per hit and comparing it with all existing hits
+in Python (see `workhit_data.sync_workhits_with_db`), the input is parsed and aggregated
+in chunks into compact integer keys, staged into a temporary table using PostgreSQL `COPY`
+and merged with the existing data by set based SQL.
+"""
+
+import csv
+import datetime
+import io
+import logging
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.db import connection
+from django.db.transaction import atomic
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from bookrank.logic.response_cache import bump_data_generation
+from bookrank.logic.static_score import update_static_scores_from_deltas
+from bookrank.models import WorkSet
+from core.logic.files import open_file
+from ..models import HitType, WorkHit
+from .rollups import update_rollups
+from .time_series import invalidate_hit_metadata
+from .topic_aggregates import update_topic_aggregates
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100_000
+# dates are stored as ordinals shifted by this number of bits, so that (work, date) pairs
+# may be represented by a single integer; 0 means the date is not known
+DATE_BITS = 22
+DATE_MASK = (1 << DATE_BITS) - 1
+COPY_NULL = r'\N'
+
+
+def parse_hit_date(value: str) -> Optional[datetime.date]:
+    """
+    Parses dates in the formats found in the hit data - YYYYMMDD, YYYYMMDDHHMM and ISO.
+
+    :raises ValueError: if `value` is not a valid date
+    """
+    if not value:
+        return None
+    if len(value) == 8 or len(value) == 12:
+        return datetime.date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    date_val = parse_date(value)
+    if date_val is None:
+        raise ValueError(f'Invalid date "{value}"')
+    return date_val
+
+
+class HitAccumulator:
+    """
+    Sums of hit values keyed by (work_pk, date) packed into one integer.
+
+    Rows are first collected in typed arrays and only merged into the sums once a whole
+    chunk is read, which keeps memory usage proportional to the number of distinct
+    (work, date) pairs and not to the number of input rows.
+    """
+
+    def __init__(self):
+        self.sums: Dict[int, int] = {}
+        self.rows_read = 0
+        self._keys = array('q')
+        self._values = array('q')
+
+    def __len__(self):
+        self.flush()
+        return len(self.sums)
+
+    @staticmethod
+    def make_key(work_pk: int, date_val: Optional[datetime.date]) -> int:
+        return (work_pk << DATE_BITS) | (date_val.toordinal() if date_val else 0)
+
+    @staticmethod
+    def split_key(key: int) -> Tuple[int, Optional[datetime.date]]:
+        ordinal = key & DATE_MASK
+        return key >> DATE_BITS, datetime.date.fromordinal(ordinal) if ordinal else None
+
+    def add(self, work_pk: int, date_val: Optional[datetime.date], value: int) -> None:
+        self._keys.append(self.make_key(work_pk, date_val))
+        self._values.append(value)
+        self.rows_read += 1
+        if len(self._keys) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        sums = self.sums
+        for key, value in zip(self._keys, self._values):
+            sums[key] = sums.get(key, 0) + value
+        self._keys = array('q')
+        self._values = array('q')
+
+    def merge(self, other: 'HitAccumulator') -> None:
+        other.flush()
+        self.flush()
+        sums = self.sums
+        for key, value in other.sums.items():
+            sums[key] = sums.get(key, 0) + value
+        self.rows_read += other.rows_read
+
+    def items(self) -> Iterator[Tuple[int, Optional[datetime.date], int]]:
+        """
+        Yields (work_pk, date, value) tuples
+        """
+        self.flush()
+        for key, value in self.sums.items():
+            yield (*self.split_key(key), value)
+
+
+def accumulate_workhits_from_csv(
+    filename: str,
+    work_uid_to_pk: Dict[str, int],
+    separator=',',
+    id_col='id',
+    date_col='date',
+    count_col='count',
+    fieldnames=None,
+    accumulator: Optional[HitAccumulator] = None,
+) -> HitAccumulator:
+    """
+    Reads hits from a CSV file into a `HitAccumulator`. The meaning of the parameters is the
+    same as in `workhit_data.extract_workhits_from_csv`.
+    """
+    accumulator = accumulator if accumulator is not None else HitAccumulator()
+    unknown_uids = Counter()
+    with open_file(filename, 'rt') as infile:
+        reader = csv.DictReader(infile, fieldnames=fieldnames, delimiter=separator)
+        while chunk := list(islice(reader, CHUNK_SIZE)):
+            for rec in chunk:
+                work_uid = (rec.get(id_col) or '').strip()
+                if not work_uid:
+                    logger.warning('Record does not contain target ID (%s): %s', id_col, rec)
+                    continue
+                work_pk = work_uid_to_pk.get(work_uid)
+                if not work_pk:
+                    unknown_uids[work_uid] += 1
+                    continue
+                try:
+                    date_val = parse_hit_date(rec.get(date_col))
+                except ValueError as exc:
+                    logger.warning('Skipping record with bad date: %s: %s', exc, rec)
+                    continue
+                accumulator.add(work_pk, date_val, int(rec.get(count_col) or 1))
+            logger.debug('Read %d records', accumulator.rows_read)
+    if unknown_uids:
+        logger.error(
+            'No work in workset for %d IDs (%d records), e.g. "%s"',
+            len(unknown_uids),
+            sum(unknown_uids.values()),
+            next(iter(unknown_uids)),
+        )
+    return accumulator
+
+
+# uid -> pk mapping shared by the worker processes of `accumulate_workhits_from_files`
+_worker_uid_to_pk: Dict[str, int] = {}
+
+
+def _init_worker(work_uid_to_pk: Dict[str, int]) -> None:
+    global _worker_uid_to_pk
+    _worker_uid_to_pk = work_uid_to_pk
+
+
+def _accumulate_file_in_worker(filename: str, **kwargs) -> HitAccumulator:
+    logger.info('Reading file: %s', filename)
+    return accumulate_workhits_from_csv(filename, _worker_uid_to_pk, **kwargs)
+
+
+def accumulate_workhits_from_files(
+    filenames: List[str], work_uid_to_pk: Dict[str, int], jobs: int = 1, **kwargs
+) -> HitAccumulator:
+    """
+    Reads hits from several CSV files using `jobs` processes and merges them into one
+    `HitAccumulator`. `kwargs` are passed to `accumulate_workhits_from_csv`.
+    """
+    accumulator = HitAccumulator()
+    if jobs <= 1:
+        for filename in filenames:
+            logger.info('Reading file: %s', filename)
+            accumulate_workhits_from_csv(
+                filename, work_uid_to_pk, accumulator=accumulator, **kwargs
+            )
+        return accumulator
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(work_uid_to_pk,)
+    ) as executor:
+        for file_accumulator in executor.map(
+            partial(_accumulate_file_in_worker, **kwargs), filenames
+        ):
+            accumulator.merge(file_accumulator)
+    return accumulator
+
+
+def _copy_data(accumulator: HitAccumulator) -> io.StringIO:
+    buffer = io.StringIO()
+    for work_pk, date_val, value in accumulator.items():
+        buffer.write(f'{work_pk}\t{date_val.isoformat() if date_val else COPY_NULL}\t{value}\n')
+    buffer.seek(0)
+    return buffer
+
+
+@atomic
+def sync_accumulated_workhits_with_db(
+    hit_type: HitType, accumulator: HitAccumulator, replace_existing=False
+) -> Counter:
+    """
+    Merges the hits from `accumulator` with the database using a temporary staging table.
+    Replaced hits are updated in place, new ones are inserted. The semantics of
+    `replace_existing` and the returned stats are the same as in
+    `workhit_data.sync_workhits_with_db`.
+    """
+    stats = Counter()
+    if not len(accumulator):
+        return stats
+    table = WorkHit._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE workhit_staging ('
+            'work_id integer NOT NULL, date date, value integer NOT NULL, '
+            'existing_id integer, existing_value integer) ON COMMIT DROP'
+        )
+        cursor.copy_expert(
+            'COPY workhit_staging (work_id, date, value) FROM STDIN', _copy_data(accumulator)
+        )
+        cursor.execute('ANALYZE workhit_staging')
+        cursor.execute(
+            f'UPDATE workhit_staging s SET existing_id = h.id, existing_value = h.value '
+            f'FROM {table} h WHERE h.typ_id = %s AND h.work_id = s.work_id '
+            f'AND h.date IS NOT DISTINCT FROM s.date',
+            [hit_type.pk],
+        )
+        cursor.execute(
+            'SELECT count(*) FILTER (WHERE existing_id IS NULL), '
+            'count(*) FILTER (WHERE existing_value = value), '
+            'count(*) FILTER (WHERE existing_value <> value) FROM workhit_staging'
+        )
+        new, same, different = cursor.fetchone()
+        stats['new'] += new
+        stats['skip existing'] += same
+        stats['replace' if replace_existing else 'no replace'] += different
+        if different and not replace_existing:
+            logger.warning('Not overwriting %d hits with different value', different)
+        # changes which have to be propagated to the rollups and static scores - they are
+        # taken from the rows actually written, so that hits written by a concurrent load
+        # between reading the existing hits and writing are not counted twice
+        deltas = Counter()
+        now = timezone.now()
+        if replace_existing and different:
+            logger.warning('Overwriting %d hits with different value', different)
+            # only hits which still have the value read above are replaced
+            cursor.execute(
+                f'UPDATE {table} h SET value = s.value, last_updated = %s FROM workhit_staging s '
+                f'WHERE h.id = s.existing_id AND s.existing_value <> s.value '
+                f'AND h.value = s.existing_value '
+                f'RETURNING h.work_id, h.date, s.value - s.existing_value',
+                [now],
+            )
+            replaced = cursor.fetchall()
+            if len(replaced) < different:
+                logger.warning(
+                    'Skipped %d hits changed by a concurrent load', different - len(replaced)
+                )
+            for work_id, date_val, delta in replaced:
+                deltas[(work_id, hit_type.pk, date_val)] += delta
+        # conflicts may only come from concurrent loads here, the (work, date, typ) unique
+        # constraint makes sure they do not produce duplicates
+        cursor.execute(
+            f'INSERT INTO {table} (work_id, date, value, typ_id, created, last_updated) '
+            f'SELECT work_id, date, value, %s, %s, %s FROM workhit_staging '
+            f'WHERE existing_id IS NULL ON CONFLICT (work_id, date, typ_id) DO NOTHING '
+            f'RETURNING work_id, date, value',
+            [hit_type.pk, now, now],
+        )
+        inserted = cursor.fetchall()
+        logger.info('Inserted %d new work hits', len(inserted))
+        if len(inserted) < new:
+            logger.warning(
+                'Skipped %d new hits already inserted by a concurrent load', new - len(inserted)
+            )
+        for work_id, date_val, value in inserted:
+            deltas[(work_id, hit_type.pk, date_val)] += value
+        cursor.execute('DROP TABLE workhit_staging')
+    if deltas:
+        invalidate_hit_metadata()
+        update_rollups(deltas)
+        work_set = WorkSet.objects.get(works=next(iter(deltas))[0])
+        update_static_scores_from_deltas(work_set, deltas, stats)
+        update_topic_aggregates(work_set, deltas)
+        bump_data_generation(work_set)
+    return stats
+
+
+def load_workhits_from_csv_files(
+    filenames: List[str],
+    workset: WorkSet,
+    hit_type: HitType,
+    jobs: int = 1,
+    separator=',',
+    id_col='id',
+    date_col='date',
+    count_col='count',
+    fieldnames=None,
+    replace_existing=False,
+) -> Counter:
+    """
+    Loads hits from several CSV files at once - the files are parsed in parallel by `jobs`
+    processes and the merged data is synced with the database in one go. Hits for the same
+    work and date from different files are summed up.
+    """
+    work_uid_to_pk = dict(workset.works.values_list('uid', 'pk'))
+    accumulator = accumulate_workhits_from_files(
+        filenames,
+        work_uid_to_pk,
+        jobs=jobs,
+        separator=separator,
+        id_col=id_col,
+        date_col=date_col,
+        count_col=count_col,
+        fieldnames=fieldnames,
+    )
+    logger.debug('Read %d records, reduced into %d hits', accumulator.rows_read, len(accumulator))
+    return sync_accumulated_workhits_with_db(
+        hit_type, accumulator, replace_existing=replace_existing
+    )
+
+
+def load_workhits_from_csv_streaming(
+    filename: str,
+    workset: WorkSet,
+    hit_type: HitType,
+    separator=',',
+    id_col='id',
+    date_col='date',
+    count_col='count',
+    fieldnames=None,
+    replace_existing=False,
+) -> Counter:
+    """
+    Streaming variant of `workhit_data.load_workhits_from_csv` with the same parameters and
+    return value which is suitable for large files.
+    """
+    return load_workhits_from_csv_files(
+        [filename],
+        workset,
+        hit_type,
+        separator=separator,
+        id_col=id_col,
+        date_col=date_col,
+        count_col=count_col,
+        fieldnames=fieldnames,
+        replace_existing=replace_existing,
+    )
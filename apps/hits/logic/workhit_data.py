@@ -6,9 +6,14 @@ from collections import Counter
 from django.db.transaction import atomic
 
 from bookrank.models import WorkSet
-from bookrank.logic.static_score import update_static_scores
 from core.logic.files import open_file
 from ..models import HitType, WorkHit
+from .workhit_bulk import (
+    HitAccumulator,
+    load_workhits_from_csv_streaming,
+    parse_hit_date,
+    sync_accumulated_workhits_with_db,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +29,7 @@ def load_workhits_from_csv(
     count_col='count',
     fieldnames=None,
     replace_existing=False,
+    streaming=False,
 ) -> Counter:
     """
 
@@ -37,8 +43,22 @@ def load_workhits_from_csv(
     :param fieldnames: provides fieldnames to CSV reader - usefull for files without headers
     :param replace_existing: if True, clashing WorkHits will be removed from the database
                              otherwise they will be not overwritten and new data forgotten
+    :param streaming: if True, the data are processed in chunks and merged with the database
+                      using SQL - much faster and less memory hungry for large files
     :return:
     """
+    if streaming:
+        return load_workhits_from_csv_streaming(
+            filename,
+            workset,
+            hit_type,
+            separator=separator,
+            fieldnames=fieldnames,
+            id_col=id_col,
+            date_col=date_col,
+            count_col=count_col,
+            replace_existing=replace_existing,
+        )
     new_hits = extract_workhits_from_csv(
         filename,
         workset,
@@ -55,52 +75,17 @@ def load_workhits_from_csv(
 def sync_workhits_with_db(
     hit_type: HitType, new_hits: [WorkSet], replace_existing=False
 ) -> Counter:
-    stats = Counter()
-    if not new_hits:
-        return stats
-    # here we check the database for conflicts
-    min_date = min(wh.date for wh in new_hits)
-    max_date = max(wh.date for wh in new_hits)
-    existing_hits = WorkHit.objects.filter(date__gte=min_date, date__lte=max_date, typ=hit_type)
-    existing_recs = {
-        (wh['work_id'], wh['date']): (wh['pk'], wh['value'])
-        for wh in existing_hits.values('pk', 'work_id', 'date', 'value').iterator()
-    }
-    to_insert = []
-    to_delete = []
+    """
+    Stores `new_hits` into the database. Conflicts with existing hits of the same work, date
+    and `hit_type` are resolved in the database, see `sync_accumulated_workhits_with_db`.
+    """
+    accumulator = HitAccumulator()
     for wh in new_hits:
-        key = (wh.work_id, wh.date)
-        clashing = existing_recs.get(key)
-        if clashing is not None:
-            if clashing[1] != wh.value:
-                if replace_existing:
-                    logger.warning(
-                        'Overwriting different value for "%s": %s vs %s', key, clashing[1], wh.value
-                    )
-                    stats['replace'] += 1
-                    to_insert.append(wh)
-                    to_delete.append(clashing[0])  # the ID of the clashing WorkHit
-                else:
-                    logger.warning(
-                        'Not overwriting different value for "%s": %s vs %s',
-                        key,
-                        clashing[1],
-                        wh.value,
-                    )
-                    stats['no replace'] += 1
-            else:
-                stats['skip existing'] += 1
-        else:
-            stats['new'] += 1
-            to_insert.append(wh)
-    if to_insert:
-        logger.info('Inserting %d new work hits', len(to_insert))
-        hit_objs = WorkHit.objects.bulk_create(to_insert)
-        update_static_scores(hit_objs[0].work.work_set, stats, new_hits=hit_objs)
-    if to_delete:
-        logger.info('Removing %d replaced work hits', len(to_delete))
-        WorkHit.objects.filter(pk__in=to_delete).delete()
-    return stats
+        date_val = parse_hit_date(wh.date) if isinstance(wh.date, str) else wh.date
+        accumulator.add(wh.work_id, date_val, wh.value)
+    return sync_accumulated_workhits_with_db(
+        hit_type, accumulator, replace_existing=replace_existing
+    )
 
 
 def extract_workhits_from_csv(
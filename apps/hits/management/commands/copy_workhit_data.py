@@ -3,12 +3,17 @@ Loads hits from a CSV file
 """
 
 import logging
+from collections import defaultdict
 from time import time
 
 from django.core.management.base import BaseCommand
 
 from bookrank.logic.command_help import get_workset_by_name_or_command_error
-from ...models import WorkHit
+from bookrank.logic.response_cache import bump_data_generation
+from ...logic.rollups import hit_deltas, update_rollups
+from ...logic.time_series import invalidate_hit_metadata
+from ...logic.workhit_data import sync_workhits_with_db
+from ...models import HitType, WorkHit
 
 logger = logging.getLogger(__name__)
 
@@ -36,14 +41,28 @@ class Command(BaseCommand):
             options['from_year'],
             workset,
         )
+        hit_types = {ht.pk: ht for ht in HitType.objects.all()}
         for year in options['to_year']:
             start = time()
             logger.info('Copying to year %d', year)
-            to_write = []
+            to_write = defaultdict(list)
             for wh in source.iterator():
                 new_date = wh.date.replace(year=year)
-                to_write.append(
+                to_write[wh.typ_id].append(
                     WorkHit(work_id=wh.work_id, value=wh.value, typ_id=wh.typ_id, date=new_date)
                 )
-            WorkHit.objects.bulk_create(to_write)
-            logger.info('Copied %d work hits in %.2f s', len(to_write), time() - start)
+            for typ_id, hits in to_write.items():
+                if typ_id is None:
+                    # hits without type cannot clash with each other
+                    WorkHit.objects.bulk_create(hits)
+                    update_rollups(hit_deltas(hits))
+                    invalidate_hit_metadata()
+                    bump_data_generation(workset)
+                else:
+                    stats = sync_workhits_with_db(hit_types[typ_id], hits, replace_existing=True)
+                    logger.info('Stats for %s: %s', hit_types[typ_id], stats)
+            logger.info(
+                'Copied %d work hits in %.2f s',
+                sum(len(hits) for hits in to_write.values()),
+                time() - start,
+            )
@@ -0,0 +1,44 @@
+"""
+Creates yearly partitions of the WorkHit table in advance
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...logic.partitions import create_partitions, existing_partition_years
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Creates yearly partitions of the WorkHit table. Without arguments, partitions for '
+        'the current year and the following years (see --years-ahead) are created. Hits from '
+        'the default partition are moved into the newly created partitions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', type=int, nargs='*', help="Years to create partitions for")
+        parser.add_argument(
+            '-a',
+            '--years-ahead',
+            type=int,
+            dest='years_ahead',
+            default=1,
+            help="Number of years after the current one to create partitions for.",
+        )
+
+    def handle(self, *args, **options):
+        years = options['year']
+        if not years:
+            this_year = timezone.now().year
+            years = range(this_year, this_year + options['years_ahead'] + 1)
+        created = create_partitions(years)
+        self.stderr.write(
+            self.style.NOTICE(
+                f'Created partitions: {created}; all partitions: {existing_partition_years()}'
+            )
+        )
@@ -9,6 +9,7 @@ from django.core.management.base import BaseCommand
 from django.db import transaction
 
 from bookrank.logic.command_help import get_workset_by_name_or_command_error
+from ...logic.workhit_bulk import load_workhits_from_csv_files
 from ...logic.workhit_data import load_workhits_from_csv
 from ...models import HitType
 
@@ -64,6 +65,22 @@ class Command(BaseCommand):
             dest='replace',
             help="If hits clash with DB, replace the existing records.",
         )
+        parser.add_argument(
+            '--streaming',
+            action='store_true',
+            dest='streaming',
+            help="Process the data in chunks and merge them with the DB using SQL - "
+            "recommended for large files.",
+        )
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            dest='jobs',
+            default=1,
+            help="Parse the files in this many parallel processes and load all of them into "
+            "the DB at once. Hits for the same work and date in different files are summed up.",
+        )
         parser.add_argument(
             '-a',
             '--add-hit-type',
@@ -113,6 +130,21 @@ class Command(BaseCommand):
             else:
                 logger.debug("Using existing HitType: %s, pk: %d", hit_type.slug, hit_type.pk)
             # load the data
+            if options['jobs'] > 1:
+                stats = load_workhits_from_csv_files(
+                    options['csv_file'],
+                    workset,
+                    hit_type,
+                    jobs=options['jobs'],
+                    id_col=options['id_col'],
+                    date_col=options['date_col'],
+                    count_col=options['count_col'],
+                    fieldnames=fieldnames,
+                    separator=separator,
+                    replace_existing=options['replace'],
+                )
+                self.stderr.write(self.style.NOTICE(f'Stats: {stats}'))
+                return
             for fname in options['csv_file']:
                 logger.info('Reading file: %s', fname)
                 stats = load_workhits_from_csv(
@@ -125,5 +157,6 @@ class Command(BaseCommand):
                     fieldnames=fieldnames,
                     separator=separator,
                     replace_existing=options['replace'],
+                    streaming=options['streaming'],
                 )
                 self.stderr.write(self.style.NOTICE(f'Stats: {stats}'))
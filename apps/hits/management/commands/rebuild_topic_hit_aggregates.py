@@ -0,0 +1,29 @@
+"""
+Rebuilds the pre-aggregated hit sums per explicit topic for one workset
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from bookrank.logic.command_help import get_workset_by_name_or_command_error
+from ...logic.topic_aggregates import rebuild_topic_aggregates
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Recomputes hit sums per explicit topic, hit type and month for a workset. After the '
+        'first run, the aggregates are used for topic hit statistics and kept up to date when '
+        'hits are loaded and topics extracted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('work_set', type=str, help="Name of the work set")
+
+    def handle(self, *args, **options):
+        workset = get_workset_by_name_or_command_error(options['work_set'], self)
+        stats = rebuild_topic_aggregates(workset)
+        self.stderr.write(self.style.NOTICE(f'Stats: {stats}'))
@@ -0,0 +1,23 @@
+"""
+Rebuilds the pre-aggregated WorkHit rollups from raw hits
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from ...logic.rollups import rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Recomputes monthly and yearly WorkHit rollups from raw hits. After the first run, '
+        'the rollups are used for hit statistics and kept up to date when hits are loaded.'
+    )
+
+    def handle(self, *args, **options):
+        stats = rebuild_rollups()
+        self.stderr.write(self.style.NOTICE(f'Stats: {stats}'))
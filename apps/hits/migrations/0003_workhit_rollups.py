@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookrank', '0030_work_static_fields_update'),
+        ('hits', '0002_remove_hit_and_hitset_models'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkHitYear',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('date', models.DateField(help_text='First day of the period', null=True)),
+                ('value', models.BigIntegerField(default=0)),
+                (
+                    'typ',
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='hits.hittype',
+                    ),
+                ),
+                (
+                    'work',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to='bookrank.work'
+                    ),
+                ),
+            ],
+            options={'abstract': False, 'unique_together': {('work', 'typ', 'date')}},
+        ),
+        migrations.CreateModel(
+            name='WorkHitMonth',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('date', models.DateField(help_text='First day of the period', null=True)),
+                ('value', models.BigIntegerField(default=0)),
+                (
+                    'typ',
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to='hits.hittype',
+                    ),
+                ),
+                (
+                    'work',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to='bookrank.work'
+                    ),
+                ),
+            ],
+            options={'abstract': False, 'unique_together': {('work', 'typ', 'date')}},
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+    Duplicates could be created by `copy_workhit_data`. The newest record is kept which is
+    also the one that was used for conflict detection when loading new hits.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM hits_workhit a USING hits_workhit b '
+            'WHERE a.work_id = b.work_id AND a.date = b.date AND a.typ_id = b.typ_id '
+            'AND a.id < b.id'
+        )
+        deleted = cursor.rowcount
+    if deleted:
+        # the rollups contain the duplicates, so they have to be rebuilt before further use
+        singleton_value_model = apps.get_model('core', 'SingletonValue')
+        singleton_value_model.objects.filter(key='workhit_rollups').delete()
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_alter_user_first_name'),
+        ('hits', '0003_workhit_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, noop),
+        migrations.AddConstraint(
+            model_name='workhit',
+            constraint=models.UniqueConstraint(
+                fields=('work', 'date', 'typ'), name='workhit_work_date_typ_unique'
+            ),
+        ),
+    ]
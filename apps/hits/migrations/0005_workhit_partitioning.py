@@ -0,0 +1,92 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:15
+
+"""
+Converts `hits_workhit` into a table range-partitioned by `date` with one partition per
+year and a default partition for hits without date (or outside of the created partitions).
+
+PostgreSQL requires the partition key to be part of all unique indexes, so the `id` column
+is not a primary key on the DB level anymore, just an indexed column filled from a sequence.
+The Django model is not affected.
+"""
+
+from django.db import migrations
+
+COLUMNS = 'id, value, date, work_id, typ_id, created, last_updated'
+
+TABLE_DEFINITION = '''
+CREATE TABLE hits_workhit (
+    id integer NOT NULL DEFAULT nextval('hits_workhit_id_seq'),
+    value integer NOT NULL,
+    date date NULL,
+    work_id integer NOT NULL,
+    typ_id integer NULL,
+    created timestamp with time zone NOT NULL,
+    last_updated timestamp with time zone NOT NULL
+)
+'''
+
+INDEXES_AND_CONSTRAINTS = [
+    'CREATE INDEX hits_workhit_typ_id_4dda7c6b ON hits_workhit (typ_id)',
+    'CREATE INDEX hits_workhit_work_id_34d93f24 ON hits_workhit (work_id)',
+    'ALTER TABLE hits_workhit ADD CONSTRAINT workhit_work_date_typ_unique '
+    'UNIQUE (work_id, date, typ_id)',
+    'ALTER TABLE hits_workhit ADD CONSTRAINT hits_workhit_typ_id_4dda7c6b_fk_hits_hittype_id '
+    'FOREIGN KEY (typ_id) REFERENCES hits_hittype (id) DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE hits_workhit ADD CONSTRAINT hits_workhit_work_id_34d93f24_fk_bookrank_work_id '
+    'FOREIGN KEY (work_id) REFERENCES bookrank_work (id) DEFERRABLE INITIALLY DEFERRED',
+]
+
+
+def _replace_table(schema_editor, partitioned: bool):
+    execute = schema_editor.execute
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence('hits_workhit', 'id')")
+        (old_sequence,) = cursor.fetchone()
+        cursor.execute(
+            'SELECT DISTINCT extract(year FROM date)::integer FROM hits_workhit '
+            'WHERE date IS NOT NULL ORDER BY 1'
+        )
+        years = [row[0] for row in cursor.fetchall()]
+    execute('ALTER TABLE hits_workhit RENAME TO hits_workhit_old')
+    execute(f'ALTER SEQUENCE {old_sequence} RENAME TO hits_workhit_old_id_seq')
+    execute('CREATE SEQUENCE hits_workhit_id_seq AS integer')
+    if partitioned:
+        execute(TABLE_DEFINITION + ' PARTITION BY RANGE (date)')
+        execute('CREATE TABLE hits_workhit_default PARTITION OF hits_workhit DEFAULT')
+        for year in years:
+            execute(
+                f'CREATE TABLE hits_workhit_y{year} PARTITION OF hits_workhit '
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+        execute('CREATE INDEX hits_workhit_id_idx ON hits_workhit (id)')
+    else:
+        execute(TABLE_DEFINITION)
+        execute('ALTER TABLE hits_workhit ADD CONSTRAINT hits_workhit_pkey PRIMARY KEY (id)')
+    execute('ALTER SEQUENCE hits_workhit_id_seq OWNED BY hits_workhit.id')
+    execute(f'INSERT INTO hits_workhit ({COLUMNS}) SELECT {COLUMNS} FROM hits_workhit_old')
+    execute(
+        "SELECT setval('hits_workhit_id_seq', coalesce(max(id), 0) + 1, false) FROM hits_workhit"
+    )
+    execute('DROP TABLE hits_workhit_old')
+    for sql in INDEXES_AND_CONSTRAINTS:
+        execute(sql)
+
+
+def partition_workhit(apps, schema_editor):
+    _replace_table(schema_editor, partitioned=True)
+
+
+def unpartition_workhit(apps, schema_editor):
+    _replace_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookrank', '0030_work_static_fields_update'),
+        ('hits', '0004_workhit_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_workhit, unpartition_workhit),
+    ]
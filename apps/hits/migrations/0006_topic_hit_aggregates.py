@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookrank', '0030_work_static_fields_update'),
+        ('hits', '0005_workhit_partitioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicWorkCount',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('topic_type', models.CharField(max_length=20)),
+                ('topic_id', models.PositiveIntegerField()),
+                ('work_count', models.PositiveIntegerField(default=0)),
+                (
+                    'work_set',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to='bookrank.workset'
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('topic_type', 'topic_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TopicHitMonth',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('topic_type', models.CharField(max_length=20)),
+                ('topic_id', models.PositiveIntegerField()),
+                ('date', models.DateField(help_text='First day of the month', null=True)),
+                ('value', models.BigIntegerField(default=0)),
+                (
+                    'typ',
+                    models.ForeignKey(
+                        null=True, on_delete=django.db.models.deletion.CASCADE, to='hits.hittype'
+                    ),
+                ),
+                (
+                    'work_set',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to='bookrank.workset'
+                    ),
+                ),
+            ],
+            options={
+                'indexes': [
+                    models.Index(
+                        fields=['work_set', 'topic_type', 'date'],
+                        name='hits_topich_work_se_24b65d_idx',
+                    )
+                ],
+                'unique_together': {('topic_type', 'topic_id', 'typ', 'date')},
+            },
+        ),
+    ]
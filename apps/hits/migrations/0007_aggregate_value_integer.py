@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hits', '0006_topic_hit_aggregates'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='topichitmonth',
+            name='value',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='workhitmonth',
+            name='value',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='workhityear',
+            name='value',
+            field=models.IntegerField(default=0),
+        ),
+    ]
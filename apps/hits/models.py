@@ -21,5 +21,81 @@ class WorkHit(CreatedUpdatedMixin, models.Model):
     )
     typ = models.ForeignKey(HitType, null=True, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['work', 'date', 'typ'], name='workhit_work_date_typ_unique'
+            )
+        ]
+
     def __str__(self):
         return f'{self.work}; {self.date.isoformat()}: {self.value}'
+
+
+class WorkHitRollup(models.Model):
+    """
+    Pre-aggregated sum of `WorkHit` values for one work, hit type and period. The period is
+    represented by its first day stored in `date`, so that the same date filters may be used
+    for raw hits and for the rollups.
+    """
+
+    work = models.ForeignKey('bookrank.Work', on_delete=models.CASCADE)
+    typ = models.ForeignKey(HitType, null=True, on_delete=models.CASCADE)
+    date = models.DateField(null=True, help_text="First day of the period")
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        unique_together = ('work', 'typ', 'date')
+
+    def __str__(self):
+        return f'{self.work_id}; {self.date}: {self.value}'
+
+
+class WorkHitMonth(WorkHitRollup):
+
+    pass
+
+
+class WorkHitYear(WorkHitRollup):
+
+    pass
+
+
+class TopicHitMonth(models.Model):
+    """
+    Pre-aggregated sum of hits of all works connected to one explicit topic for one hit
+    type and month. The topic is identified by the `model_name` of the topic model and its
+    primary key.
+    """
+
+    work_set = models.ForeignKey('bookrank.WorkSet', on_delete=models.CASCADE)
+    topic_type = models.CharField(max_length=20)
+    topic_id = models.PositiveIntegerField()
+    typ = models.ForeignKey(HitType, null=True, on_delete=models.CASCADE)
+    date = models.DateField(null=True, help_text="First day of the month")
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('topic_type', 'topic_id', 'typ', 'date')
+        indexes = [models.Index(fields=['work_set', 'topic_type', 'date'])]
+
+    def __str__(self):
+        return f'{self.topic_type} {self.topic_id}; {self.date}: {self.value}'
+
+
+class TopicWorkCount(models.Model):
+    """
+    Number of works connected to an explicit topic - see `TopicHitMonth`
+    """
+
+    work_set = models.ForeignKey('bookrank.WorkSet', on_delete=models.CASCADE)
+    topic_type = models.CharField(max_length=20)
+    topic_id = models.PositiveIntegerField()
+    work_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('topic_type', 'topic_id')
+
+    def __str__(self):
+        return f'{self.topic_type} {self.topic_id}: {self.work_count}'
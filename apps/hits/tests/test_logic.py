@@ -1,11 +1,33 @@
 import csv
+import gzip
+from collections import Counter
+from datetime import date
 from io import StringIO
+from types import SimpleNamespace
 
 import pytest
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Sum
 
-from bookrank.tests.fake_data import WorkSetFactory, WorkFactory
-from hits.logic.workhit_data import load_workhits_from_csv
-from hits.models import WorkHit
+from bookrank.models import Work
+from bookrank.models import Author
+from bookrank.tests.fake_data import AuthorFactory, WorkSetFactory, WorkFactory
+from hits.logic.partitions import (
+    create_partitions,
+    default_partition_name,
+    existing_partition_years,
+    partition_name,
+)
+from hits.logic import workhit_bulk
+from hits.logic.rollups import hit_deltas, hit_sum_total, split_date_range, update_rollups
+from hits.logic.topic_aggregates import (
+    rebuild_topic_aggregates,
+    refresh_topic_aggregates,
+    topics_of_works,
+)
+from hits.logic.workhit_data import load_workhits_from_csv, sync_workhits_with_db
+from hits.models import TopicHitMonth, TopicWorkCount, WorkHit, WorkHitMonth, WorkHitYear
 from hits.tests.fake_data import HitTypeFactory
 
 
@@ -23,3 +45,259 @@ class TestCommands:
         fs.create_file('test.csv', contents=content.getvalue())
         load_workhits_from_csv('test.csv', work_set, hit_type=ht)
         assert WorkHit.objects.count() == 10
+
+    @pytest.mark.parametrize('replace_existing', [False, True])
+    def test_load_workhits_from_csv_streaming(self, fs, replace_existing):
+        """
+        Streaming loader must give the same data and stats as the original one
+        """
+        work_set = WorkSetFactory.create()
+        works = WorkFactory.create_batch(5, work_set=work_set)
+        ht = HitTypeFactory.create()
+
+        def write_csv(fname, rows):
+            content = StringIO()
+            writer = csv.writer(content)
+            writer.writerow(['id', 'date', 'count'])
+            writer.writerows(rows)
+            fs.create_file(fname, contents=content.getvalue())
+
+        write_csv('old.csv', [[work.uid, '20210101', i + 1] for i, work in enumerate(works)])
+        rows = [[work.uid, '20210101', 1] for work in works[:2]]
+        # merged with the above, the value for the 3rd work stays the same
+        rows += [[work.uid, '202101011200', 3] for work in works]
+        rows += [[works[0].uid, '20210203', 5], ['unknown', '20210101', 7], ['', '20210101', 1]]
+        write_csv('new.csv', rows)
+        results = []
+        for streaming in (False, True):
+            WorkHit.objects.all().delete()
+            load_workhits_from_csv('old.csv', work_set, hit_type=ht)
+            stats = load_workhits_from_csv(
+                'new.csv',
+                work_set,
+                hit_type=ht,
+                replace_existing=replace_existing,
+                streaming=streaming,
+            )
+            hits = set(WorkHit.objects.values_list('work__uid', 'date', 'value', 'typ_id'))
+            results.append((stats, hits))
+        assert results[0] == results[1]
+        stats, hits = results[1]
+        assert stats['new'] == 1
+        assert stats['skip existing'] == 1
+        assert stats['replace' if replace_existing else 'no replace'] == 4
+        assert (works[0].uid, date(2021, 1, 1), 4 if replace_existing else 1, ht.pk) in hits
+
+    def test_copy_workhit_data_idempotent(self):
+        work_set = WorkSetFactory.create(name='test')
+        works = WorkFactory.create_batch(3, work_set=work_set)
+        ht = HitTypeFactory.create()
+        for work in works:
+            WorkHit.objects.create(work=work, typ=ht, date=date(2020, 3, 1), value=3)
+        for _ in range(2):
+            call_command('copy_workhit_data', 'test', 2020, 2021)
+        assert WorkHit.objects.count() == 6
+        with pytest.raises(IntegrityError):
+            WorkHit.objects.create(work=works[0], typ=ht, date=date(2021, 3, 1), value=1)
+
+    def test_load_workhit_csv_parallel(self, tmp_path):
+        work_set = WorkSetFactory.create(name='test')
+        works = WorkFactory.create_batch(4, work_set=work_set)
+        ht = HitTypeFactory.create()
+        files = []
+        for file_no in range(3):
+            fname = str(tmp_path / f'hits{file_no}.csv.gz')
+            with gzip.open(fname, 'wt') as outfile:
+                writer = csv.writer(outfile)
+                writer.writerow(['id', 'date', 'count'])
+                for i, work in enumerate(works):
+                    writer.writerow([work.uid, f'2021010{file_no + 1}', i + 1])
+                    writer.writerow([work.uid, '20210201', 1])
+            files.append(fname)
+        call_command('load_workhit_csv', 'test', ht.slug, *files, jobs=2, stderr=StringIO())
+        assert WorkHit.objects.count() == 16
+        assert WorkHit.objects.filter(date='2021-02-01').aggregate(total=Sum('value')) == {
+            'total': 12
+        }
+
+    def test_sync_accumulated_workhits_concurrent_load(self, monkeypatch):
+        """
+        Hits written by another load between reading the existing hits and writing must
+        not be counted twice in the rollups
+        """
+        work_set = WorkSetFactory.create()
+        works = WorkFactory.create_batch(2, work_set=work_set)
+        ht = HitTypeFactory.create()
+        hit_date = date(2021, 1, 1)
+        sync_workhits_with_db(ht, [WorkHit(work=works[1], date=hit_date, value=1, typ=ht)])
+        accumulator = workhit_bulk.HitAccumulator()
+        accumulator.add(works[0].pk, hit_date, 5)
+        accumulator.add(works[1].pk, hit_date, 7)
+        now = workhit_bulk.timezone.now
+
+        def concurrent_load():
+            # inserts the first hit and changes the second one with their rollups
+            new_hit = WorkHit.objects.create(work=works[0], date=hit_date, value=3, typ=ht)
+            update_rollups(hit_deltas([new_hit]))
+            WorkHit.objects.filter(work=works[1]).update(value=2)
+            update_rollups(Counter({(works[1].pk, ht.pk, hit_date): 1}))
+            return now()
+
+        monkeypatch.setattr(workhit_bulk, 'timezone', SimpleNamespace(now=concurrent_load))
+        workhit_bulk.sync_accumulated_workhits_with_db(ht, accumulator, replace_existing=True)
+        assert dict(WorkHit.objects.values_list('work_id', 'value')) == {
+            works[0].pk: 3,
+            works[1].pk: 2,
+        }
+        assert hit_sum_total({}) == 5
+
+
+@pytest.mark.django_db
+class TestRollups:
+    @pytest.mark.parametrize(
+        ['start', 'end', 'parts'],
+        [
+            (None, None, {'year': [(None, None)]}),
+            (
+                date(2019, 6, 15),
+                date(2022, 3, 10),
+                {
+                    'day': [
+                        (date(2019, 6, 15), date(2019, 7, 1)),
+                        (date(2022, 3, 1), date(2022, 3, 10)),
+                    ],
+                    'month': [
+                        (date(2019, 7, 1), date(2020, 1, 1)),
+                        (date(2022, 1, 1), date(2022, 3, 1)),
+                    ],
+                    'year': [(date(2020, 1, 1), date(2022, 1, 1))],
+                },
+            ),
+            (
+                date(2020, 1, 15),
+                date(2021, 3, 10),
+                {
+                    'day': [
+                        (date(2020, 1, 15), date(2020, 2, 1)),
+                        (date(2021, 3, 1), date(2021, 3, 10)),
+                    ],
+                    'month': [(date(2020, 2, 1), date(2021, 3, 1))],
+                },
+            ),
+            (
+                date(2020, 1, 15),
+                date(2020, 1, 20),
+                {'day': [(date(2020, 1, 15), date(2020, 1, 20))]},
+            ),
+            (
+                date(2019, 12, 10),
+                None,
+                {
+                    'day': [(date(2019, 12, 10), date(2020, 1, 1))],
+                    'year': [(date(2020, 1, 1), None)],
+                },
+            ),
+        ],
+    )
+    def test_split_date_range(self, start, end, parts):
+        assert {k: v for k, v in split_date_range(start, end).items() if v} == parts
+
+    @pytest.mark.parametrize(
+        ['date_filter'],
+        [
+            ({},),
+            ({'date__gte': '2020-01-01'},),
+            ({'date__gte': '2019-11-15', 'date__lte': '2021-02-10'},),
+            ({'date__gte': '2020-03-01', 'date__lte': '2020-05-31'},),
+            ({'date__lte': '2020-02-29'},),
+        ],
+    )
+    def test_rollups_match_raw_hits(self, date_filter):
+        work_set = WorkSetFactory.create()
+        works = WorkFactory.create_batch(3, work_set=work_set)
+        ht = HitTypeFactory.create()
+        dates = [date(2019, 11, 20), date(2020, 1, 1), date(2020, 2, 29), date(2021, 2, 10)]
+        sync_workhits_with_db(
+            ht,
+            [
+                WorkHit(work=work, date=hit_date, value=i + j + 1, typ=ht)
+                for i, work in enumerate(works)
+                for j, hit_date in enumerate(dates[:2])
+            ],
+        )
+        call_command('rebuild_workhit_rollups')
+        assert WorkHitMonth.objects.count() == 6
+        assert WorkHitYear.objects.count() == 6
+        # the following hits must be added to the rollups incrementally
+        sync_workhits_with_db(
+            ht,
+            [
+                WorkHit(work=work, date=hit_date, value=10 * (i + 1), typ=ht)
+                for i, work in enumerate(works)
+                for hit_date in dates[1:]
+            ],
+            replace_existing=True,
+        )
+        raw_total = WorkHit.objects.filter(**date_filter).aggregate(total=Sum('value'))['total']
+        assert hit_sum_total(date_filter) == raw_total
+        scores = dict(
+            Work.objects.annotate_score(hit_date_filter=date_filter).values_list('pk', 'score')
+        )
+        for work in works:
+            raw = work.workhit_set.filter(**date_filter).aggregate(total=Sum('value'))['total']
+            assert scores[work.pk] == (raw or 0)
+
+
+@pytest.mark.django_db
+class TestPartitions:
+    def test_create_workhit_partitions(self):
+        work = WorkFactory.create()
+        ht = HitTypeFactory.create()
+        WorkHit.objects.create(work=work, typ=ht, date=date(2041, 3, 1), value=3)
+        WorkHit.objects.create(work=work, typ=ht, date=date(2042, 3, 1), value=4)
+        assert 2041 not in existing_partition_years()
+        call_command('create_workhit_partitions', 2041, 2042, stderr=StringIO())
+        assert {2041, 2042} <= set(existing_partition_years())
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT value FROM {partition_name(2041)}')
+            assert cursor.fetchall() == [(3,)]
+            cursor.execute(f'SELECT count(*) FROM {default_partition_name()}')
+            assert cursor.fetchone() == (0,)
+        # running again does nothing
+        assert create_partitions([2041, 2042]) == []
+        assert WorkHit.objects.filter(date__year=2042).get().value == 4
+
+
+@pytest.mark.django_db
+class TestTopicAggregates:
+    def test_refresh_changed_topics(self):
+        work_set = WorkSetFactory.create()
+        a1, a2, a3 = AuthorFactory.create_batch(3, work_set=work_set)
+        w1 = WorkFactory.create(work_set=work_set, authors=[a1, a2])
+        w2 = WorkFactory.create(work_set=work_set, authors=[a2])
+        ht = HitTypeFactory.create()
+        WorkHit.objects.create(work=w1, typ=ht, date=date(2021, 3, 5), value=3)
+        WorkHit.objects.create(work=w2, typ=ht, date=date(2021, 4, 5), value=4)
+        rebuild_topic_aggregates(work_set)
+
+        def aggregates():
+            return sorted(
+                TopicHitMonth.objects.filter(work_set=work_set).values_list(
+                    'topic_type', 'topic_id', 'date', 'value'
+                )
+            ), sorted(
+                TopicWorkCount.objects.filter(work_set=work_set).values_list(
+                    'topic_type', 'topic_id', 'work_count'
+                )
+            )
+
+        changed = topics_of_works([Author], [w1.pk])
+        w1.authors.set([a3])
+        for model, topic_ids in topics_of_works([Author], [w1.pk]).items():
+            changed[model] |= topic_ids
+        assert changed == {Author: {a1.pk, a2.pk, a3.pk}}
+        stats = refresh_topic_aggregates(work_set, changed)
+        assert stats['TopicWorkCount_created'] == 2, 'a1 has no works now'
+        refreshed = aggregates()
+        rebuild_topic_aggregates(work_set)
+        assert refreshed == aggregates()
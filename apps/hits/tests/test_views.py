@@ -1,6 +1,17 @@
+from datetime import date
+from io import StringIO
+
 import pytest
+from django.core.management import call_command
 from rest_framework.reverse import reverse
 
+from bookrank.logic.response_cache import bump_data_generation
+from bookrank.tests.fake_data import AuthorFactory, WorkFactory, WorkSetFactory
+from core.models import SingletonValue
+from hits.logic.workhit_data import sync_workhits_with_db
+from hits.models import TopicHitMonth, WorkHit
+from hits.tests.fake_data import HitTypeFactory, WorkHitFactory, hit_types as hit_types_names
+
 
 @pytest.mark.django_db
 class TestHitStatsViews:
@@ -46,3 +57,136 @@ class TestWorkStatsViews:
         url = reverse('hits:work-hits', args=[work.id])
         response = admin_client.get(url)
         assert response.status_code == 200
+
+    @pytest.mark.parametrize(
+        ['params', 'dates'],
+        [
+            ({}, ['2019-12-16', '2020-01-16', '2020-02-16', '2020-03-16']),
+            ({'step': 'year'}, ['2019', '2020']),
+            ({'start_date': '2020-01-10', 'end_date': '2020-02-20'}, ['2020-01-16', '2020-02-16']),
+            ({'start_date': '2021-01-01'}, []),
+        ],
+    )
+    def test_workhits_in_time_dense(self, admin_client, work, params, dates):
+        ht1 = HitTypeFactory.create(name=hit_types_names[0])
+        ht2 = HitTypeFactory.create(name=hit_types_names[1])
+        WorkHitFactory.create(work=work, typ=ht1, date=date(2019, 12, 5), value=3)
+        WorkHitFactory.create(work=work, typ=ht2, date=date(2020, 3, 5), value=4)
+        url = reverse('hits:workhits-in-time', args=[work.id])
+        stats = admin_client.get(url, params).json()['stats']
+        assert [rec['date'] for rec in stats] == dates
+        if not params:
+            assert stats[0] == {'date': '2019-12-16', str(ht1.pk): 3, str(ht2.pk): 0}
+            assert stats[1] == {'date': '2020-01-16', str(ht1.pk): 0, str(ht2.pk): 0}
+            assert stats[3] == {'date': '2020-03-16', str(ht1.pk): 0, str(ht2.pk): 4}
+
+    def test_hit_metadata_invalidation(self, admin_client, work):
+        ht = HitTypeFactory.create()
+        WorkHitFactory.create(work=work, typ=ht, date=date(2020, 1, 5), value=3)
+        url = reverse('hits:workhits-in-time', args=[work.id])
+        assert len(admin_client.get(url).json()['stats']) == 1
+        sync_workhits_with_db(ht, [WorkHit(work=work, typ=ht, date=date(2020, 3, 1), value=1)])
+        assert len(admin_client.get(url).json()['stats']) == 3
+
+
+@pytest.mark.django_db
+class TestTopicHitAggregates:
+    @pytest.mark.parametrize(
+        'params',
+        [
+            {},
+            {'start_date': '2020-01-01', 'end_date': '2020-12-31'},
+            {'start_date': '2020-03-15'},
+            {'lang': 'cze'},
+        ],
+    )
+    def test_stats_from_aggregates_match_raw(self, admin_client, settings, params):
+        # the same requests are compared with and without aggregates
+        settings.ANALYTICS_CACHE_ENABLED = False
+        work_set = WorkSetFactory.create()
+        authors = AuthorFactory.create_batch(3, work_set=work_set)
+        works = [
+            WorkFactory.create(work_set=work_set, authors=authors[:2]),
+            WorkFactory.create(work_set=work_set, authors=authors[1:]),
+            WorkFactory.create(work_set=work_set, authors=[]),
+        ]
+        hit_types = [HitTypeFactory.create(name=name) for name in hit_types_names]
+        for i, work in enumerate(works):
+            for month in range(1, 13, i + 2):
+                for ht in hit_types:
+                    WorkHitFactory.create(work=work, typ=ht, date=date(2020, month, 10))
+            WorkHitFactory.create(work=work, typ=hit_types[0], date=date(2019, 12, 1))
+        urls = [
+            reverse(name, args=[work_set.uuid, 'author'])
+            for name in ('hits:explicit-topic-hit-stats', 'hits:explicit-topic-hit-histogram')
+        ]
+        params = {**params, 'hit_type': hit_types[0].pk}
+
+        def get_data():
+            return [admin_client.get(url, params).json() for url in urls]
+
+        raw = get_data()
+        call_command('rebuild_topic_hit_aggregates', work_set.name, stderr=StringIO())
+        assert TopicHitMonth.objects.exists()
+        from_aggregates = get_data()
+        assert from_aggregates == raw
+        assert all(type(rec['score']) is int for rec in from_aggregates[0]['results'])
+        # incremental update
+        new_hits = [WorkHit(work=works[0], typ=hit_types[0], date=date(2020, 1, 5), value=1000)]
+        sync_workhits_with_db(hit_types[0], new_hits)
+        from_aggregates = get_data()
+        SingletonValue.objects.filter(key__startswith='topic_hit_aggregates').delete()
+        assert from_aggregates == get_data()
+
+    def test_histogram_bins(self, admin_client):
+        work_set = WorkSetFactory.create()
+        ht = HitTypeFactory.create()
+        scores = [0, 0, 1, 3, 5, 6, 999, 1000, 1001, 2000, 2001, 9999, 10000, 12345]
+        for i, score in enumerate(scores):
+            author = AuthorFactory.create(work_set=work_set, name=f'author {i}')
+            work = WorkFactory.create(work_set=work_set, authors=[author])
+            if score:
+                WorkHitFactory.create(work=work, typ=ht, date=date(2020, 1, 1), value=score)
+        url = reverse('hits:explicit-topic-hit-histogram', args=[work_set.uuid, 'author'])
+        data = admin_client.get(url).json()
+        assert [(rec['name'], rec['count']) for rec in data] == [
+            ('0', 2),
+            ('1', 1),
+            ('1-10000', 1),
+            ('2-5', 2),
+            ('6-10', 1),
+            ('501-1000', 2),
+            ('1001-2000', 2),
+            ('2001-3000', 1),
+            ('9001-10000', 1),
+            ('10001-20000', 1),
+        ]
+
+
+@pytest.mark.django_db
+class TestResponseCache:
+    def test_cached_until_generation_bump(self, admin_client, django_assert_max_num_queries):
+        work_set = WorkSetFactory.create()
+        author = AuthorFactory.create(work_set=work_set)
+        work = WorkFactory.create(work_set=work_set, authors=[author])
+        ht = HitTypeFactory.create()
+        WorkHitFactory.create(work=work, typ=ht, date=date(2020, 1, 5), value=3)
+        url = reverse('hits:explicit-topic-hit-stats', args=[work_set.uuid, 'author'])
+        assert admin_client.get(url).json()['results'][0]['score'] == 3
+        # data changed without bumping the generation - the cached response is used
+        WorkHitFactory.create(work=work, typ=ht, date=date(2020, 2, 5), value=4)
+        with django_assert_max_num_queries(3):
+            # session, user and workset generation
+            assert admin_client.get(url).json()['results'][0]['score'] == 3
+        # different parameters are cached separately
+        assert admin_client.get(url, {'hit_type': ht.pk}).json()['results'][0]['score'] == 7
+        bump_data_generation(work_set)
+        assert admin_client.get(url).json()['results'][0]['score'] == 7
+
+    def test_hit_sync_invalidates(self, admin_client):
+        work = WorkFactory.create()
+        ht = HitTypeFactory.create()
+        url = reverse('hits:work-hits', args=[work.pk])
+        assert admin_client.get(url).json() == [{'name': ht.name, 'score': 0}]
+        sync_workhits_with_db(ht, [WorkHit(work=work, typ=ht, date=date(2020, 3, 1), value=5)])
+        assert admin_client.get(url).json() == [{'name': ht.name, 'score': 5}]
@@ -1,15 +1,17 @@
-from collections import Counter
 from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
 
 from dateutil.relativedelta import relativedelta
-from dateutil.utils import today
 from django.db.models import Q, Count, F, FloatField
-from django.db.models import Sum, Min, Max
-from django.db.models.functions import Cast, Coalesce
+from django.db.models import BigIntegerField, Case, CharField, Value, When
+from django.db.models import Sum
+from django.db.models.functions import Cast, Coalesce, Length, NullIf, Power
 from django.db.models.functions import TruncMonth, TruncDay, TruncWeek, TruncYear
 from rest_framework.generics import get_object_or_404, GenericAPIView
 from rest_framework.response import Response
 
+from bookrank.logic.response_cache import cached_analytics_response
 from bookrank.models import WorkSet, Work, Language, OwnerInstitution, WorkCategory
 from bookrank.serializers import WorkSerializer, WorkSimpleScoreSerializer
 from bookrank.view_mixins import RequestParameterExtractor
@@ -17,7 +19,14 @@ from core.exceptions import BadRequestError
 from core.logic.query import prefix_query_filter
 from core.pagination import SmartPageNumberPagination
 from .logic.request_attrs import date_filter_from_request
-from .models import WorkHit, HitType
+from .logic.rollups import hit_model_for_period, hit_sum_total
+from .logic.time_series import dense_time_series, get_hit_metadata, series_bounds
+from .logic.topic_aggregates import (
+    topic_aggregates_usable,
+    topic_hit_sum_expression,
+    topic_work_count_expression,
+)
+from .models import HitType
 
 
 class Pagination20(SmartPageNumberPagination):
@@ -39,13 +48,11 @@ class BaseWorkHitStatsView(RequestParameterExtractor, GenericAPIView):
         self.hit_type_filter = None
 
     def _get_total_score(self, request):
-        work_filter = prefix_query_filter(self.work_filter, 'work__')
-        score = WorkHit.objects.filter(
-            **self._extract_hit_type_filter(request),
-            **date_filter_from_request(request),
-            **work_filter,
-        ).aggregate(sum=Sum('value'))
-        return score['sum']
+        return hit_sum_total(
+            date_filter=date_filter_from_request(request),
+            hit_type_filter=self._extract_hit_type_filter(request),
+            work_filter=self.work_filter,
+        )
 
     def _get_total_count(self, request):
         count = Work.objects.filter(**self.work_filter).count()
@@ -64,23 +71,26 @@ class ExplicitTopicsHitStatsView(BaseWorkHitStatsView):
     growth_metrics = ['absolute_growth', 'relative_growth']
 
     def get_queryset(self):
-        self.date_filter = prefix_query_filter(
-            date_filter_from_request(self.request), 'works__workhit__'
-        )
-        self.hit_type_filter = prefix_query_filter(
-            self._extract_hit_type_filter(self.request), 'works__workhit__'
-        )
+        self.date_filter = date_filter_from_request(self.request)
+        self.hit_type_filter = self._extract_hit_type_filter(self.request)
         self.work_filter = self._extract_work_filter(self.request)
         works_filter = prefix_query_filter(self.work_filter, 'works__')
         topic_model = self.topic_type_to_explicit_topic.get(self.topic_type)
-        queryset = topic_model.objects.filter(work_set=self.workset, **works_filter).annotate(
-            score=Sum(
-                'works__workhit__value', filter=Q(**self.date_filter, **self.hit_type_filter)
-            ),
-            work_count=Count('works', distinct=True),
+        queryset = topic_model.objects.filter(work_set=self.workset, **works_filter)
+        if topic_aggregates_usable(self.workset, self.date_filter, self.work_filter):
+            queryset = queryset.annotate(
+                score=topic_hit_sum_expression(topic_model, self.date_filter, self.hit_type_filter),
+                work_count=Coalesce(topic_work_count_expression(topic_model), 0),
+            )
+        else:
+            queryset = queryset.annotate(
+                score=queryset.hit_score(self.date_filter, self.hit_type_filter, self.work_filter),
+                work_count=Count('works', distinct=True),
+            )
+        queryset = queryset.annotate(
             ratio=(
                 Cast(F('score'), output_field=FloatField())
-                / Cast(F('work_count'), output_field=FloatField())
+                / Cast(NullIf(F('work_count'), 0), output_field=FloatField())
             ),
         )
         if self.topic_type == 'psh':
@@ -99,7 +109,7 @@ class ExplicitTopicsHitStatsView(BaseWorkHitStatsView):
             )
         return F(cls.ORDERING_TYPES_REMAP[attr_name]).desc(nulls_last=True), attr_name
 
-    # @method_decorator(cache_page(1*60*60))
+    @cached_analytics_response()
     def get(self, request, workset_uuid, topic_type):
         self.workset = get_object_or_404(WorkSet.objects.all(), uuid=workset_uuid)
         self.topic_type = topic_type
@@ -137,46 +147,72 @@ class ExplicitTopicsHitHistogramView(BaseWorkHitStatsView):
     ]
 
     def get_queryset(self):
-        self.date_filter = prefix_query_filter(
-            date_filter_from_request(self.request), 'works__workhit__'
-        )
-        self.hit_type_filter = prefix_query_filter(
-            self._extract_hit_type_filter(self.request), 'works__workhit__'
-        )
+        self.date_filter = date_filter_from_request(self.request)
+        self.hit_type_filter = self._extract_hit_type_filter(self.request)
         self.work_filter = self._extract_work_filter(self.request)
         works_filter = prefix_query_filter(self.work_filter, 'works__')
         topic_model = self.topic_type_to_explicit_topic.get(self.topic_type)
-        queryset = topic_model.objects.filter(work_set=self.workset, **works_filter).annotate(
-            score=Coalesce(
-                Sum('works__workhit__value', filter=Q(**self.date_filter, **self.hit_type_filter)),
-                0,
-            )
-        )
+        queryset = topic_model.objects.filter(work_set=self.workset)
+        if topic_aggregates_usable(self.workset, self.date_filter, self.work_filter):
+            score = topic_hit_sum_expression(topic_model, self.date_filter, self.hit_type_filter)
+        else:
+            if works_filter:
+                # the join through works could produce duplicates, so a subquery is used
+                queryset = queryset.filter(
+                    pk__in=topic_model.objects.filter(**works_filter).values('pk')
+                )
+            score = queryset.hit_score(self.date_filter, self.hit_type_filter, self.work_filter)
+        queryset = queryset.annotate(score=Coalesce(score, 0))
         if root_node := self.request.query_params.get('root_node'):
             queryset = queryset.annotate_root_node().filter(root_node=root_node)
         return queryset
 
+    @classmethod
+    def _bin_annotations(cls) -> dict:
+        """
+        Expressions assigning `score` to one of `histogram_bins`, or for larger values to
+        a bin spanning one unit of the highest order of magnitude of the score - e.g. 2001-3000
+        """
+        # the cast makes sure the division below is an integer one
+        bin_score = Cast('score', output_field=BigIntegerField())
+        unit = Cast(
+            Power(10, Length(Cast('bin_score', output_field=CharField())) - 1),
+            output_field=BigIntegerField(),
+        )
+        large_start = F('unit') * ((F('bin_score') - 1) / F('unit'))
+        return {
+            'bin_score': bin_score,
+            'unit': unit,
+            'bin_start': Case(
+                *[
+                    When(bin_score__gte=start, bin_score__lte=end, then=Value(start))
+                    for start, end in cls.histogram_bins
+                ],
+                default=large_start + 1,
+                output_field=BigIntegerField(),
+            ),
+            'bin_end': Case(
+                *[
+                    When(bin_score__gte=start, bin_score__lte=end, then=Value(end))
+                    for start, end in cls.histogram_bins
+                ],
+                default=large_start + F('unit'),
+                output_field=BigIntegerField(),
+            ),
+        }
+
+    @cached_analytics_response()
     def get(self, request, workset_uuid, topic_type):
         self.workset = get_object_or_404(WorkSet.objects.all(), uuid=workset_uuid)
         self.topic_type = topic_type
-        queryset = self.get_queryset().values('pk', 'score')
-        counter = Counter()
-        for rec in queryset:
-            counter[rec['score']] += 1
-        # here we bin it according to self.histogram_bins
-        bin_counter = Counter()
-        for hits, count in counter.items():
-            for start, end in self.histogram_bins:
-                if start <= hits <= end:
-                    bin_counter[(start, end)] += count
-                    break
-            else:
-                digits = len(str(hits)) - 1
-                unit = 10**digits
-                start = unit * ((hits - 1) // unit)
-                end = start + unit
-                start += 1
-                bin_counter[(start, end)] += count
+        # the binning is done in the database, so that only the bins are transferred
+        queryset = (
+            self.get_queryset()
+            .annotate(**self._bin_annotations())
+            .values('bin_start', 'bin_end')
+            .annotate(count=Count('pk'))
+            .order_by('bin_start', 'bin_end')
+        )
 
         # objects to return
         def name(a, b):
@@ -185,8 +221,13 @@ class ExplicitTopicsHitHistogramView(BaseWorkHitStatsView):
             return f'{a}-{b}'
 
         data = [
-            {'count': count, 'start': start, 'end': end, 'name': name(start, end)}
-            for (start, end), count in sorted(bin_counter.items())
+            {
+                'count': rec['count'],
+                'start': rec['bin_start'],
+                'end': rec['bin_end'],
+                'name': name(rec['bin_start'], rec['bin_end']),
+            }
+            for rec in queryset
         ]
         return Response(data)
 
@@ -195,6 +236,7 @@ class ExplicitTopicWorkStatsView(GenericAPIView):
 
     model = None
 
+    @cached_analytics_response()
     def get(self, request, workset_uuid):
         if not self.model:
             raise ValueError('You must provide the model attr in a subclass')
@@ -264,6 +306,7 @@ class TimePeriodStatsMixin(object):
         self.extra = None
         self.label_map = {}
         self.workset = None
+        self.hit_model = None
 
     def _extract_step_and_params(self):
         step = self.request.GET.get('step', 'month')
@@ -280,53 +323,29 @@ class WorkHitInTimeBaseStatsView(TimePeriodStatsMixin, BaseWorkHitStatsView):
     def get_statistics(self):
         self.date_filter = date_filter_from_request(self.request)
         self.hit_type_filter = self._extract_hit_type_filter(self.request)
+        self.hit_model = hit_model_for_period(self.step, self.date_filter)
         # we create a map of HitTypes, but only those that have at least one hit anywhere in the DB
-        hittype_id_to_name = {
-            ht.pk: ht.name
-            for ht in HitType.objects.annotate(score=Sum('workhit')).filter(score__gt=0)
-        }
-        trunc = self.params['trunc']
-        data = self.get_data_raw()
-        # here we add zero data where necessary
-        # we use the min and max of the data in the DB, but if there is date_filter,
-        # we limit the limits we got
-        date_limits = WorkHit.objects.filter(**self.date_filter).aggregate(
-            min_unit=trunc(Min('date')), max_unit=trunc(Max('date'))
+        metadata = get_hit_metadata()
+        hittype_id_to_name = dict(
+            HitType.objects.filter(pk__in=metadata['hit_type_ids']).values_list('pk', 'name')
         )
-        last_date = None
-        current_data = {}
+        # the series spans from the first to the last hit in the DB limited by the date_filter,
+        # periods without data are added by the database
+        start, end = series_bounds(self.step, self.date_filter, metadata)
+        rows = []
+        if start is not None and start <= end:
+            rows = dense_time_series(self.get_data_raw(), start, end, self.step)
         shift = self.params['shift']
-        date_to_data = {}
-        for row in data:
-            if not last_date:
-                last_date = row['unit']
-            if last_date != row['unit']:
-                if current_data:
-                    date_to_data[last_date] = current_data
-                current_data = {}
-                last_date = row['unit']
-            current_data[row['typ']] = row['score']
-        if current_data:
-            date_to_data[last_date] = current_data
-        # now process the whole date range
-        date = date_limits['min_unit']
-        max_date = date_limits['max_unit']
-        if date is None:
-            # there are no hit data
-            date = today().replace(day=1)
-            max_date = date.replace(year=date.year - 1)
         result = []
-        while date <= max_date:
-            current_data = date_to_data.get(date, {})
-            if 'date' not in current_data:
-                current_data['date'] = (date + shift).isoformat()
+        for date, group in groupby(rows, key=itemgetter(0)):
+            current_data = {typ: score for _date, typ, score in group if score is not None}
+            current_data['date'] = (date + shift).isoformat()
             if self.step == 'year':
                 current_data['date'] = current_data['date'][:4]
             for hittype_id in hittype_id_to_name.keys():
                 if hittype_id not in current_data:
                     current_data[hittype_id] = 0
             result.append(current_data)
-            date += self.params['delta']
         self.label_map = hittype_id_to_name
         self.extra = {'series': list(hittype_id_to_name.keys())}
         return result
@@ -340,7 +359,9 @@ class WorkHitsInTimeStatsView(WorkHitInTimeBaseStatsView):
     def get_data_raw(self):
         trunc = self.params['trunc']
         data = (
-            WorkHit.objects.filter(work_id=self.work_id, **self.date_filter, **self.hit_type_filter)
+            self.hit_model.objects.filter(
+                work_id=self.work_id, **self.date_filter, **self.hit_type_filter
+            )
             .annotate(unit=trunc('date'))
             .values('unit', 'typ')
             .annotate(score=Sum('value'))
@@ -349,6 +370,7 @@ class WorkHitsInTimeStatsView(WorkHitInTimeBaseStatsView):
         )
         return data
 
+    @cached_analytics_response(scope='work')
     def get(self, request, work_id):
         self.work_id = work_id
         self._extract_step_and_params()
@@ -368,7 +390,9 @@ class ExplicitTopicsInTimeStatsView(WorkHitInTimeBaseStatsView):
         self.work_filter = prefix_query_filter(self._extract_work_filter(self.request), 'work__')
         trunc = self.params['trunc']
         data = (
-            WorkHit.objects.filter(**self.work_filter, **self.date_filter, **self.hit_type_filter)
+            self.hit_model.objects.filter(
+                **self.work_filter, **self.date_filter, **self.hit_type_filter
+            )
             .annotate(unit=trunc('date'))
             .values('unit', 'typ')
             .annotate(score=Sum('value'))
@@ -377,6 +401,7 @@ class ExplicitTopicsInTimeStatsView(WorkHitInTimeBaseStatsView):
         )
         return data
 
+    @cached_analytics_response(scope='global')
     def get(self, request):
         self._extract_step_and_params()
         # we extract stats here because as a side-effect, it will fill out the label_map
@@ -392,20 +417,15 @@ class ExplicitTopicsInTimeStatsView(WorkHitInTimeBaseStatsView):
 
 class ExplicitTopicsImportantWorksView(BaseWorkHitStatsView):
     def get_queryset(self):
-        self.date_filter = prefix_query_filter(date_filter_from_request(self.request), 'workhit__')
+        self.date_filter = date_filter_from_request(self.request)
         self.hit_type_filter = self._extract_hit_type_filter(self.request)
         self.work_filter = self._extract_work_filter(self.request)
-        queryset = (
-            Work.objects.filter(work_set=self.workset, **self.work_filter)
-            .annotate(
-                score=Coalesce(
-                    Sum('workhit__value', filter=Q(**self.date_filter, **self.hit_type_filter)), 0
-                )
-            )
-            .order_by(F('score').desc(nulls_last=True))
-        )
-        return queryset
+        queryset = Work.objects.filter(work_set=self.workset, **self.work_filter)
+        return queryset.annotate(
+            score=Coalesce(queryset.hit_score(self.date_filter, self.hit_type_filter), 0)
+        ).order_by(F('score').desc(nulls_last=True))
 
+    @cached_analytics_response()
     def get(self, request, workset_uuid, topic_type):
         self.workset = get_object_or_404(WorkSet.objects.all(), uuid=workset_uuid)
         self.topic_type = topic_type
@@ -428,20 +448,15 @@ class ExplicitTopicsImportantWorksView(BaseWorkHitStatsView):
 
 class ImportantWorksView(BaseWorkHitStatsView):
     def get_queryset(self):
-        self.date_filter = prefix_query_filter(date_filter_from_request(self.request), 'workhit__')
+        self.date_filter = date_filter_from_request(self.request)
         self.hit_type_filter = self._extract_hit_type_filter(self.request)
         self.work_filter = self._extract_work_filter(self.request)
-        queryset = (
-            Work.objects.filter(work_set=self.workset, **self.work_filter)
-            .annotate(
-                score=Coalesce(
-                    Sum('workhit__value', filter=Q(**self.date_filter, **self.hit_type_filter)), 0
-                )
-            )
-            .order_by(F('score').desc(nulls_last=True))
-        )
-        return queryset
+        queryset = Work.objects.filter(work_set=self.workset, **self.work_filter)
+        return queryset.annotate(
+            score=Coalesce(queryset.hit_score(self.date_filter, self.hit_type_filter), 0)
+        ).order_by(F('score').desc(nulls_last=True))
 
+    @cached_analytics_response()
     def get(self, request, workset_uuid):
         self.workset = get_object_or_404(WorkSet.objects.all(), uuid=workset_uuid)
         # by deferring `extra_data` json field below, we get more than 2x speed-up
@@ -457,6 +472,7 @@ class ImportantWorksView(BaseWorkHitStatsView):
 
 
 class WorkHitsWorkDetailView(GenericAPIView):
+    @cached_analytics_response(scope='work')
     def get(self, request, work_id):
         date_filter = prefix_query_filter(date_filter_from_request(request), 'workhit__')
         data = (
@@ -62,7 +62,14 @@ class ImporterRecord:
         identifiers: Optional[dict] = None,
         title: Optional[str] = None,
         timestamp: Optional[datetime] = None,
+        header: Optional[bytes] = None,
+        message_tag: Optional[str] = None,
     ):
+        """
+        If `header` is given, `raw_data` contains only the record itself and `header` is the
+        header of the message the record comes from, `message_tag` being the tag of the root
+        element of the message.
+        """
         self.ssid = ssid
         self.isbn = isbn
         self.doi = doi
@@ -71,6 +78,8 @@ class ImporterRecord:
         self.raw_data = raw_data
         self.raw_data_format = raw_data_format
         self.timestamp = timestamp or datetime.now()
+        self.header = header
+        self.message_tag = message_tag
 
 
 class DataImportError(ValueError):
@@ -28,7 +28,7 @@ class ImportOnixBase(ImportBase):
         "23": "OCLC",
     }
 
-    def __init__(self, filename_or_stream, close_file=None, validate=True):
+    def __init__(self, filename_or_stream, close_file=None, validate=True, split_header=False):
         """
         An iterative reader of Products from an ONIX XML.
 
@@ -41,9 +41,13 @@ class ImportOnixBase(ImportBase):
         one Header and one Product, duplicating the header data for completeness.
         Validates the XML against a schema by default.
 
+        With `split_header`, the raw data of each record contain only the Product and the
+        serialized Header is given separately, so that it may be stored only once.
+
         By default, closes files given as filenames, and leaves streams open.
         """
         super().__init__(filename_or_stream, close_file)
+        self.split_header = split_header
 
         if validate and self.SCHEMA_FILE:
             schema_dir = Path(__file__).resolve().parent / 'data'
@@ -56,6 +60,8 @@ class ImportOnixBase(ImportBase):
         self.root_tag = None
         # The ONIX <header> element, read when encountered
         self.header = None
+        # Serialized `header`, used with `split_header`
+        self.header_data = None
         # Iterator over ended header and product elements of the XML
         self.iterparser = etree.iterparse(
             self.file,
@@ -76,15 +82,23 @@ class ImportOnixBase(ImportBase):
         if el is None:
             raise StopIteration
 
+        if self.split_header:
+            if self.header_data is None:
+                self.header_data = etree.tostring(self.header, encoding="utf-8", with_tail=False)
+            raw_data = etree.tostring(el, encoding="utf-8", with_tail=False)
+        else:
+            raw_data = etree.tostring(root, encoding="utf-8")
         return ImporterRecord(
             self.get_ssid(el),
             isbn=self.get_isbn(el),
             doi=self.get_doi(el),
             title=self.get_title(el),
-            raw_data=etree.tostring(root, encoding="utf-8"),
+            raw_data=raw_data,
             raw_data_format=DataFormat.XML,
             identifiers=self.get_identifiers(el),
             timestamp=self.get_timestamp(root),
+            header=self.header_data,
+            message_tag=self.root_tag if self.split_header else None,
         )
 
     def next_product_document(self):
@@ -40,3 +40,14 @@ class TestOnix21Importer:
         for _rec in reader:
             i += 1
         assert i == 1, 'one record in the file'
+
+    def test_file_parsing_split_header(self, test_data_path):
+        reader = ImportOnix21Reference(
+            test_data_path('onix/onix_sample_1_book.xml'), split_header=True
+        )
+        record = next(reader)
+        assert record.message_tag == 'ONIXMessage'
+        assert record.header.startswith(b'<Header>')
+        assert record.raw_data.startswith(b'<Product>')
+        assert b'<Header>' not in record.raw_data
+        assert record.timestamp == datetime(2019, 3, 22, 21, 26, 33, tzinfo=UTC)
@@ -0,0 +1,102 @@
+"""
+Compression of `RawDataRecord.data` using Zstandard with dictionaries trained per `DataSource`.
+
+Records are compressed when imported, using the newest dictionary of the source (or without
+a dictionary if none was trained yet). `RawDataRecord.compression` tells how the data are
+stored, so records stored before compression was introduced may still be read - always use
+`raw_data_bytes` to get the data.
+"""
+
+import logging
+from functools import lru_cache
+from typing import AnyStr, Optional
+
+import zstandard
+
+from ..models import CompressionDictionary, DataSource, RawDataRecord
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_LEVEL = 3
+DICTIONARY_SIZE = 110 * 1024
+SAMPLE_COUNT = 5000
+
+
+@lru_cache(maxsize=16)
+def _decompressor(dictionary_id: Optional[int]) -> zstandard.ZstdDecompressor:
+    # dictionaries are never changed, so it is safe to keep the decompressors around
+    if dictionary_id is None:
+        return zstandard.ZstdDecompressor()
+    dictionary = CompressionDictionary.objects.get(pk=dictionary_id)
+    return zstandard.ZstdDecompressor(
+        dict_data=zstandard.ZstdCompressionDict(bytes(dictionary.data))
+    )
+
+
+def raw_data_bytes(raw_data: RawDataRecord) -> bytes:
+    """
+    Returns the uncompressed data of `raw_data`
+    """
+    data = bytes(raw_data.data)
+    if raw_data.compression == RawDataRecord.COMPRESSION_ZSTD:
+        return _decompressor(raw_data.dictionary_id).decompress(data)
+    return data
+
+
+class RawDataCompressor:
+    def __init__(
+        self, dictionary: Optional[CompressionDictionary] = None, level: int = COMPRESSION_LEVEL
+    ):
+        self.dictionary = dictionary
+        dict_data = zstandard.ZstdCompressionDict(bytes(dictionary.data)) if dictionary else None
+        self.compressor = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+
+    @classmethod
+    def for_source(cls, source: DataSource, level: int = COMPRESSION_LEVEL):
+        """
+        Compressor using the newest dictionary of `source`
+        """
+        return cls(latest_dictionary(source), level=level)
+
+    def compress(self, raw_data: RawDataRecord, data: Optional[AnyStr]) -> RawDataRecord:
+        """
+        Stores compressed `data` into `raw_data`, the object is not saved
+        """
+        if data is None:
+            raw_data.data = None
+            raw_data.compression = RawDataRecord.COMPRESSION_NONE
+            raw_data.dictionary = None
+            return raw_data
+        if type(data) is str:
+            data = data.encode('utf-8')
+        raw_data.data = self.compressor.compress(data)
+        raw_data.compression = RawDataRecord.COMPRESSION_ZSTD
+        raw_data.dictionary = self.dictionary
+        return raw_data
+
+
+def latest_dictionary(source: DataSource) -> Optional[CompressionDictionary]:
+    return source.compression_dictionaries.order_by('-pk').first()
+
+
+def train_dictionary(
+    source: DataSource, sample_count: int = SAMPLE_COUNT, dict_size: int = DICTIONARY_SIZE
+) -> Optional[CompressionDictionary]:
+    """
+    Trains a new dictionary on the newest records of `source`. Returns None if there is not
+    enough data for training.
+    """
+    samples = [
+        raw_data_bytes(raw_data)
+        for raw_data in RawDataRecord.objects.filter(record__source=source)
+        .exclude(data__isnull=True)
+        .order_by('-pk')[:sample_count]
+    ]
+    try:
+        zstd_dict = zstandard.train_dictionary(dict_size, samples)
+    except zstandard.ZstdError as exc:
+        logger.warning('Could not train dictionary from %d samples: %s', len(samples), exc)
+        return None
+    return CompressionDictionary.objects.create(
+        source=source, data=zstd_dict.as_bytes(), sample_count=len(samples)
+    )
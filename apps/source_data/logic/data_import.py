@@ -1,47 +1,171 @@
+import hashlib
+import logging
 from collections import Counter
-from typing import Iterator, Callable, Optional
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, Callable, Optional, List
 
 from django.db.transaction import atomic
+from django.utils import timezone
 
+from core.models import SingletonValue
 from importers.import_base import ImporterRecord
 
 from ..models import DataSource, DataRecord, RawDataRecord
+from .compression import RawDataCompressor
+from .raw_data import get_message_header
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+# number of bytes from the start of a file which are part of its checkpoint key
+CHECKPOINT_HEAD_SIZE = 64 * 1024
+
+DATA_RECORD_UPDATE_FIELDS = [
+    'isbn13',
+    'title',
+    'doi',
+    'other_ids',
+    'extracted_data',
+    'header',
+    'last_updated',
+]
+
+
+def checkpoint_key(source: DataSource, filename) -> str:
+    """
+    Returns the key of the `SingletonValue` which stores the number of records from file
+    `filename` already imported into `source`. Besides the path and size, the file is
+    identified by its modification time and the start of its content, so that a different
+    file put in place of the original one does not resume from its checkpoint.
+    """
+    path = Path(filename).resolve()
+    stat = path.stat()
+    with path.open('rb') as infile:
+        head_hash = hashlib.md5(infile.read(CHECKPOINT_HEAD_SIZE)).hexdigest()
+    file_id = f'{path}:{stat.st_size}:{stat.st_mtime_ns}:{head_hash}'
+    return f'ingest-{source.pk}-{hashlib.md5(file_id.encode("utf-8")).hexdigest()[:24]}'
+
+
+def _aware(value: datetime) -> datetime:
+    if timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
 
 
-@atomic
 def sync_data_with_source(
     reader: Iterator[ImporterRecord],
     source: DataSource,
     watcher: Optional[Callable[[int], None]] = None,
+    batch_size: int = BATCH_SIZE,
+    checkpoint: Optional[str] = None,
 ) -> Counter:
+    """
+    Imports records from `reader` into `source` in batches, each batch is committed in its own
+    transaction.
+
+    :param checkpoint: key of a `SingletonValue` where the number of already imported records
+                       is stored after each batch. If present, that many records are skipped
+                       at the start, so that an interrupted import may be resumed. The value is
+                       removed once the import finishes.
+    """
     stats = Counter()
     existing_ssids = set(source.datarecord_set.all().values_list('ssid', flat=True).distinct())
-    i = 0
-    for record in reader:
-        defaults = {
-            'isbn13': record.isbn or '',
-            'title': record.title or '',
-            'doi': record.doi or '',
-            'other_ids': record.identifiers or {},
-            'extracted_data': {},
-        }
-
-        record_obj, created = DataRecord.objects.update_or_create(
-            ssid=record.ssid, timestamp=record.timestamp, source=source, defaults=defaults
-        )
-        if created:
-            if record.ssid in existing_ssids:
-                stats['new version created'] += 1
-            else:
-                stats['new ssid created'] += 1
-        else:
-            stats['existing record updated'] += 1
-            record_obj.raw_data.delete()
-
-        RawDataRecord.objects.create(
-            record=record_obj, data=record.raw_data, fmt=record.raw_data_format.value
+    done = 0
+    if checkpoint:
+        done = (
+            SingletonValue.objects.filter(key=checkpoint).values_list('integer', flat=True).first()
+            or 0
         )
+        if done:
+            logger.info('Resuming import after %d records from checkpoint %s', done, checkpoint)
+            for _record in islice(reader, done):
+                pass
+    i = done
+    batch = []
+    for record in reader:
+        batch.append(record)
         if watcher:
             watcher(i)
         i += 1
+        if len(batch) >= batch_size:
+            _write_batch(batch, source, existing_ssids, stats, checkpoint, i)
+            batch = []
+    if batch:
+        _write_batch(batch, source, existing_ssids, stats, checkpoint, i)
+    if checkpoint:
+        SingletonValue.objects.filter(key=checkpoint).delete()
     return stats
+
+
+@atomic
+def _write_batch(
+    records: List[ImporterRecord],
+    source: DataSource,
+    existing_ssids: set,
+    stats: Counter,
+    checkpoint: Optional[str],
+    done: int,
+) -> None:
+    # the last occurrence of the same record wins, as it would with one record at a time
+    key_to_record = {}
+    for record in records:
+        key = (record.ssid, _aware(record.timestamp))
+        if key in key_to_record:
+            stats['existing record updated'] += 1
+        key_to_record[key] = record
+    key_to_pk = {
+        (ssid, timestamp): pk
+        for pk, ssid, timestamp in DataRecord.objects.filter(
+            source=source, ssid__in={ssid for ssid, _ts in key_to_record}
+        ).values_list('pk', 'ssid', 'timestamp')
+    }
+    # records from one message share the header, so there are just a few of them in a batch
+    headers = {}
+    for record in key_to_record.values():
+        key = (record.message_tag, record.header)
+        if record.header is not None and key not in headers:
+            headers[key] = get_message_header(source, record.message_tag, record.header)
+    now = timezone.now()
+    to_create = []
+    to_update = []
+    for (ssid, timestamp), record in key_to_record.items():
+        record_obj = DataRecord(
+            pk=key_to_pk.get((ssid, timestamp)),
+            source=source,
+            header_id=headers.get((record.message_tag, record.header)),
+            ssid=ssid,
+            timestamp=timestamp,
+            isbn13=record.isbn or '',
+            title=record.title or '',
+            doi=record.doi or '',
+            other_ids=record.identifiers or {},
+            extracted_data={},
+            last_updated=now,
+        )
+        if record_obj.pk:
+            to_update.append((record_obj, record))
+            stats['existing record updated'] += 1
+        else:
+            to_create.append((record_obj, record))
+            if ssid in existing_ssids:
+                stats['new version created'] += 1
+            else:
+                stats['new ssid created'] += 1
+                existing_ssids.add(ssid)
+    DataRecord.objects.bulk_update([obj for obj, _rec in to_update], DATA_RECORD_UPDATE_FIELDS)
+    RawDataRecord.objects.filter(record_id__in=[obj.pk for obj, _rec in to_update]).delete()
+    DataRecord.objects.bulk_create([obj for obj, _rec in to_create])
+    compressor = RawDataCompressor.for_source(source)
+    RawDataRecord.objects.bulk_create(
+        [
+            compressor.compress(
+                RawDataRecord(record=record_obj, fmt=record.raw_data_format.value),
+                record.raw_data,
+            )
+            for record_obj, record in to_update + to_create
+        ]
+    )
+    if checkpoint:
+        SingletonValue.objects.update_or_create(key=checkpoint, defaults={'integer': done})
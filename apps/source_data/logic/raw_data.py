@@ -0,0 +1,50 @@
+"""
+Reading raw data of records and storage of message headers shared by records.
+"""
+
+import hashlib
+from functools import lru_cache
+from typing import Tuple
+
+from lxml import etree
+
+from ..models import DataRecord, DataSource, MessageHeader
+from .compression import raw_data_bytes
+
+
+def header_hash(message_tag: str, data: bytes) -> str:
+    return hashlib.md5(message_tag.encode('utf-8') + b'\0' + data).hexdigest()
+
+
+def get_message_header(source: DataSource, message_tag: str, data: bytes) -> int:
+    """
+    Returns pk of the stored header with `data`, creating it if necessary
+    """
+    header, _created = MessageHeader.objects.get_or_create(
+        source=source,
+        content_hash=header_hash(message_tag, data),
+        defaults={'message_tag': message_tag, 'data': data},
+    )
+    return header.pk
+
+
+@lru_cache(maxsize=64)
+def _header_data(header_id: int) -> Tuple[str, bytes]:
+    # headers are never changed, so it is safe to keep them around
+    header = MessageHeader.objects.get(pk=header_id)
+    return header.message_tag, bytes(header.data)
+
+
+def raw_document_bytes(record: DataRecord) -> bytes:
+    """
+    Returns the full document of the record - for records with a separately stored header,
+    the document is put together from the header and the record data.
+    """
+    data = raw_data_bytes(record.raw_data)
+    if record.header_id is None:
+        return data
+    message_tag, header = _header_data(record.header_id)
+    root = etree.Element(message_tag)
+    root.append(etree.fromstring(header))
+    root.append(etree.fromstring(data))
+    return etree.tostring(root, encoding='utf-8')
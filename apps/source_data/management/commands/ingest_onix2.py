@@ -4,8 +4,9 @@ from time import monotonic
 from django.core.management import CommandError
 from django.core.management.base import BaseCommand
 
+from core.models import SingletonValue
 from importers.onix import ImportOnix21Reference
-from source_data.logic.data_import import sync_data_with_source
+from source_data.logic.data_import import BATCH_SIZE, checkpoint_key, sync_data_with_source
 from source_data.models import DataSource
 
 logger = logging.getLogger(__name__)
@@ -23,6 +24,18 @@ class Command(BaseCommand):
         parser.add_argument('source', type=str)
         parser.add_argument('filename', type=str, nargs='+')
         parser.add_argument('-c', '--create-source', dest='create_source', action='store_true')
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Number of records written and committed at once',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the checkpoint of a previous interrupted import and start from scratch',
+        )
 
     def handle(self, *args, **options):
         source_name = options['source']
@@ -38,8 +51,17 @@ class Command(BaseCommand):
                     f'use one of the existing sources: {sources}'
                 )
         for fname in options['filename']:
-            reader = ImportOnix21Reference(fname)
-            stats = sync_data_with_source(reader, source, watcher=self.show_progress)
+            checkpoint = checkpoint_key(source, fname)
+            if options['restart']:
+                SingletonValue.objects.filter(key=checkpoint).delete()
+            reader = ImportOnix21Reference(fname, split_header=True)
+            stats = sync_data_with_source(
+                reader,
+                source,
+                watcher=self.show_progress,
+                batch_size=options['batch_size'],
+                checkpoint=checkpoint,
+            )
             self.stderr.write(f'\nStats: {stats}')
 
     def show_progress(self, count):
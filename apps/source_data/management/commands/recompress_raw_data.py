@@ -0,0 +1,77 @@
+import logging
+from collections import Counter
+from time import sleep
+
+from django.core.management import CommandError
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+
+from source_data.logic.compression import (
+    COMPRESSION_LEVEL,
+    RawDataCompressor,
+    latest_dictionary,
+    raw_data_bytes,
+    train_dictionary,
+)
+from source_data.models import DataSource, RawDataRecord
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Compresses raw data of a source using its newest compression dictionary. Records are '
+        'processed in small committed batches, so the command may run alongside other work '
+        'and be interrupted and restarted at any time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=str)
+        parser.add_argument(
+            '-t',
+            '--train',
+            action='store_true',
+            help='Train a new dictionary even if the source already has one',
+        )
+        parser.add_argument('-b', '--batch-size', type=int, default=500)
+        parser.add_argument('-l', '--level', type=int, default=COMPRESSION_LEVEL)
+        parser.add_argument(
+            '-p', '--pause', type=float, default=0, help='Seconds to sleep between batches'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            source = DataSource.objects.get(slug=options['source'])
+        except DataSource.DoesNotExist:
+            raise CommandError(f'No such source "{options["source"]}"')
+        dictionary = latest_dictionary(source)
+        if options['train'] or not dictionary:
+            dictionary = train_dictionary(source) or dictionary
+            if dictionary:
+                logger.info('Using new dictionary trained on %d records', dictionary.sample_count)
+        compressor = RawDataCompressor(dictionary, level=options['level'])
+        stats = Counter()
+        to_process = (
+            RawDataRecord.objects.filter(record__source=source)
+            .exclude(data__isnull=True)
+            .order_by('pk')
+        )
+        if dictionary:
+            to_process = to_process.exclude(dictionary=dictionary)
+        else:
+            to_process = to_process.exclude(compression=RawDataRecord.COMPRESSION_ZSTD)
+        last_pk = 0
+        while batch := list(to_process.filter(pk__gt=last_pk)[: options['batch_size']]):
+            with atomic():
+                for raw_data in batch:
+                    stats['size_before'] += len(raw_data.data)
+                    compressor.compress(raw_data, raw_data_bytes(raw_data))
+                    stats['size_after'] += len(raw_data.data)
+                RawDataRecord.objects.bulk_update(batch, ['data', 'compression', 'dictionary'])
+            stats['recompressed'] += len(batch)
+            last_pk = batch[-1].pk
+            logger.debug('Stats: %s', stats)
+            if options['pause']:
+                sleep(options['pause'])
+        logger.info('Stats: %s', stats)
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('source_data', '0002_json_field_migration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawdatarecord',
+            name='compression',
+            field=models.CharField(
+                blank=True, choices=[('', 'None'), ('zstd', 'Zstandard')], default='', max_length=8
+            ),
+        ),
+        migrations.CreateModel(
+            name='CompressionDictionary',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('data', models.BinaryField()),
+                (
+                    'sample_count',
+                    models.PositiveIntegerField(
+                        default=0, help_text='Number of records the dictionary was trained on'
+                    ),
+                ),
+                (
+                    'source',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='compression_dictionaries',
+                        to='source_data.datasource',
+                    ),
+                ),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='rawdatarecord',
+            name='dictionary',
+            field=models.ForeignKey(
+                blank=True,
+                help_text='Dictionary used for compression of `data`',
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to='source_data.compressiondictionary',
+            ),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('source_data', '0003_raw_data_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageHeader',
+            fields=[
+                (
+                    'id',
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name='ID'
+                    ),
+                ),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                (
+                    'message_tag',
+                    models.CharField(help_text='Tag of the root element', max_length=256),
+                ),
+                ('data', models.BinaryField()),
+                (
+                    'content_hash',
+                    models.CharField(help_text='Hash of `message_tag` and `data`', max_length=32),
+                ),
+                (
+                    'source',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to='source_data.datasource'
+                    ),
+                ),
+            ],
+            options={
+                'unique_together': {('source', 'content_hash')},
+            },
+        ),
+        migrations.AddField(
+            model_name='datarecord',
+            name='header',
+            field=models.ForeignKey(
+                blank=True,
+                help_text='If present, raw data contain only the record without the message header',
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name='records',
+                to='source_data.messageheader',
+            ),
+        ),
+    ]
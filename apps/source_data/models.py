@@ -38,9 +38,36 @@ class WorkIdentifierMixin(models.Model):
         abstract = True
 
 
+class MessageHeader(CreatedUpdatedMixin, models.Model):
+    """
+    Header of a message (e.g. ONIX file) shared by all records from the message. Records with
+    a header only store their own part of the message as raw data, the full document may be
+    reconstructed using `source_data.logic.raw_data.raw_document_bytes`.
+    """
+
+    source = models.ForeignKey(DataSource, on_delete=models.CASCADE)
+    message_tag = models.CharField(max_length=256, help_text='Tag of the root element')
+    data = models.BinaryField()
+    content_hash = models.CharField(max_length=32, help_text='Hash of `message_tag` and `data`')
+
+    class Meta:
+        unique_together = [('source', 'content_hash')]
+
+    def __str__(self):
+        return f'{self.source_id}/{self.content_hash}'
+
+
 class DataRecord(WorkIdentifierMixin, CreatedUpdatedMixin, models.Model):
 
     source = models.ForeignKey(DataSource, on_delete=models.CASCADE)
+    header = models.ForeignKey(
+        MessageHeader,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='records',
+        help_text='If present, raw data contain only the record without the message header',
+    )
     extracted_data = JSONField(
         default=dict, blank=True, help_text="Any data of interest extracted from raw data"
     )
@@ -55,6 +82,25 @@ class DataRecord(WorkIdentifierMixin, CreatedUpdatedMixin, models.Model):
         return f'{self.source_id}/{self.ssid}'
 
 
+class CompressionDictionary(CreatedUpdatedMixin, models.Model):
+    """
+    Zstandard dictionary trained on raw data of one source. Records from one source are very
+    similar (e.g. the ONIX header is repeated in each of them), so compression with such
+    a dictionary is much more efficient than compressing each record on its own.
+    """
+
+    source = models.ForeignKey(
+        DataSource, on_delete=models.CASCADE, related_name='compression_dictionaries'
+    )
+    data = models.BinaryField()
+    sample_count = models.PositiveIntegerField(
+        default=0, help_text='Number of records the dictionary was trained on'
+    )
+
+    def __str__(self):
+        return f'{self.source_id}/{self.pk}'
+
+
 class RawDataRecord(CreatedUpdatedMixin, models.Model):
     """
     Raw data records can become quite large which can adversely effect query performance
@@ -65,8 +111,26 @@ class RawDataRecord(CreatedUpdatedMixin, models.Model):
 
     FMT_CHOICES = ((fmt.value, fmt.value) for fmt in DataFormat)
 
+    COMPRESSION_NONE = ''
+    COMPRESSION_ZSTD = 'zstd'
+
+    COMPRESSION_CHOICES = (
+        (COMPRESSION_NONE, 'None'),
+        (COMPRESSION_ZSTD, 'Zstandard'),
+    )
+
     data = models.BinaryField(null=True)
     fmt = models.CharField(max_length=4, choices=FMT_CHOICES)
+    compression = models.CharField(
+        max_length=8, choices=COMPRESSION_CHOICES, default=COMPRESSION_NONE, blank=True
+    )
+    dictionary = models.ForeignKey(
+        CompressionDictionary,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        help_text='Dictionary used for compression of `data`',
+    )
     record = models.OneToOneField(DataRecord, on_delete=models.CASCADE, related_name='raw_data')
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
@@ -1,7 +1,13 @@
 import pytest
+import xmltodict
 from django.core.management import call_command
 
-from ..models import DataRecord, RawDataRecord
+from core.models import SingletonValue
+from importers.onix import ImportOnix21Reference
+from ..logic.compression import raw_data_bytes
+from ..logic.data_import import checkpoint_key
+from ..logic.raw_data import raw_document_bytes
+from ..models import DataRecord, MessageHeader, RawDataRecord
 
 
 @pytest.mark.django_db
@@ -28,3 +34,35 @@ class TestIngestOnix2:
         )
         assert DataRecord.objects.count() == 2
         assert DataRecord.objects.values('ssid').distinct().count() == 1, 'only one ssid'
+
+    def test_onix_resume(self, data_source, test_data_path):
+        path = test_data_path('onix_sample_1_book.xml')
+        SingletonValue.objects.create(key=checkpoint_key(data_source, path), integer=1)
+        call_command('ingest_onix2', data_source.slug, path)
+        assert DataRecord.objects.count() == 0, 'the only record was already imported'
+        call_command('ingest_onix2', data_source.slug, path)
+        assert DataRecord.objects.count() == 1, 'checkpoint was removed after the import'
+
+    def test_checkpoint_key_replaced_file(self, data_source, tmp_path):
+        path = tmp_path / 'feed.xml'
+        path.write_bytes(b'<ONIXMessage>1</ONIXMessage>')
+        key = checkpoint_key(data_source, path)
+        assert checkpoint_key(data_source, path) == key
+        path.write_bytes(b'<ONIXMessage>2</ONIXMessage>')
+        assert checkpoint_key(data_source, path) != key, 'same size, different content'
+
+    def test_onix_header_stored_once(self, data_source, test_data_path):
+        path = test_data_path('onix_sample_1_book.xml')
+        call_command('ingest_onix2', data_source.slug, path)
+        call_command(
+            'ingest_onix2', data_source.slug, test_data_path('onix_sample_1_book_updated.xml')
+        )
+        assert MessageHeader.objects.count() == 2
+        record = DataRecord.objects.order_by('timestamp').first()
+        assert record.header.message_tag == 'ONIXMessage'
+        assert b'<Header>' not in raw_data_bytes(record.raw_data)
+        full_record = next(ImportOnix21Reference(str(path)))
+        assert xmltodict.parse(raw_document_bytes(record)) == xmltodict.parse(full_record.raw_data)
+        # reimport of the same file reuses the header
+        call_command('ingest_onix2', data_source.slug, path)
+        assert MessageHeader.objects.count() == 2
@@ -0,0 +1,58 @@
+import pytest
+from django.core.management import call_command
+
+from importers.import_base import ImporterRecord
+from ..logic.compression import raw_data_bytes, train_dictionary
+from ..logic.data_import import sync_data_with_source
+from ..models import CompressionDictionary, DataRecord, RawDataRecord
+
+
+def onix_record(faker, ssid: str) -> ImporterRecord:
+    return ImporterRecord(
+        ssid=ssid,
+        raw_data=(
+            f'<ONIXMessage><Header><FromCompany>Distributor</FromCompany></Header><Product>'
+            f'<RecordReference>{ssid}</RecordReference><Title><TitleText>{faker.sentence()}'
+            f'</TitleText></Title><OtherText>{faker.text()}</OtherText></Product></ONIXMessage>'
+        ),
+    )
+
+
+@pytest.mark.django_db
+class TestRawDataCompression:
+    def test_compressed_on_import(self, data_source, faker):
+        records = [onix_record(faker, str(i)) for i in range(3)]
+        sync_data_with_source(iter(records), data_source)
+        for record in records:
+            raw_data = RawDataRecord.objects.get(record__ssid=record.ssid)
+            assert raw_data.compression == RawDataRecord.COMPRESSION_ZSTD
+            assert raw_data.dictionary is None
+            assert raw_data_bytes(raw_data) == record.raw_data.encode('utf-8')
+
+    def test_uncompressed_data(self, data_source):
+        record = DataRecord.objects.create(ssid='1', source=data_source)
+        raw_data = RawDataRecord.objects.create(record=record, data='<xml/>', fmt='XML')
+        raw_data.refresh_from_db()
+        assert raw_data_bytes(raw_data) == b'<xml/>'
+
+    def test_recompress(self, data_source, faker):
+        records = [onix_record(faker, str(i)) for i in range(500)]
+        sync_data_with_source(iter(records), data_source)
+        legacy = DataRecord.objects.create(ssid='legacy', source=data_source)
+        RawDataRecord.objects.create(record=legacy, data='<xml/>', fmt='XML')
+        size_before = sum(len(rec.data) for rec in RawDataRecord.objects.all())
+        call_command('recompress_raw_data', data_source.slug, batch_size=100)
+        dictionary = CompressionDictionary.objects.get()
+        assert not RawDataRecord.objects.exclude(dictionary=dictionary).exists()
+        assert sum(len(rec.data) for rec in RawDataRecord.objects.all()) < size_before
+        for record in records[:10]:
+            raw_data = RawDataRecord.objects.get(record__ssid=record.ssid)
+            assert raw_data_bytes(raw_data) == record.raw_data.encode('utf-8')
+        assert raw_data_bytes(legacy.raw_data) == b'<xml/>'
+        # new records are compressed using the dictionary
+        sync_data_with_source(iter([onix_record(faker, 'new')]), data_source)
+        assert RawDataRecord.objects.get(record__ssid='new').dictionary == dictionary
+
+    def test_train_dictionary_not_enough_data(self, data_source, faker):
+        sync_data_with_source(iter([onix_record(faker, '1')]), data_source)
+        assert train_dictionary(data_source) is None
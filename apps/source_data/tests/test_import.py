@@ -1,9 +1,12 @@
 import pytest
 from django.utils.timezone import now
 
+from core.models import SingletonValue
 from importers.import_base import ImporterRecord
-from ..models import DataRecord, RawDataRecord
+from ..models import DataRecord, MessageHeader, RawDataRecord
+from ..logic import data_import
 from ..logic.data_import import sync_data_with_source
+from ..logic.raw_data import get_message_header
 
 
 @pytest.mark.django_db
@@ -39,3 +42,49 @@ class TestImport:
         assert RawDataRecord.objects.count() == 4, '1 extra record for new timestamp'
         assert stats['new version created'] == 1
         assert stats['existing record updated'] == 2
+
+    def test_sync_data_with_source_batches(self, data_source, importer_records_n):
+        records = importer_records_n(7)
+        stats = sync_data_with_source(iter(records), data_source, batch_size=3)
+        assert DataRecord.objects.count() == 7
+        assert RawDataRecord.objects.count() == 7
+        assert stats['new ssid created'] == 7
+        stats = sync_data_with_source(iter(records), data_source, batch_size=3)
+        assert DataRecord.objects.count() == 7
+        assert RawDataRecord.objects.count() == 7
+        assert stats['existing record updated'] == 7
+
+    def test_sync_data_with_source_checkpoint(self, data_source, importer_records_n):
+        records = importer_records_n(5)
+
+        def failing_reader():
+            yield from records[:4]
+            raise ValueError('broken data')
+
+        with pytest.raises(ValueError):
+            sync_data_with_source(failing_reader(), data_source, batch_size=2, checkpoint='test')
+        assert DataRecord.objects.count() == 4, 'two full batches were committed'
+        assert SingletonValue.objects.get(key='test').integer == 4
+        stats = sync_data_with_source(iter(records), data_source, batch_size=2, checkpoint='test')
+        assert stats == {'new ssid created': 1}
+        assert DataRecord.objects.count() == 5
+        assert not SingletonValue.objects.filter(key='test').exists()
+
+    def test_sync_data_with_source_shared_header(
+        self, data_source, importer_records_n, monkeypatch
+    ):
+        records = importer_records_n(5)
+        for record in records:
+            record.message_tag = 'ONIXMessage'
+            record.header = b'<Header><Sender>Test</Sender></Header>'
+        calls = []
+
+        def counting_get_message_header(*args):
+            calls.append(args)
+            return get_message_header(*args)
+
+        monkeypatch.setattr(data_import, 'get_message_header', counting_get_message_header)
+        sync_data_with_source(iter(records), data_source, batch_size=10)
+        assert len(calls) == 1, 'the header is looked up once per batch'
+        assert MessageHeader.objects.count() == 1
+        assert DataRecord.objects.filter(header__isnull=False).count() == 5
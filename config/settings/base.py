@@ -242,6 +242,10 @@ CACHES = {
     }
 }
 CACHE_MIDDLEWARE_SECONDS = 24 * 60 * 60
+# cached analytics responses are invalidated by changes in data, the timeout only serves to
+# remove responses for outdated data from the cache
+ANALYTICS_CACHE_ENABLED = config('ANALYTICS_CACHE_ENABLED', cast=bool, default=True)
+ANALYTICS_CACHE_TIMEOUT = 7 * 24 * 60 * 60
 
 # logging
 